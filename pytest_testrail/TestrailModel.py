@@ -1,5 +1,7 @@
 from dataclasses import dataclass, field
 
+from pytest_testrail.vars import RESULTS_CHUNK_SIZE_LIMIT
+
 
 @dataclass
 class TestRailModel:
@@ -10,7 +12,7 @@ class TestRailModel:
     cert_check: bool = False
     client: any = None
     project_id: int = None
-    results: list = None
+    results: any = None
     suite_id: int = None
     include_all: bool = None
     testrun_name: str = None
@@ -20,9 +22,11 @@ class TestRailModel:
     testplan_id: int = None
     testplan_name: int = None
     testplan_description: str = None
+    testplan_single_request: bool = False
     version: str = None
     close_on_complete: bool = None
     publish_blocked: bool = None
+    coalesce: str = None
     skip_missing: bool = None
     milestone_id: int = None
     custom_comment: str = None
@@ -30,9 +34,30 @@ class TestRailModel:
     tr_keys: list = None
     actual_suites_with_case_ids: dict = None
     plan_entry_storage: dict = None
+    run_case_statuses: dict = None
     diff_case_ids: list = None
+    case_catalog: any = None
+    item_index: dict = None
     available_suite_ids: dict = None
-    test_comments: list = field(default_factory=[])
+    fetch_concurrency: int = 1
+    create_concurrency: int = 1
+    catalog_cache: any = None
+    journal: any = None
+    metrics: any = None
+    read_cache: any = None
+    stream_results: bool = False
+    stream_batch_size: int = 250
+    stream_flush_interval: float = 30.0
+    stream_queue_size: int = 1000
+    publish_on_controller: bool = False
+    chunk_bytes: int = RESULTS_CHUNK_SIZE_LIMIT
+    chunk_max_results: int = None
+    worker_results: any = None
+    worker_result_keys: set = None
+    catalog: dict = None
+    run_info: dict = None
+    entries_file: str = None
+    test_comments: list = field(default_factory=list)
 
 
 @dataclass()
@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+from array import array
+
+
+class CaseCatalog:
+    def __init__(self, case_ids_by_suite=None):
+        """
+        Index of TestRail case ids by suite, with constant time lookups.
+
+        Each case is mapped to the position of its suite in a compact integer array, so the map only holds one
+        small shared integer per case whatever the suite ids are. Case ids of each suite are also kept as a set,
+        and pytest items can be attached to the case ids they cover.
+
+        :param dict case_ids_by_suite: (optional) suite id -> iterable of case ids.
+        """
+        self._suite_ids = array('q')
+        self._suite_position = {}
+        self._suite_of_case = {}
+        self._cases_by_suite = {}
+        self._items_by_case = {}
+        for suite_id, case_ids in (case_ids_by_suite or {}).items():
+            self.add_suite(suite_id, case_ids)
+
+    def __contains__(self, case_id):
+        return case_id in self._suite_of_case
+
+    def __len__(self):
+        return len(self._suite_of_case)
+
+    @property
+    def suite_ids(self):
+        """ :return list: suite ids in insertion order. """
+        return self._suite_ids.tolist()
+
+    def add_suite(self, suite_id, case_ids):
+        """ Add the case ids of a suite to the catalog. """
+        suite_id = int(suite_id)
+        position = self._suite_position.get(suite_id)
+        if position is None:
+            position = self._suite_position[suite_id] = len(self._suite_ids)
+            self._suite_ids.append(suite_id)
+            self._cases_by_suite[suite_id] = frozenset()
+        case_ids = frozenset(case_ids)
+        for case_id in case_ids:
+            self._suite_of_case[case_id] = position
+        self._cases_by_suite[suite_id] = self._cases_by_suite[suite_id] | case_ids
+
+    def suite_of(self, case_id, default=0):
+        """ :return: id of the suite containing a case, or `default` if the case is unknown. """
+        position = self._suite_of_case.get(case_id)
+        return default if position is None else self._suite_ids[position]
+
+    def case_ids(self, suite_id):
+        """ :return frozenset: case ids of a suite. """
+        return self._cases_by_suite.get(int(suite_id), frozenset())
+
+    def add_item(self, case_id, item):
+        """ Attach a pytest item to a case id. """
+        self._items_by_case.setdefault(case_id, []).append(item)
+
+    def items_of(self, case_id):
+        """ :return list: pytest items attached to a case id. """
+        return self._items_by_case.get(case_id, [])
@@ -0,0 +1,173 @@
+# -*- coding: UTF-8 -*-
+import sqlite3
+import threading
+import time
+
+# Seconds subtracted from the last refresh time when asking TestRail for updated cases, so that a clock skew
+# between the local host and the TestRail server can not hide a change.
+CLOCK_SKEW = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS suites (
+    tr_url TEXT NOT NULL,
+    project_id INTEGER NOT NULL,
+    suite_id INTEGER NOT NULL,
+    name TEXT,
+    PRIMARY KEY (tr_url, project_id, suite_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS projects (
+    tr_url TEXT NOT NULL,
+    project_id INTEGER NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    PRIMARY KEY (tr_url, project_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalogs (
+    tr_url TEXT NOT NULL,
+    project_id INTEGER NOT NULL,
+    suite_id INTEGER NOT NULL,
+    full_refresh_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (tr_url, project_id, suite_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cases (
+    tr_url TEXT NOT NULL,
+    project_id INTEGER NOT NULL,
+    suite_id INTEGER NOT NULL,
+    case_id INTEGER NOT NULL,
+    PRIMARY KEY (tr_url, project_id, suite_id, case_id)
+) WITHOUT ROWID;
+"""
+
+
+class CatalogCache:
+    def __init__(self, path, tr_url, ttl=86400, max_cases=1000000):
+        """
+        Persistent cache of the TestRail suites and case ids, stored in a SQLite database.
+
+        Entries are keyed by TestRail URL, project and suite. A suite catalog older than `ttl` is downloaded again
+        entirely, a younger one is refreshed with the cases updated since its last refresh. When more than
+        `max_cases` case ids are stored, the least recently used suite catalogs are evicted.
+
+        :param path: path of the SQLite database file.
+        :param tr_url: TestRail address, part of the key of every entry.
+        :param ttl: maximum age in seconds of a catalog before a full refresh.
+        :param max_cases: maximum number of case ids kept in the cache.
+        """
+        self.tr_url = tr_url or ''
+        self.ttl = int(ttl)
+        self.max_cases = int(max_cases)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _is_fresh(self, fetched_at, now=None):
+        return fetched_at is not None and (now or time.time()) - fetched_at < self.ttl
+
+    def get_suites(self, project_id):
+        """
+        :return: dict of suite id -> name for a project, or None if missing or older than the TTL.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT fetched_at FROM projects WHERE tr_url = ? AND project_id = ?',
+                                   (self.tr_url, project_id)).fetchone()
+            if row is None or not self._is_fresh(row[0]):
+                return None
+            rows = self._db.execute('SELECT suite_id, name FROM suites WHERE tr_url = ? AND project_id = ? '
+                                    'ORDER BY suite_id', (self.tr_url, project_id))
+            return dict(rows.fetchall())
+
+    def store_suites(self, project_id, suites, fetched_at=None):
+        """
+        Replace the cached suite list of a project.
+
+        :param suites: dict of suite id -> name.
+        """
+        with self._lock, self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.execute('DELETE FROM suites WHERE tr_url = ? AND project_id = ?', (self.tr_url, project_id))
+            self._db.executemany('INSERT INTO suites VALUES (?, ?, ?, ?)',
+                                 [(self.tr_url, project_id, suite_id, name) for suite_id, name in suites.items()])
+            self._db.execute('INSERT OR REPLACE INTO projects VALUES (?, ?, ?)',
+                             (self.tr_url, project_id, int(fetched_at or time.time())))
+
+    def get_case_ids(self, project_id, suite_id):
+        """
+        :return: tuple (list of case ids, time of last refresh) of a suite, or None if missing or older than the TTL.
+        """
+        now = int(time.time())
+        key = (self.tr_url, project_id, suite_id)
+        with self._lock:
+            row = self._db.execute('SELECT full_refresh_at, updated_at FROM catalogs '
+                                   'WHERE tr_url = ? AND project_id = ? AND suite_id = ?', key).fetchone()
+            if row is None or not self._is_fresh(row[0], now):
+                return None
+            self._db.execute('UPDATE catalogs SET used_at = ? WHERE tr_url = ? AND project_id = ? AND suite_id = ?',
+                             (time.time(),) + key)
+            rows = self._db.execute('SELECT case_id FROM cases WHERE tr_url = ? AND project_id = ? AND suite_id = ? '
+                                    'ORDER BY case_id', key)
+            return [case_id for case_id, in rows], row[1]
+
+    def store_case_ids(self, project_id, suite_id, case_ids, fetched_at=None):
+        """
+        Replace the cached catalog of a suite after a full download.
+        """
+        fetched_at = int(fetched_at or time.time())
+        key = (self.tr_url, project_id, suite_id)
+        with self._lock, self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.execute('DELETE FROM cases WHERE tr_url = ? AND project_id = ? AND suite_id = ?', key)
+            self._db.executemany('INSERT OR IGNORE INTO cases VALUES (?, ?, ?, ?)',
+                                 [key + (case_id,) for case_id in case_ids])
+            self._db.execute('INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?, ?, ?, ?)',
+                             key + (fetched_at, fetched_at, time.time()))
+            self._evict(keep=key)
+
+    def apply_delta(self, project_id, suite_id, changed_cases, fetched_at=None):
+        """
+        Update the cached catalog of a suite with the cases updated since its last refresh.
+
+        Cases flagged as deleted or moved to another suite are removed, the others are added.
+
+        :param changed_cases: cases as returned by `get_cases` with the `updated_after` filter.
+        :return: the updated list of case ids.
+        """
+        key = (self.tr_url, project_id, suite_id)
+        removed, added = [], []
+        for case in changed_cases:
+            moved = case.get('suite_id') is not None and int(case['suite_id']) != int(suite_id)
+            (removed if case.get('is_deleted') or moved else added).append(key + (case['id'],))
+        with self._lock, self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.executemany('DELETE FROM cases WHERE tr_url = ? AND project_id = ? AND suite_id = ? '
+                                 'AND case_id = ?', removed)
+            self._db.executemany('INSERT OR IGNORE INTO cases VALUES (?, ?, ?, ?)', added)
+            self._db.execute('UPDATE catalogs SET updated_at = ? WHERE tr_url = ? AND project_id = ? AND suite_id = ?',
+                             (int(fetched_at or time.time()),) + key)
+            self._evict(keep=key)
+            rows = self._db.execute('SELECT case_id FROM cases WHERE tr_url = ? AND project_id = ? AND suite_id = ? '
+                                    'ORDER BY case_id', key)
+            return [case_id for case_id, in rows]
+
+    def _evict(self, keep):
+        """ Drop least recently used suite catalogs, except `keep`, until at most `max_cases` case ids are stored. """
+        total, = self._db.execute('SELECT COUNT(*) FROM cases').fetchone()
+        if total <= self.max_cases:
+            return
+        catalogs = self._db.execute('SELECT c.tr_url, c.project_id, c.suite_id, COUNT(cases.case_id) '
+                                    'FROM catalogs c LEFT JOIN cases USING (tr_url, project_id, suite_id) '
+                                    'GROUP BY c.tr_url, c.project_id, c.suite_id ORDER BY c.used_at').fetchall()
+        for tr_url, project_id, suite_id, count in catalogs:
+            if total <= self.max_cases:
+                break
+            key = (tr_url, project_id, suite_id)
+            if key == keep:
+                continue
+            self._db.execute('DELETE FROM cases WHERE tr_url = ? AND project_id = ? AND suite_id = ?', key)
+            self._db.execute('DELETE FROM catalogs WHERE tr_url = ? AND project_id = ? AND suite_id = ?', key)
+            total -= count
@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+"""
+Coalescing of the results of a testcase published several times in a testrun, by reruns of a failed test or by the
+parametrized tests mapped to the same case.
+"""
+from pytest_testrail.results import ResultRecord
+from pytest_testrail.vars import TESTRAIL_TEST_STATUS, COALESCE_POLICIES
+
+# Rank of the statuses, the worst one is the highest. Custom statuses rank below "failed".
+STATUS_SEVERITY = {
+    TESTRAIL_TEST_STATUS['passed']: 0,
+    TESTRAIL_TEST_STATUS['untested']: 1,
+    TESTRAIL_TEST_STATUS['retest']: 2,
+    TESTRAIL_TEST_STATUS['blocked']: 3,
+    TESTRAIL_TEST_STATUS['failed']: 5,
+}
+STATUS_NAMES = {status_id: name for name, status_id in TESTRAIL_TEST_STATUS.items()}
+
+
+def status_severity(status_id):
+    return STATUS_SEVERITY.get(status_id, 4)
+
+
+def journal_seqs(results):
+    """ :return: generator of the sequence numbers in the journal of results, coalesced ones included. """
+    for result in results:
+        seq = result.get('journal_seq')
+        if isinstance(seq, (tuple, list)):
+            yield from seq
+        elif seq is not None:
+            yield seq
+
+
+def coalesce_results(results, policy):
+    """
+    Keep one result per testcase.
+
+    - `worst`: the result with the worst status, the last one of the results with the same status,
+    - `last`: the last result,
+    - `aggregate`: a result with the worst status and comment, the sum of the durations and the defects of all the
+      results, and a summary of the outcome of each result in place of the parameters.
+
+    A result standing for several results holds the tuple of their sequence numbers in the journal.
+
+    The results are read twice: first to count the results of each testcase, then to coalesce them while holding in
+    memory only the results of the testcases whose last result is not read yet. So a `ResultStore` spilled to disk
+    is not loaded at once. An iterator is read into a list.
+
+    :param results: iterable of results, in the order they were recorded.
+    :param policy: one of `COALESCE_POLICIES`.
+    :return: generator of results, in the order of the last result of each testcase.
+    """
+    if policy not in COALESCE_POLICIES:
+        raise ValueError('Unknown coalescing policy "{}", expected one of: {}'.format(
+            policy, ', '.join(COALESCE_POLICIES)))
+    if iter(results) is results:
+        results = list(results)
+    counts = {}
+    for result in results:
+        counts[result['case_id']] = counts.get(result['case_id'], 0) + 1
+    return _coalesce(results, counts, policy)
+
+
+def _coalesce(results, counts, policy):
+    groups = {}
+    for result in results:
+        case_id = result['case_id']
+        if counts[case_id] == 1:
+            yield result
+            continue
+        group = groups.setdefault(case_id, [])
+        group.append(result)
+        if len(group) == counts[case_id]:
+            del groups[case_id]
+            yield _coalesce_group(group, policy)
+
+
+def _coalesce_group(group, policy):
+    worst = group[0]
+    for result in group[1:]:
+        if status_severity(result['status_id']) >= status_severity(worst['status_id']):
+            worst = result
+    if policy == 'aggregate':
+        return _aggregate(group, worst)
+    kept = worst if policy == 'worst' else group[-1]
+    kept['journal_seq'] = tuple(journal_seqs(group)) or None
+    return kept
+
+
+def _aggregate(group, worst):
+    durations = [result.get('duration') or 0 for result in group]
+    lines = ['{} results: {}'.format(len(group), ', '.join(
+        '{} {}'.format(count, name) for name, count in _count_statuses(group)))]
+    for attempt, (result, duration) in enumerate(zip(group, durations), 1):
+        lines.append('{}: {} ({:.2f}s)'.format(
+            _status_name(result['status_id']), result.get('test_parametrize') or 'attempt {}'.format(attempt),
+            duration))
+    defects = []
+    test_comments = []
+    for result in group:
+        for defect in (result.get('defects') or '').split(','):
+            if defect.strip() and defect.strip() not in defects:
+                defects.append(defect.strip())
+        for test_comment in result.get('test_comments') or ():
+            if test_comment not in test_comments:
+                test_comments.append(test_comment)
+    return ResultRecord(worst['case_id'], worst['status_id'], worst.get('comment'), sum(durations),
+                        ', '.join(defects) or None, '\n'.join(lines), worst.get('suite_id', 0), test_comments,
+                        run_id=worst.get('run_id'), journal_seq=tuple(journal_seqs(group)) or None)
+
+
+def _status_name(status_id):
+    return STATUS_NAMES.get(status_id, 'status {}'.format(status_id))
+
+
+def _count_statuses(group):
+    counts = {}
+    for result in group:
+        name = _status_name(result['status_id'])
+        counts[name] = counts.get(name, 0) + 1
+    return counts.items()
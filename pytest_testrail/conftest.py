@@ -1,8 +1,10 @@
 # -*- coding: UTF-8 -*-
 import os
 import sys
-from .plugin import PyTestRailPlugin
-from .testrail_api import APIClient
+
+import pytest
+
+from .vars import COALESCE_POLICIES, RESULTS_CHUNK_SIZE_LIMIT, RESULTS_SPILL_THRESHOLD
 
 if sys.version_info.major == 2:
     # python2
@@ -19,6 +21,58 @@ class Messages:
     TR_EMAIL = 'Email for the account on the TestRail server (config file: email in API section)'
     TR_PASSWORD = 'Password for the account on the TestRail server (config file: password in API section)'
     TR_TIMEOUT = 'Set timeout for connecting to TestRail server'
+    TR_CONNECT_TIMEOUT = 'Set timeout for establishing a connection to TestRail server. If provided, "--tr-timeout" ' \
+                         'is used as read timeout (config file: connect_timeout in API section)'
+    TR_POOL_SIZE = 'Maximum number of persistent connections kept open to TestRail server (config file: pool_size ' \
+                   'in API section)'
+    TR_FETCH_CONCURRENCY = 'Maximum number of test suites whose cases are fetched from TestRail in parallel ' \
+                           '(config file: fetch_concurrency in API section, defaults to 4)'
+    TR_CREATE_CONCURRENCY = 'Maximum number of testruns or testplan entries created in TestRail in parallel, one per ' \
+                            'suite (config file: create_concurrency in API section, defaults to 4)'
+    TR_CATALOG_CACHE = 'Keep suites and case ids of TestRail in the pytest cache directory and only download the ' \
+                       'cases updated since the previous session'
+    TR_CATALOG_CACHE_TTL = 'Maximum age in seconds of a cached suite catalog before it is downloaded again entirely ' \
+                           '(defaults to 86400)'
+    TR_CATALOG_CACHE_MAX_CASES = 'Maximum number of case ids kept in the catalog cache, least recently used suites ' \
+                                 'are evicted first (defaults to 1000000)'
+    TR_STREAM_RESULTS = 'Publish results in background while tests are running instead of at the end of the session'
+    TR_STREAM_BATCH_SIZE = 'Number of pending results triggering a publication in streaming mode (defaults to 250)'
+    TR_STREAM_FLUSH_INTERVAL = 'Maximum number of seconds a result waits before being published in streaming mode ' \
+                               '(defaults to 30)'
+    TR_STREAM_QUEUE_SIZE = 'Maximum number of results waiting for the background publisher, tests wait when it is ' \
+                           'reached (defaults to 1000)'
+    TR_XDIST_PUBLISH_ON_CONTROLLER = 'With pytest-xdist, send results of the workers to the controller which ' \
+                                     'publishes them all at the end of the session'
+    TR_NO_KEEP_ALIVE = 'Do not reuse connections to TestRail server between requests'
+    TR_MAX_RETRIES = 'Maximum number of retries of a request failing because of a transient error (config file: ' \
+                     'max_retries in API section, defaults to 4)'
+    TR_RETRY_BACKOFF = 'Base delay in seconds of the exponential backoff between retries (config file: retry_backoff ' \
+                       'in API section, defaults to 1)'
+    TR_RETRY_DEADLINE = 'Maximum time in seconds spent on a request, retries included (config file: retry_deadline ' \
+                        'in API section, defaults to 300)'
+    TR_RATE_LIMIT = 'Maximum number of requests per minute sent to TestRail server, requests are delayed to stay ' \
+                    'under it (config file: rate_limit in API section)'
+    TR_RATE_LIMIT_FILE = 'File sharing the rate limit between the processes of this host (config file: ' \
+                         'rate_limit_file in API section, defaults to a file of the temporary directory specific to ' \
+                         'the user and the TestRail address)'
+    TR_JOURNAL = 'Append results to this journal file before publishing them, so that the results not accepted by ' \
+                 'TestRail can be published later with pytest-testrail-replay (config file: journal in TESTRUN ' \
+                 'section)'
+    TR_METRICS = 'Show the count, size, status and duration of the requests sent to TestRail, by endpoint, and the time ' \
+                 'spent in the hooks of the plugin, and the hits of the cache of the plan, run and suite lookups'
+    TR_METRICS_FILE = 'Write the measures of --tr-metrics to this file, as JSON if its name ends with .json, in the ' \
+                      'OpenMetrics text format otherwise. Implies --tr-metrics'
+    TR_CHUNK_BYTES = 'Maximum size in bytes of the body of a request publishing results (config file: chunk_bytes in ' \
+                     'API section, defaults to 524288)'
+    TR_CHUNK_MAX_RESULTS = 'Maximum number of results published by a single request (config file: chunk_max_results ' \
+                           'in API section)'
+    TR_COALESCE = 'Publish a single result per testcase of a testrun, in place of the results of its reruns and of ' \
+                  'the parametrized tests mapped to it: "worst" keeps the result with the worst status, "last" the ' \
+                  'last result, "aggregate" sums their durations and lists their outcomes (config file: coalesce ' \
+                  'in TESTRUN section). With --tr-stream-results, results are coalesced within each batch'
+    TR_SPILL_THRESHOLD = 'Number of results kept in memory until they are published, the next ones are written to a ' \
+                         'temporary file (config file: spill_threshold in TESTRUN section, defaults to 20000, 0 ' \
+                         'keeps all the results in memory)'
     TR_TESTRUN_ASSIGNED_TO = 'ID of the user assigned to the test run (config file: assignedto_id in TESTRUN section)'
     TR_TESTRUN_PROJECT_ID = 'ID of the project the test run is in (config file: project_id in TESTRUN section)'
     TR_TESTRUN_SUITE_ID = 'ID of the test suite containing the test cases (config file: suite_id in TESTRUN section)'
@@ -29,6 +83,10 @@ class Messages:
     TR_TEST_PLAN_ID = 'Identifier of testplan, that appears in TestRail (config file: plan_id in TESTRUN section). If provided, option "--tr-testrun-name" will be ignored'
     TR_TEST_PLAN_NAME = 'Name given to testplan, that appears in TestRail (config file: name in TESTRUN section)'
     TR_TEST_PLAN_DESCRIPTION = 'Description given to testplan, that appears in TestRail (config file: name in TESTRUN section)'
+    TR_TESTPLAN_SINGLE_REQUEST = 'Create the testplan of --tr-testplan-name once the tests are collected, along with ' \
+                                 'all its entries in a single request, instead of creating the testplan at the start ' \
+                                 'of the session and then each entry in its own request (config file: ' \
+                                 'testplan_single_request in TESTRUN section)'
     TR_TEST_PLAN_DESCRIPTION_DEFAULT = 'Test Plan was created via AutoTest'
     TR_VERSION = 'Indicate a version in Test Case result'
     TR_NO_SSL_CHECK = 'Do not check for valid SSL certificate on TestRail host'
@@ -59,6 +117,83 @@ def pytest_addoption(parser):
     group.addoption('--tr-timeout', action='store', help=Messages.TR_TIMEOUT)
     parser.addini('tr-timeout', help=Messages.TR_TIMEOUT, default=None)
 
+    group.addoption('--tr-connect-timeout', action='store', help=Messages.TR_CONNECT_TIMEOUT)
+    parser.addini('tr-connect-timeout', help=Messages.TR_CONNECT_TIMEOUT, default=None)
+
+    group.addoption('--tr-pool-size', action='store', help=Messages.TR_POOL_SIZE)
+    parser.addini('tr-pool-size', help=Messages.TR_POOL_SIZE, default=None)
+
+    group.addoption('--tr-fetch-concurrency', action='store', help=Messages.TR_FETCH_CONCURRENCY)
+    parser.addini('tr-fetch-concurrency', help=Messages.TR_FETCH_CONCURRENCY, default=None)
+
+    group.addoption('--tr-create-concurrency', action='store', help=Messages.TR_CREATE_CONCURRENCY)
+    parser.addini('tr-create-concurrency', help=Messages.TR_CREATE_CONCURRENCY, default=None)
+
+    group.addoption('--tr-catalog-cache', action='store_true', default=None, help=Messages.TR_CATALOG_CACHE)
+    parser.addini('tr-catalog-cache', help=Messages.TR_CATALOG_CACHE, type='bool', default=None)
+
+    group.addoption('--tr-catalog-cache-ttl', action='store', help=Messages.TR_CATALOG_CACHE_TTL)
+    parser.addini('tr-catalog-cache-ttl', help=Messages.TR_CATALOG_CACHE_TTL, default=None)
+
+    group.addoption('--tr-catalog-cache-max-cases', action='store', help=Messages.TR_CATALOG_CACHE_MAX_CASES)
+    parser.addini('tr-catalog-cache-max-cases', help=Messages.TR_CATALOG_CACHE_MAX_CASES, default=None)
+
+    group.addoption('--tr-stream-results', action='store_true', default=None, help=Messages.TR_STREAM_RESULTS)
+    parser.addini('tr-stream-results', help=Messages.TR_STREAM_RESULTS, type='bool', default=None)
+
+    group.addoption('--tr-stream-batch-size', action='store', help=Messages.TR_STREAM_BATCH_SIZE)
+    parser.addini('tr-stream-batch-size', help=Messages.TR_STREAM_BATCH_SIZE, default=None)
+
+    group.addoption('--tr-stream-flush-interval', action='store', help=Messages.TR_STREAM_FLUSH_INTERVAL)
+    parser.addini('tr-stream-flush-interval', help=Messages.TR_STREAM_FLUSH_INTERVAL, default=None)
+
+    group.addoption('--tr-stream-queue-size', action='store', help=Messages.TR_STREAM_QUEUE_SIZE)
+    parser.addini('tr-stream-queue-size', help=Messages.TR_STREAM_QUEUE_SIZE, default=None)
+
+    group.addoption('--tr-xdist-publish-on-controller', action='store_true', default=None,
+                    help=Messages.TR_XDIST_PUBLISH_ON_CONTROLLER)
+    parser.addini('tr-xdist-publish-on-controller', help=Messages.TR_XDIST_PUBLISH_ON_CONTROLLER, type='bool',
+                  default=None)
+
+    group.addoption('--tr-no-keep-alive', action='store_true', default=None, help=Messages.TR_NO_KEEP_ALIVE)
+    parser.addini('tr-no-keep-alive', help=Messages.TR_NO_KEEP_ALIVE, type='bool', default=None)
+
+    group.addoption('--tr-max-retries', action='store', help=Messages.TR_MAX_RETRIES)
+    parser.addini('tr-max-retries', help=Messages.TR_MAX_RETRIES, default=None)
+
+    group.addoption('--tr-retry-backoff', action='store', help=Messages.TR_RETRY_BACKOFF)
+    parser.addini('tr-retry-backoff', help=Messages.TR_RETRY_BACKOFF, default=None)
+
+    group.addoption('--tr-retry-deadline', action='store', help=Messages.TR_RETRY_DEADLINE)
+    parser.addini('tr-retry-deadline', help=Messages.TR_RETRY_DEADLINE, default=None)
+
+    group.addoption('--tr-rate-limit', action='store', help=Messages.TR_RATE_LIMIT)
+    parser.addini('tr-rate-limit', help=Messages.TR_RATE_LIMIT, default=None)
+
+    group.addoption('--tr-rate-limit-file', action='store', help=Messages.TR_RATE_LIMIT_FILE)
+    parser.addini('tr-rate-limit-file', help=Messages.TR_RATE_LIMIT_FILE, default=None)
+
+    group.addoption('--tr-journal', action='store', help=Messages.TR_JOURNAL)
+    parser.addini('tr-journal', help=Messages.TR_JOURNAL, default=None)
+
+    group.addoption('--tr-metrics', action='store_true', default=None, help=Messages.TR_METRICS)
+    parser.addini('tr-metrics', help=Messages.TR_METRICS, type='bool', default=None)
+
+    group.addoption('--tr-metrics-file', action='store', help=Messages.TR_METRICS_FILE)
+    parser.addini('tr-metrics-file', help=Messages.TR_METRICS_FILE, default=None)
+
+    group.addoption('--tr-chunk-bytes', action='store', help=Messages.TR_CHUNK_BYTES)
+    parser.addini('tr-chunk-bytes', help=Messages.TR_CHUNK_BYTES, default=None)
+
+    group.addoption('--tr-chunk-max-results', action='store', help=Messages.TR_CHUNK_MAX_RESULTS)
+    parser.addini('tr-chunk-max-results', help=Messages.TR_CHUNK_MAX_RESULTS, default=None)
+
+    group.addoption('--tr-coalesce', action='store', choices=COALESCE_POLICIES, help=Messages.TR_COALESCE)
+    parser.addini('tr-coalesce', help=Messages.TR_COALESCE, default=None)
+
+    group.addoption('--tr-spill-threshold', action='store', help=Messages.TR_SPILL_THRESHOLD)
+    parser.addini('tr-spill-threshold', help=Messages.TR_SPILL_THRESHOLD, default=None)
+
     group.addoption('--tr-testrun-assignedto-id', action='store', help=Messages.TR_TESTRUN_ASSIGNED_TO)
     parser.addini('tr-testrun-assignedto-id', help=Messages.TR_TESTRUN_ASSIGNED_TO, default=None)
 
@@ -88,6 +223,10 @@ def pytest_addoption(parser):
     group.addoption('--tr-testplan-name', action='store', default=None, help=Messages.TR_TEST_PLAN_NAME)
     parser.addini('tr-testplan-name', help=Messages.TR_TEST_PLAN_NAME, default=None)
 
+    group.addoption('--tr-testplan-single-request', action='store_true', default=None,
+                    help=Messages.TR_TESTPLAN_SINGLE_REQUEST)
+    parser.addini('tr-testplan-single-request', help=Messages.TR_TESTPLAN_SINGLE_REQUEST, type='bool', default=None)
+
     group.addoption(
         '--tr-testplan-description',
         action='store',
@@ -134,12 +273,60 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "testrail_suites: mark for test suite (example: @pytestrail.suite('S11111'))")
 
     if config.getoption('--testrail'):
+        # Loaded only when enabled: this module is loaded by every pytest process where the package is installed
+        from .plugin import PyTestRailPlugin
+        from .testrail_api import APIClient
+        from .catalog_cache import CatalogCache
+        from .rate_limit import RateLimiter, default_state_file
+        from .metrics import ApiMetrics
+        from .retry import RetryPolicy
+
         cfg_file_path = config.getoption('--tr-config')
         config_manager = ConfigManager(cfg_file_path, config)
+        # the choices of --tr-coalesce do not apply to the ini file and the config file
+        coalesce = config_manager.getoption('tr-coalesce', 'coalesce', 'TESTRUN')
+        if coalesce and coalesce not in COALESCE_POLICIES:
+            raise pytest.UsageError('[testrail] Unknown coalescing policy "{}", expected one of: {}'.format(
+                coalesce, ', '.join(COALESCE_POLICIES)))
+        rate_limiter = None
+        rate_limit = config_manager.getoption('tr-rate-limit', 'rate_limit', 'API')
+        if rate_limit:
+            rate_limiter = RateLimiter(
+                float(rate_limit) / 60,
+                path=config_manager.getoption('tr-rate-limit-file', 'rate_limit_file', 'API',
+                                              default=default_state_file(config_manager.getoption('tr-url', 'url',
+                                                                                                  'API'))))
+        metrics_file = config_manager.getoption('tr-metrics-file', 'metrics_file', 'API')
+        metrics = None
+        if metrics_file or config_manager.getoption('tr-metrics', 'metrics', 'API', is_bool=True, default=False):
+            metrics = ApiMetrics()
         client = APIClient(config_manager.getoption('tr-url', 'url', 'API'),
                            config_manager.getoption('tr-email', 'email', 'API'),
                            config_manager.getoption('tr-password', 'password', 'API'),
-                           timeout=config_manager.getoption('tr-timeout', 'timeout', 'API'))
+                           timeout=config_manager.getoption('tr-timeout', 'timeout', 'API'),
+                           connect_timeout=config_manager.getoption('tr-connect-timeout', 'connect_timeout', 'API'),
+                           pool_size=config_manager.getoption('tr-pool-size', 'pool_size', 'API'),
+                           keep_alive=not config_manager.getoption('tr-no-keep-alive', 'no_keep_alive', 'API',
+                                                                   is_bool=True, default=False),
+                           retry_policy=RetryPolicy(
+                               max_retries=config_manager.getoption('tr-max-retries', 'max_retries', 'API', default=4),
+                               backoff=config_manager.getoption('tr-retry-backoff', 'retry_backoff', 'API', default=1),
+                               deadline=config_manager.getoption('tr-retry-deadline', 'retry_deadline', 'API',
+                                                                 default=300)),
+                           rate_limiter=rate_limiter,
+                           metrics=metrics)
+
+        catalog_cache = None
+        if config_manager.getoption('tr-catalog-cache', 'catalog_cache', 'API', is_bool=True, default=False):
+            if config.cache is None:
+                print('[testrail] Catalog cache disabled: pytest cache provider is not active')
+            else:
+                catalog_cache = CatalogCache(
+                    config.cache.mkdir('testrail') / 'catalog.sqlite3',
+                    tr_url=config_manager.getoption('tr-url', 'url', 'API'),
+                    ttl=config_manager.getoption('tr-catalog-cache-ttl', 'catalog_cache_ttl', 'API', default=86400),
+                    max_cases=config_manager.getoption('tr-catalog-cache-max-cases', 'catalog_cache_max_cases', 'API',
+                                                       default=1000000))
 
         config.pluginmanager.register(
             PyTestRailPlugin(
@@ -166,6 +353,35 @@ def pytest_configure(config):
                 skip_missing=config.getoption('--tr-skip-missing'),
                 milestone_id=config_manager.getoption('tr-milestone-id', 'milestone_id', 'TESTRUN'),
                 custom_comment=config_manager.getoption('tc-custom-comment', 'custom_comment', 'TESTCASE'),
+                fetch_concurrency=int(config_manager.getoption('tr-fetch-concurrency', 'fetch_concurrency', 'API',
+                                                               default=4)),
+                create_concurrency=int(config_manager.getoption('tr-create-concurrency', 'create_concurrency', 'API',
+                                                                default=4)),
+                catalog_cache=catalog_cache,
+                stream_results=config_manager.getoption('tr-stream-results', 'stream_results', 'TESTRUN', is_bool=True,
+                                                        default=False),
+                stream_batch_size=int(config_manager.getoption('tr-stream-batch-size', 'stream_batch_size', 'TESTRUN',
+                                                               default=250)),
+                stream_flush_interval=float(config_manager.getoption('tr-stream-flush-interval',
+                                                                     'stream_flush_interval', 'TESTRUN', default=30)),
+                publish_on_controller=config_manager.getoption('tr-xdist-publish-on-controller',
+                                                               'xdist_publish_on_controller', 'TESTRUN', is_bool=True,
+                                                               default=False),
+                stream_queue_size=int(config_manager.getoption('tr-stream-queue-size', 'stream_queue_size', 'TESTRUN',
+                                                               default=1000)),
+                chunk_bytes=int(config_manager.getoption('tr-chunk-bytes', 'chunk_bytes', 'API',
+                                                         default=RESULTS_CHUNK_SIZE_LIMIT)),
+                chunk_max_results=int(config_manager.getoption('tr-chunk-max-results', 'chunk_max_results', 'API',
+                                                               default=0)) or None,
+                journal_path=config_manager.getoption('tr-journal', 'journal', 'TESTRUN'),
+                metrics=metrics,
+                metrics_file=metrics_file,
+                spill_threshold=int(config_manager.getoption('tr-spill-threshold', 'spill_threshold', 'TESTRUN',
+                                                             default=RESULTS_SPILL_THRESHOLD)),
+                coalesce=coalesce,
+                testplan_single_request=config_manager.getoption('tr-testplan-single-request',
+                                                                 'testplan_single_request', 'TESTRUN', is_bool=True,
+                                                                 default=False),
             ),
             # Name of plugin instance (allow to be used by other plugins)
             name="pytest-testrail-instance"
@@ -1,9 +1,14 @@
+import json
 import re
 import warnings
+from array import array
+from itertools import islice
 
 import pytest
 from datetime import datetime
-from pytest_testrail.vars import PYTEST_TO_TESTRAIL_STATUS, DT_FORMAT, TESTRAIL_PREFIX, TESTRAIL_SUITES_PREFIX
+from pytest_testrail.results import ResultRecord
+from pytest_testrail.vars import PYTEST_TO_TESTRAIL_STATUS, DT_FORMAT, TESTRAIL_PREFIX, TESTRAIL_SUITES_PREFIX, \
+    RESULTS_CHUNK_SIZE_LIMIT, COMMENT_SIZE_LIMIT, COMMENT_TRUNCATED_MARKER, TESTRAIL_DEFECTS_PREFIX
 
 
 class DeprecatedTestDecorator(DeprecationWarning):
@@ -96,6 +101,13 @@ def is_xdist_worker(config):
     return hasattr(config, 'workerinput')
 
 
+def is_xdist_controller(config):
+    """True if the code running the given pytest.config object is the controller of several xdist workers.
+    """
+    return not is_xdist_worker(config) and config.pluginmanager.hasplugin('xdist') \
+        and bool(config.getoption('numprocesses', None))
+
+
 def clean_test_ids(test_ids):
     """
     Clean pytest marker containing testrail testcase ids.
@@ -153,6 +165,23 @@ def get_testrail_keys(items):
     return testcaseids
 
 
+def index_testrail_item(item, case_ids):
+    """
+    Parse once what the results of a marked item are published with.
+
+    :param item: pytest item with a `testrail` marker.
+    :param list case_ids: testcase ids of the marker, see `clean_test_ids`.
+    :return tuple: (case_ids, defects as a comma separated string or None, parameters of the item or None)
+    """
+    defects = None
+    defect_marker = item.get_closest_marker(TESTRAIL_DEFECTS_PREFIX)
+    defect_ids = defect_marker.kwargs.get('defect_ids') if defect_marker else None
+    if defect_ids:
+        defects = str(clean_test_defects(defect_ids)).replace('[', '').replace(']', '').replace("'", '')
+    callspec = getattr(item, 'callspec', None)
+    return case_ids, defects, callspec.params if callspec is not None else None
+
+
 def get_testrail_suite_ids(items) -> list:
     suite_ids = []
     for item in items:
@@ -167,14 +196,129 @@ def get_testrail_suite_ids(items) -> list:
     return suite_ids
 
 
-def filter_publish_results(results, ignore_cases):
-    clear_results = []
-    test_case_ids_list = []
-    for result in results:
-        if int(result['case_id']) not in ignore_cases:
-            clear_results.append(result)
-            test_case_ids_list.append(str(result['case_id']))
-    return clear_results, test_case_ids_list
+def pack_result(run_id, result):
+    """
+    Pack a result into a compact tuple of basic types, which can be sent from a xdist worker to the controller.
+
+    :param run_id: id of the testrun the result is published to.
+    :param result: result built by `TestrailActions.add_result`.
+    :return tuple: (run_id, case_id, status_id, comment, duration, defects, test_parametrize, test_comments)
+    """
+    test_parametrize = result.get('test_parametrize')
+    return (
+        run_id,
+        result['case_id'],
+        result['status_id'],
+        result.get('comment') or '',
+        result.get('duration') or 0,
+        result.get('defects'),
+        str(test_parametrize) if test_parametrize else None,
+        tuple(result.get('test_comments') or ()),
+    )
+
+
+def unpack_result(record):
+    """
+    Unpack a result packed by `pack_result`.
+
+    :return tuple: (run_id, ResultRecord)
+    """
+    run_id, case_id, status_id, comment, duration, defects, test_parametrize, test_comments = record
+    return run_id, ResultRecord(case_id, status_id, comment, duration, defects, test_parametrize,
+                                test_comments=test_comments, run_id=run_id)
+
+
+def pack_catalog(suite_names, case_ids_by_suite):
+    """
+    Pack suites and case ids into basic types, which can be sent from the xdist controller to the workers.
+    Case ids of a suite are packed as the bytes of an array of 64-bit integers.
+
+    :param dict suite_names: suite id -> suite name.
+    :param dict case_ids_by_suite: suite id -> list of case ids.
+    :return dict:
+    """
+    return {
+        'suites': [[suite_id, name] for suite_id, name in suite_names.items()],
+        'cases': [[suite_id, array('q', case_ids).tobytes()] for suite_id, case_ids in case_ids_by_suite.items()],
+    }
+
+
+def unpack_catalog(catalog):
+    """
+    Unpack a catalog packed by `pack_catalog`.
+
+    :return tuple: (dict suite id -> suite name, dict suite id -> list of case ids)
+    """
+    case_ids_by_suite = {}
+    for suite_id, packed in catalog['cases']:
+        case_ids = array('q')
+        case_ids.frombytes(packed)
+        case_ids_by_suite[suite_id] = case_ids.tolist()
+    return {suite_id: name for suite_id, name in catalog['suites']}, case_ids_by_suite
+
+
+def encode_json(data):
+    """
+    Encode data as the compact UTF-8 JSON body sent to TestRail.
+
+    :return bytes:
+    """
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def truncate_comment(comment, limit=COMMENT_SIZE_LIMIT):
+    """
+    Keep the last `limit` characters of a comment, after `COMMENT_TRUNCATED_MARKER` if some were dropped.
+
+    Characters which can not be encoded in UTF-8 are replaced. A comment already truncated is returned unchanged,
+    so results can be truncated when they are captured and again when they are published.
+    """
+    comment = str(comment)
+    if comment.startswith(COMMENT_TRUNCATED_MARKER):
+        return comment
+    tail = comment[-limit:].encode('utf-8', 'replace').decode('utf-8')
+    return COMMENT_TRUNCATED_MARKER + tail if len(comment) > limit else tail
+
+
+def print_case_ids(message, case_ids, batch=1000):
+    """
+    Print a message followed by case ids separated by commas, `batch` ids at a time, so that the text listing the
+    ids of a large session is never built in memory at once.
+    """
+    print(message, end='')
+    case_ids = iter(case_ids)
+    separator = ''
+    text = ', '.join(map(str, islice(case_ids, batch)))
+    while text:
+        print(separator + text, end='')
+        separator = ', '
+        text = ', '.join(map(str, islice(case_ids, batch)))
+    print()
+
+
+def chunk_results(entries, byte_limit=RESULTS_CHUNK_SIZE_LIMIT, max_results=None):
+    """
+    Split result entries into `add_results_for_cases` payloads.
+
+    The size of the encoded JSON of each entry is computed once, so a payload never exceeds `byte_limit` bytes
+    (unless a single entry does) and the cost is linear in the number of entries.
+
+    :param entries: iterable of result entries.
+    :param int byte_limit: maximum size in bytes of an encoded payload.
+    :param int max_results: (optional) maximum number of results in a payload.
+    :return: generator of `{'results': [...]}` payloads.
+    """
+    envelope = len(encode_json({'results': []}))
+    chunk, size = [], envelope
+    for entry in entries:
+        entry_size = len(encode_json(entry)) + (1 if chunk else 0)  # comma separating entries
+        if chunk and (size + entry_size > byte_limit or (max_results and len(chunk) >= max_results)):
+            yield {'results': chunk}
+            chunk, size, entry_size = [], envelope, entry_size - 1
+        chunk.append(entry)
+        size += entry_size
+    if chunk:
+        yield {'results': chunk}
 
 
 def get_suite_by_case(case, suites):
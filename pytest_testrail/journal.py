@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+"""
+Local journal of the results of a session, replayed with the `pytest-testrail-replay` command when they could not
+all be published.
+
+The journal is a JSON lines file holding three kinds of records:
+
+- `{"session": {...}}`: settings of the session used to build the results of the next records,
+- `{"seq": 1, "result": [run_id, case_id, ...]}`: a result packed by `pack_result`,
+- `{"ack": [1, 2, ...]}`: sequence numbers of results accepted by TestRail.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from pytest_testrail.functions import pack_result, unpack_result
+from pytest_testrail.vars import TESTRAIL_PREFIX
+
+
+class ResultJournal:
+    def __init__(self, path, session=None, sync_every=100, sync_interval=1.0):
+        """
+        Append-only journal of the results of a session.
+
+        Each record is written to the operating system at once, so it survives the end of the process, and the file
+        is synced to the disk every `sync_every` records or `sync_interval` seconds, so it survives a crash of the
+        host too. A journal without pending results is truncated when a new session opens it, otherwise the number
+        of its pending results is available as `pending`.
+
+        :param path: path of the journal file.
+        :param dict session: settings of the session, see `replay_journal`.
+        :param sync_every: maximum number of records written between two syncs to the disk.
+        :param sync_interval: maximum number of seconds between two syncs to the disk.
+        """
+        self.path = path
+        self.sync_every = int(sync_every)
+        self.sync_interval = float(sync_interval)
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        pending, self._seq = read_journal(path)
+        self.pending = len(pending)
+        self._file = open(path, 'a' if pending else 'w', encoding='utf-8')
+        self._write({'session': session or {}}, sync=True)
+
+    def append(self, run_id, result):
+        """
+        Record a result to be published to a testrun.
+
+        :return: sequence number of the result in the journal.
+        """
+        with self._lock:
+            self._seq += 1
+            self._write({'seq': self._seq, 'result': pack_result(run_id, result)})
+            return self._seq
+
+    def append_packed(self, record):
+        """ Record a result packed by `pack_result`. """
+        with self._lock:
+            self._seq += 1
+            self._write({'seq': self._seq, 'result': record})
+            return self._seq
+
+    def ack(self, seqs):
+        """ Record that results were accepted by TestRail. """
+        seqs = [seq for seq in seqs if seq is not None]
+        if seqs:
+            with self._lock:
+                self._write({'ack': seqs}, sync=True)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if sync or self._unsynced >= self.sync_every or time.monotonic() - self._synced_at >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+
+def read_journal(path):
+    """
+    Read the results of a journal not accepted by TestRail yet.
+
+    A truncated last record, left by a process killed while writing it, is ignored.
+
+    :return tuple: (list of (seq, session settings, run_id, result), last sequence number)
+    """
+    pending = {}
+    last_seq = 0
+    session = {}
+    if not os.path.exists(path):
+        return [], last_seq
+    with open(path, encoding='utf-8') as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'session' in record:
+                session = record['session']
+            elif 'seq' in record:
+                last_seq = max(last_seq, record['seq'])
+                pending[record['seq']] = (session,) + unpack_result(record['result'])
+            elif 'ack' in record:
+                for seq in record['ack']:
+                    pending.pop(seq, None)
+    return [(seq,) + entry for seq, entry in sorted(pending.items())], last_seq
+
+
+def replay_journal(path, client, cert_check=True):
+    """
+    Publish the pending results of a journal, and record them as accepted.
+
+    :param client: `APIClient` connected to the TestRail instance of the session.
+    :return: number of results replayed.
+    """
+    from pytest_testrail.TestrailModel import TestRailModel
+    from pytest_testrail.testrail_actions import TestrailActions
+
+    pending, _ = read_journal(path)
+    journal = ResultJournal(path) if pending else None
+    groups = {}
+    for seq, session, run_id, result in pending:
+        result['journal_seq'] = seq
+        key = (run_id, session.get('version'), session.get('custom_comment'), session.get('publish_blocked'),
+               session.get('coalesce'))
+        groups.setdefault(key, []).append(result)
+    try:
+        for (run_id, version, custom_comment, publish_blocked, coalesce), results in groups.items():
+            actions = TestrailActions(TestRailModel(assign_user_id=None, client=client, cert_check=cert_check,
+                                                    version=version, custom_comment=custom_comment,
+                                                    publish_blocked=publish_blocked, coalesce=coalesce,
+                                                    journal=journal))
+            print('[{}] Replay {} results in testrun {}'.format(TESTRAIL_PREFIX, len(results), run_id))
+            actions._add_results(run_id, results)
+    finally:
+        if journal is not None:
+            journal.close()
+    return len(pending)
+
+
+def main(args=None):
+    """ Entry point of the `pytest-testrail-replay` command. """
+    from pytest_testrail.testrail_api import APIClient
+    import configparser
+
+    parser = argparse.ArgumentParser(prog='pytest-testrail-replay',
+                                     description='Publish the results of journals written with --tr-journal which '
+                                                 'were not accepted by TestRail.')
+    parser.add_argument('journals', nargs='+', help='journal files')
+    parser.add_argument('--tr-config', default='testrail.cfg', help='config file containing information about the '
+                                                                    'TestRail server (defaults to testrail.cfg)')
+    parser.add_argument('--tr-url', help='TestRail address (config file: url in API section)')
+    parser.add_argument('--tr-email', help='email for the account on the TestRail server (config file: email in API '
+                                           'section)')
+    parser.add_argument('--tr-password', help='password for the account on the TestRail server (config file: '
+                                              'password in API section)')
+    parser.add_argument('--tr-no-ssl-cert-check', action='store_false', dest='cert_check', default=None,
+                        help='do not check for valid SSL certificate on TestRail host (config file: no_ssl_cert_check '
+                             'in API section)')
+    options = parser.parse_args(args)
+
+    cfg_file = configparser.ConfigParser()
+    cfg_file.read(options.tr_config)
+
+    def option(name):
+        value = getattr(options, 'tr_' + name)
+        return value if value is not None else cfg_file.get('API', name, fallback=None)
+
+    cert_check = options.cert_check
+    if cert_check is None:
+        cert_check = not cfg_file.getboolean('API', 'no_ssl_cert_check', fallback=False)
+
+    with APIClient(option('url'), option('email'), option('password')) as client:
+        for path in options.journals:
+            replayed = replay_journal(path, client, cert_check=cert_check)
+            print('[{}] {}: {} results replayed'.format(TESTRAIL_PREFIX, path, replayed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
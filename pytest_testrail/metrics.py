@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+import functools
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from pytest_testrail import vars
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# API method name -> URL template of vars.py
+ENDPOINT_TEMPLATES = {
+    value.lstrip('/').split('/')[0]: value
+    for name, value in sorted(vars.__dict__.items()) if name.endswith(('_URL', '_ENTRY')) and isinstance(value, str)
+}
+
+
+def endpoint_template(uri):
+    """ :return: URL template of vars.py matching the URI of a request, or the name of its API method. """
+    name = uri.lstrip('/').split('/')[0].split('&')[0]
+    return ENDPOINT_TEMPLATES.get(name, name)
+
+
+class _EndpointStats:
+    __slots__ = ('count', 'bytes_out', 'bytes_in', 'statuses', 'retries', 'buckets', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.statuses = Counter()
+        self.retries = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            'retries': self.retries,
+            'seconds': round(self.seconds, 6),
+            'latency_buckets': {_le(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)},
+        }
+
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _label(value):
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+class ApiMetrics:
+    def __init__(self):
+        """
+        Measures of the requests sent to TestRail, by endpoint and HTTP method, and of the time spent in the hooks
+        of the plugin. Recording is thread safe.
+        """
+        self.endpoints = {}
+        self.hooks = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, method, uri):
+        key = (endpoint_template(uri), method)
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints.setdefault(key, _EndpointStats())
+        return stats
+
+    def record(self, method, uri, status, seconds, bytes_out=0, bytes_in=0):
+        """
+        Record an attempt of a request.
+
+        :param status: status of the response, or name of the exception raised by the request.
+        """
+        with self._lock:
+            stats = self._stats(method, uri)
+            stats.count += 1
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.statuses[status] += 1
+            stats.seconds += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[index] += 1
+                    break
+
+    def record_retry(self, method, uri):
+        with self._lock:
+            self._stats(method, uri).retries += 1
+
+    @contextmanager
+    def time_hook(self, name):
+        """ Add the time spent in the block to a hook of the plugin. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                count, total = self.hooks.get(name, (0, 0.0))
+                self.hooks[name] = (count + 1, total + seconds)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'endpoints': [dict(endpoint=endpoint, method=method, **stats.to_dict())
+                              for (endpoint, method), stats in sorted(self.endpoints.items())],
+                'hooks': {name: {'count': count, 'seconds': round(seconds, 6)}
+                          for name, (count, seconds) in sorted(self.hooks.items())},
+            }
+
+    def to_openmetrics(self):
+        """ :return: the measures in the OpenMetrics text format. """
+        data = self.to_dict()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.append('# HELP {} {}'.format(name, help_text))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{{{}}} {}'.format(name, suffix, ','.join(
+                    '{}={}'.format(key, _label(label)) for key, label in labels), value))
+
+        endpoints = data['endpoints']
+        family('testrail_api_requests', 'counter', 'Requests sent to TestRail, retries included.',
+               [('_total', (('endpoint', e['endpoint']), ('method', e['method']), ('status', status)), count)
+                for e in endpoints for status, count in e['statuses'].items()])
+        family('testrail_api_sent_bytes', 'counter', 'Bytes of the bodies of the requests.',
+               [('_total', (('endpoint', e['endpoint']), ('method', e['method'])), e['bytes_out']) for e in endpoints])
+        family('testrail_api_received_bytes', 'counter', 'Bytes of the bodies of the responses.',
+               [('_total', (('endpoint', e['endpoint']), ('method', e['method'])), e['bytes_in']) for e in endpoints])
+        family('testrail_api_retries', 'counter', 'Requests retried because of a transient error.',
+               [('_total', (('endpoint', e['endpoint']), ('method', e['method'])), e['retries']) for e in endpoints])
+        samples = []
+        for e in endpoints:
+            labels = (('endpoint', e['endpoint']), ('method', e['method']))
+            cumulated = 0
+            for le, count in e['latency_buckets'].items():
+                cumulated += count
+                samples.append(('_bucket', labels + (('le', le),), cumulated))
+            samples.append(('_sum', labels, e['seconds']))
+            samples.append(('_count', labels, e['count']))
+        family('testrail_api_request_duration_seconds', 'histogram', 'Duration of the requests.', samples)
+        family('testrail_hook_duration_seconds', 'counter', 'Time spent in the hooks of the plugin.',
+               [('_total', (('hook', name),), hook['seconds']) for name, hook in data['hooks'].items()])
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Write the measures to a file, as JSON if its name ends with .json, in the OpenMetrics format otherwise. """
+        with open(path, 'w') as metrics_file:
+            if path.endswith('.json'):
+                json.dump(self.to_dict(), metrics_file, indent=2)
+            else:
+                metrics_file.write(self.to_openmetrics())
+
+    def summary_lines(self):
+        """ :return: lines of a compact table of the measures. """
+        data = self.to_dict()
+        lines = ['{:<34} {:>6} {:>7} {:>10} {:>10} {:>9} {:>9}  {}'.format(
+            'endpoint', 'method', 'calls', 'sent', 'received', 'time (s)', 'retries', 'statuses')]
+        for e in data['endpoints']:
+            lines.append('{:<34} {:>6} {:>7} {:>10} {:>10} {:>9.3f} {:>9}  {}'.format(
+                e['endpoint'], e['method'], e['count'], e['bytes_out'], e['bytes_in'], e['seconds'], e['retries'],
+                ' '.join('{}:{}'.format(status, count) for status, count in e['statuses'].items())))
+        for name, hook in data['hooks'].items():
+            lines.append('{:<34} {:>6} {:>7} {:>10} {:>10} {:>9.3f}'.format(
+                name, 'hook', hook['count'], '', '', hook['seconds']))
+        return lines
+
+
+def timed(name):
+    """
+    Decorator adding the time spent in a method of the plugin to the hook `name` of `testrail_data.metrics`, if set.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.testrail_data.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            with metrics.time_hook(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,11 +1,27 @@
 # -*- coding: UTF-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+
 import pytest
+from filelock import FileLock
 
 from pytest_testrail.TestrailModel import TestRailModel
+from pytest_testrail.catalog import CaseCatalog
+from pytest_testrail.journal import ResultJournal
+from pytest_testrail.metrics import timed
+from pytest_testrail.publisher import ResultPublisher
+from pytest_testrail.read_cache import ReadCache
+from pytest_testrail.results import ResultStore, split_by_run
 from pytest_testrail.testrail_actions import TestrailActions
-from pytest_testrail.vars import TESTRAIL_DEFECTS_PREFIX, TESTRAIL_PREFIX
+from pytest_testrail.vars import TESTRAIL_PREFIX, RESULTS_CHUNK_SIZE_LIMIT, \
+    RESULTS_SPILL_THRESHOLD, ADD_TESTPLAN_ENTRY_URL, ADD_TESTRUN_URL
 from pytest_testrail.functions import get_testrail_keys, testrun_name, clean_test_ids, \
-    get_test_outcome, clean_test_defects, is_xdist_worker, get_testrail_suite_ids, get_suite_by_case
+    get_test_outcome, is_xdist_worker, get_testrail_suite_ids, get_suite_by_case, pack_result, \
+    unpack_result, is_xdist_controller, pack_catalog, unpack_catalog, truncate_comment, index_testrail_item
 
 
 class PyTestRailPlugin(TestrailActions):
@@ -13,12 +29,17 @@ class PyTestRailPlugin(TestrailActions):
     def __init__(self, client, assign_user_id, project_id, suite_id, include_all, cert_check, tr_name,
                  tr_description='', testplan_name=None, testplan_description=None, run_id=0, plan_id=0, version='',
                  close_on_complete=False, publish_blocked=True, skip_missing=False, milestone_id=None,
-                 custom_comment=None, user_email=None, user_password=None, tr_url=None):
+                 custom_comment=None, user_email=None, user_password=None, tr_url=None, fetch_concurrency=4,
+                 create_concurrency=4,
+                 catalog_cache=None, stream_results=False, stream_batch_size=250, stream_flush_interval=30.0,
+                 stream_queue_size=1000, publish_on_controller=False, chunk_bytes=RESULTS_CHUNK_SIZE_LIMIT,
+                 chunk_max_results=None, journal_path=None, metrics=None, metrics_file=None,
+                 spill_threshold=RESULTS_SPILL_THRESHOLD, coalesce=None, testplan_single_request=False):
         self.testrail_data = TestRailModel(assign_user_id=assign_user_id,
                                            cert_check=cert_check,
                                            client=client,
                                            project_id=project_id,
-                                           results=[],
+                                           results=ResultStore(spill_threshold),
                                            suite_id=suite_id,
                                            include_all=include_all,
                                            testrun_name=tr_name,
@@ -27,12 +48,28 @@ class PyTestRailPlugin(TestrailActions):
                                            testplan_id=plan_id,
                                            testplan_name=testplan_name,
                                            testplan_description=testplan_description,
+                                           testplan_single_request=testplan_single_request,
                                            version=version,
                                            close_on_complete=close_on_complete,
                                            publish_blocked=publish_blocked,
+                                           coalesce=coalesce,
                                            skip_missing=skip_missing,
                                            milestone_id=milestone_id,
                                            custom_comment=custom_comment,
+                                           fetch_concurrency=fetch_concurrency,
+                                           create_concurrency=create_concurrency,
+                                           catalog_cache=catalog_cache,
+                                           stream_results=stream_results,
+                                           stream_batch_size=stream_batch_size,
+                                           stream_flush_interval=stream_flush_interval,
+                                           stream_queue_size=stream_queue_size,
+                                           publish_on_controller=publish_on_controller,
+                                           chunk_bytes=chunk_bytes,
+                                           chunk_max_results=chunk_max_results,
+                                           metrics=metrics,
+                                           read_cache=ReadCache(),
+                                           worker_results=ResultStore(spill_threshold),
+                                           worker_result_keys=set(),
                                            tr_keys=[],
                                            user_email=user_email,
                                            user_password=user_password,
@@ -44,6 +81,12 @@ class PyTestRailPlugin(TestrailActions):
                                            )
         super().__init__(testrail_data=self.testrail_data)
         self.is_use_xdist = False
+        self.result_publisher = None
+        self.send_results_to_controller = False
+        self.journal_path = journal_path
+        self.metrics_file = metrics_file
+        self._entries_dir = None
+        self._catalog_prefetch = None
 
     @pytest.fixture(scope='function')
     def testrail_comment(self, request):
@@ -56,43 +99,138 @@ class PyTestRailPlugin(TestrailActions):
         yield _add_section
 
 
-    def _create_test_plan(self):
+    def _create_test_plan(self, suite_ids=None):
+        """
+        :param suite_ids: (optional) suites of the entries created in the same request as the testplan.
+        """
+        entries = None
+        if suite_ids is not None:
+            entries = [self._test_plan_entry_data(suite_id, self.testrail_data.available_suite_ids.get(suite_id))
+                       for suite_id in suite_ids]
         self.create_plan(self.testrail_data.project_id,
                          self.testrail_data.testplan_name,
                          self.testrail_data.milestone_id,
-                         self.testrail_data.testplan_description)
-
-    def _create_test_plan_entry(self, suite_id=None, test_suite_name=''):
-        self.create_plan_entry(suite_id=suite_id if suite_id else self.testrail_data.suite_id,
-                               testrun_name=f'[ {test_suite_name} ] {self.testrail_data.testrun_name or testrun_name()}',
-                               assign_user_id=self.testrail_data.assign_user_id,
-                               plan_id=self.testrail_data.testplan_id,
-                               include_all=self.testrail_data.include_all,
-                               tr_keys=self.testrail_data.actual_suites_with_case_ids[
-                                   suite_id if suite_id else self.testrail_data.suite_id],
-                               description=self.testrail_data.testrun_description
-                               )
-
-    def _create_test_run(self, suite_id=None, test_suite_name=''):
-        self.create_test_run(assign_user_id=self.testrail_data.assign_user_id,
-                             project_id=self.testrail_data.project_id,
-                             suite_id=suite_id if suite_id else self.testrail_data.suite_id,
-                             include_all=self.testrail_data.include_all,
-                             testrun_name=f'[ {test_suite_name} ] {self.testrail_data.testrun_name or testrun_name()}',
-                             tr_keys=self.testrail_data.actual_suites_with_case_ids[
-                                 suite_id if suite_id else self.testrail_data.suite_id],
-                             milestone_id=self.testrail_data.milestone_id,
-                             description=self.testrail_data.testrun_description
-                             )
+                         self.testrail_data.testplan_description,
+                         entries=entries)
+
+    def _test_plan_entry_data(self, suite_id=None, test_suite_name=''):
+        return self.plan_entry_data(suite_id=suite_id if suite_id else self.testrail_data.suite_id,
+                                    testrun_name=f'[ {test_suite_name} ] '
+                                                 f'{self.testrail_data.testrun_name or testrun_name()}',
+                                    assign_user_id=self.testrail_data.assign_user_id,
+                                    include_all=self.testrail_data.include_all,
+                                    tr_keys=self.testrail_data.actual_suites_with_case_ids[
+                                        suite_id if suite_id else self.testrail_data.suite_id],
+                                    description=self.testrail_data.testrun_description
+                                    )
+
+    def _test_run_data(self, suite_id=None, test_suite_name=''):
+        return self.test_run_data(suite_id=suite_id if suite_id else self.testrail_data.suite_id,
+                                  testrun_name=f'[ {test_suite_name} ] '
+                                               f'{self.testrail_data.testrun_name or testrun_name()}',
+                                  assign_user_id=self.testrail_data.assign_user_id,
+                                  include_all=self.testrail_data.include_all,
+                                  tr_keys=self.testrail_data.actual_suites_with_case_ids[
+                                      suite_id if suite_id else self.testrail_data.suite_id],
+                                  milestone_id=self.testrail_data.milestone_id,
+                                  description=self.testrail_data.testrun_description
+                                  )
+
+    def resolve_run_info(self):
+        """
+        :return: suite, testplan and testplan entry of the testrun specified with `--tr-run-id`.
+        """
+        run = self.get_run(run_id=self.testrail_data.testrun_id)
+        run_info = {'suite_id': run['suite_id'], 'plan_id': run['plan_id'], 'entry_id': None}
+        if run['plan_id']:
+            run_info['entry_id'] = self.get_testplan_entry_id(plan_id=run['plan_id'],
+                                                              run_id=self.testrail_data.testrun_id)
+        return run_info
+
+    def prepare_workers(self):
+        """
+        Resolve on the xdist controller, once for all workers, the TestRail catalog and the specified testrun.
+        Without `--tr-testrun-suite-id`, the catalog contains all the suites of the project.
+        """
+        suite_names = self.get_suite_names(project_id=self.testrail_data.project_id)
+        suite_ids = [int(self.testrail_data.suite_id)] if self.testrail_data.suite_id else list(suite_names)
+        case_ids_by_suite = self.get_case_ids_by_suites(self.testrail_data.project_id, suite_ids,
+                                                        self.testrail_data.fetch_concurrency)
+        self.testrail_data.catalog = pack_catalog(suite_names, case_ids_by_suite)
+        if self.testrail_data.testrun_id:
+            self.testrail_data.run_info = self.resolve_run_info()
+        self._entries_dir = tempfile.mkdtemp(prefix='pytest-testrail-')
+        self.testrail_data.entries_file = os.path.join(self._entries_dir, 'entries.json')
+
+    def _start_catalog_prefetch(self):
+        """
+        Fetch the TestRail catalog in background while pytest collects the tests, see `_prefetch_catalog`.
+
+        The thread is a daemon, so that an aborted collection does not wait at exit for the prefetch and its retries.
+        """
+        future = Future()
+
+        def prefetch():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self._prefetch_catalog())
+            except BaseException as error:
+                future.set_exception(error)
+
+        self._catalog_prefetch = future
+        threading.Thread(target=prefetch, name='testrail-prefetch', daemon=True).start()
+
+    @timed('catalog_prefetch')
+    def _prefetch_catalog(self):
+        """
+        Fetch the suites of the project, and the case ids of the suites known before collection: the suite of
+        `--tr-testrun-suite-id`, or else all the suites of the list of the catalog cache, when it is fresh.
+
+        :return: dict of suite id -> suite name, dict of suite id -> list of case ids of the prefetched suites.
+        """
+        project_id = self.testrail_data.project_id
+        cache = self.testrail_data.catalog_cache
+        cached_suites = cache is not None and cache.get_suites(project_id) is not None
+        suite_names = self.get_suite_names(project_id=project_id)
+        if self.testrail_data.suite_id:
+            suite_ids = [int(self.testrail_data.suite_id)]
+        else:
+            suite_ids = list(suite_names) if cached_suites else []
+        return suite_names, self.get_case_ids_by_suites(project_id, suite_ids, self.testrail_data.fetch_concurrency)
 
+    @timed('create_report_entries')
     def create_report_entries(self):
+        entries_file = self.testrail_data.entries_file
+        if not entries_file:
+            self._create_report_entries()
+            return
+        # xdist workers share the testruns: the first one creates or updates them, the others load their ids
+        with FileLock(entries_file + '.lock'):
+            if os.path.exists(entries_file):
+                self._load_shared_entries()
+                print(f'[{TESTRAIL_PREFIX}] Testruns shared with other xdist workers: '
+                      f'{[entry["testrun_id"] for entry in self.testrail_data.plan_entry_storage.values()]}')
+                return
+            self._create_report_entries()
+            with open(entries_file, 'w') as f:
+                # the testplan may be created along with its entries, by the first worker
+                json.dump({'testplan_id': self.testrail_data.testplan_id,
+                           'entries': self.testrail_data.plan_entry_storage}, f)
+
+    def _load_shared_entries(self):
+        """ Load the testruns created by the first xdist worker, see `create_report_entries`. """
+        with open(self.testrail_data.entries_file) as f:
+            shared = json.load(f)
+        self.testrail_data.testplan_id = self.testrail_data.testplan_id or shared['testplan_id']
+        self.testrail_data.plan_entry_storage.update({int(suite): entry for suite, entry in shared['entries'].items()})
+
+    def _create_report_entries(self):
         if self.testrail_data.testrun_id:
             # update specified test run
-            run_info = self.get_run(run_id=self.testrail_data.testrun_id)
+            run_info = self.testrail_data.run_info or self.resolve_run_info()
             if run_info['plan_id']:
-                entry_id = self.get_testplan_entry_id(plan_id=run_info['plan_id'],
-                                                      run_id=self.testrail_data.testrun_id
-                                                      )
+                entry_id = run_info['entry_id']
                 self.update_testplan_entry(plan_id=run_info['plan_id'], entry_id=entry_id,
                                            run_id=self.testrail_data.testrun_id,
                                            tr_keys=self.testrail_data.actual_suites_with_case_ids[run_info['suite_id']],
@@ -104,16 +242,28 @@ class PyTestRailPlugin(TestrailActions):
                                     suite_id=run_info['suite_id'],
                                     save_previous=True)
         else:
-            # create testrun for each suite
+            suite_ids = []
             for suite_id in self.testrail_data.actual_suites_with_case_ids.keys():
                 if not self.testrail_data.actual_suites_with_case_ids[suite_id]:
                     print(f"[{TESTRAIL_PREFIX}] No testcases for suite {suite_id}! Testrun not created")
                     continue
+                suite_ids.append(suite_id)
+            if self.testrail_data.testplan_single_request and self.testrail_data.testplan_name \
+                    and not self.testrail_data.testplan_id:
+                # the testplan and all its entries in a single request
+                self._create_test_plan(suite_ids)
+                return
+            # create testrun for each suite, in parallel
+            creations = []
+            for suite_id in suite_ids:
+                test_suite_name = self.testrail_data.available_suite_ids.get(suite_id)
                 if self.testrail_data.testplan_id:
-                    self._create_test_plan_entry(suite_id=suite_id,
-                                                 test_suite_name=self.testrail_data.available_suite_ids.get(suite_id))
+                    creations.append((ADD_TESTPLAN_ENTRY_URL.format(self.testrail_data.testplan_id),
+                                      self._test_plan_entry_data(suite_id, test_suite_name), self._record_plan_entry))
                 else:
-                    self._create_test_run(suite_id=suite_id, test_suite_name=self.testrail_data.available_suite_ids.get(suite_id))
+                    creations.append((ADD_TESTRUN_URL.format(self.testrail_data.project_id),
+                                      self._test_run_data(suite_id, test_suite_name), self._record_test_run))
+            self.create_entries(creations, self.testrail_data.create_concurrency)
 
     # pytest hooks
     def pytest_report_header(self, config, startdir):
@@ -127,15 +277,47 @@ class PyTestRailPlugin(TestrailActions):
             message += 'a new testrun will be created'
         return message
 
+    def pytest_terminal_summary(self, terminalreporter):
+        """
+        Report the error stopping the publishing of streamed results and the results dropped so far, the requests
+        retried because of transient errors, and the measures of the API calls and lookups
+        """
+        publisher = self.result_publisher
+        if publisher is not None and publisher.failure is not None:
+            terminalreporter.write_line('[{}] Publishing of the streamed results stopped on error: {!r}'.format(
+                TESTRAIL_PREFIX, publisher.failure), red=True)
+        if publisher is not None and publisher.dropped:
+            terminalreporter.write_line('[{}] {} streamed results not published'.format(
+                TESTRAIL_PREFIX, publisher.dropped), red=True)
+        retries = self.testrail_data.client.retries
+        if retries:
+            reasons = sorted(retries.items(), key=lambda item: str(item[0]))
+            terminalreporter.write_line('[{}] {} requests retried ({})'.format(
+                TESTRAIL_PREFIX, sum(retries.values()), ', '.join('{}: {}'.format(*reason) for reason in reasons)))
+        if self.testrail_data.metrics is not None:
+            terminalreporter.write_sep('-', 'TestRail API')
+            for line in self.testrail_data.metrics.summary_lines():
+                terminalreporter.write_line(line)
+            terminalreporter.write_line(self.testrail_data.read_cache.summary())
+
     @pytest.hookimpl(trylast=True)
+    @timed('pytest_collection_modifyitems')
     def pytest_collection_modifyitems(self, session, config, items):
         # received all the tests with test ids from the run
         items_with_tr_keys = get_testrail_keys(items)
 
         # ---------------------------------------------
-        testrail_list_of_suites_and_cases = {}
-        self.testrail_data.available_suite_ids = self.get_suites(project_id=self.testrail_data.project_id)
-        self.testrail_data.available_suite_ids = {suite['id']: suite['name'] for suite in self.testrail_data.available_suite_ids}
+        shipped_case_ids = None
+        prefetched_case_ids = {}
+        if self.testrail_data.catalog is not None:
+            # catalog resolved once by the xdist controller
+            self.testrail_data.available_suite_ids, shipped_case_ids = unpack_catalog(self.testrail_data.catalog)
+        elif self._catalog_prefetch is not None:
+            # fetched while the tests were collected
+            self.testrail_data.available_suite_ids, prefetched_case_ids = self._catalog_prefetch.result()
+            self._catalog_prefetch = None
+        else:
+            self.testrail_data.available_suite_ids = self.get_suite_names(project_id=self.testrail_data.project_id)
         # got a list of test suites [11234,34234,123213]
         if self.testrail_data.suite_id:
             suite_ids = {int(self.testrail_data.suite_id)}
@@ -150,28 +332,41 @@ class PyTestRailPlugin(TestrailActions):
                           f"for project_id: {self.testrail_data.project_id}")
 
         # got a list of test suites with corresponding test cases from the Testrail
-        for suite_id in suite_ids:
-            testrail_list_of_suites_and_cases[suite_id] = \
-                [test.get('id') for test in self.get_cases(self.testrail_data.project_id, suite_id)]
+        if shipped_case_ids is not None:
+            testrail_list_of_suites_and_cases = {suite_id: shipped_case_ids.get(suite_id, [])
+                                                 for suite_id in sorted(suite_ids)}
+        else:
+            fetched_case_ids = self.get_case_ids_by_suites(self.testrail_data.project_id,
+                                                           suite_ids.difference(prefetched_case_ids),
+                                                           self.testrail_data.fetch_concurrency)
+            testrail_list_of_suites_and_cases = {suite_id: prefetched_case_ids.get(suite_id, fetched_case_ids.get(
+                suite_id)) for suite_id in sorted(suite_ids)}
 
         # ---------------------------------------------
+        # indexed the test cases of all the test suites and the pytest items of each test case
+        catalog = CaseCatalog(testrail_list_of_suites_and_cases)
+        item_index = {}
+        for item, case_ids in items_with_tr_keys:
+            for case_id in case_ids:
+                catalog.add_item(case_id, item)
+            item_index[item.nodeid] = index_testrail_item(item, case_ids)
+        self.testrail_data.case_catalog = catalog
+        self.testrail_data.item_index = item_index
+
         # got a list of all the test ids in the run
         pytest_case_ids = [case_id for item in items_with_tr_keys for case_id in item[1]]
-
-        # got a list of all the test cases from all the test suites
-        suite_case_ids = [case for value in testrail_list_of_suites_and_cases for case in
-                          testrail_list_of_suites_and_cases[value]]
+        pytest_case_set = set(pytest_case_ids)
 
         # got a list of test cases to run.
-        self.testrail_data.tr_keys = [case for case in pytest_case_ids if case in suite_case_ids]
+        self.testrail_data.tr_keys = [case for case in pytest_case_ids if case in catalog]
 
         # received a list of test suites with participating test cases in the run
-        for suite_id in suite_ids:
-            self.testrail_data.actual_suites_with_case_ids[suite_id] = list(
-                set(pytest_case_ids).intersection(testrail_list_of_suites_and_cases[suite_id]))
+        for suite_id in testrail_list_of_suites_and_cases:
+            self.testrail_data.actual_suites_with_case_ids[suite_id] = sorted(
+                pytest_case_set.intersection(catalog.case_ids(suite_id)))
         print(f"[{TESTRAIL_PREFIX}] PyTest cases: {pytest_case_ids}")
         # received a list of test cases that are not in the run
-        self.testrail_data.diff_case_ids = list(set(pytest_case_ids).difference(suite_case_ids))
+        self.testrail_data.diff_case_ids = sorted(case for case in pytest_case_set if case not in catalog)
 
         # Showed a list of test cases that are not in the test suites
         if self.testrail_data.diff_case_ids:
@@ -179,12 +374,19 @@ class PyTestRailPlugin(TestrailActions):
                   f"[{TESTRAIL_PREFIX}] Diff: {self.testrail_data.diff_case_ids}")
 
         self.create_report_entries()
+        if self.testrail_data.stream_results and self.testrail_data.plan_entry_storage \
+                and not self.send_results_to_controller:
+            self._start_result_publisher()
 
         if self.testrail_data.skip_missing:
-            for item, case_id in items_with_tr_keys:
-                if set(case_id).intersection(set(self.testrail_data.diff_case_ids)):
-                    mark = pytest.mark.skip(f'[{TESTRAIL_PREFIX}] Test {case_id} is not present in testrun.')
-                    item.add_marker(mark)
+            skipped = set()
+            for diff_case_id in self.testrail_data.diff_case_ids:
+                for item in catalog.items_of(diff_case_id):
+                    if item.nodeid not in skipped:
+                        skipped.add(item.nodeid)
+                        case_id = clean_test_ids(item.get_closest_marker(TESTRAIL_PREFIX).kwargs.get('ids'))
+                        mark = pytest.mark.skip(f'[{TESTRAIL_PREFIX}] Test {case_id} is not present in testrun.')
+                        item.add_marker(mark)
 
     @pytest.hookimpl(tryfirst=True, hookwrapper=True)
     def pytest_runtest_makereport(self, item, call):
@@ -192,54 +394,170 @@ class PyTestRailPlugin(TestrailActions):
         outcome = yield
 
         rep = outcome.get_result()
-        defect_ids = None
-        test_parametrize = None
-        report_messages = []
-        test_comments: list = []
-
-        if 'callspec' in dir(item):
-            test_parametrize = item.callspec.params
+        # Results are only published for the call phase of the marked tests
+        if rep.when != 'call':
+            return None
+        indexed = self._indexed_item(item)
+        if indexed is None or not indexed[0]:
+            return None
+        testcase_ids, defects, test_parametrize = indexed
 
-        if hasattr(rep, 'sections'):
-            for section in rep.sections:
-                if "testrail_comment" in section[0]:
-                    test_comments.append(section[1])
-        if rep.when == "call" and rep.failed:
+        test_comments = [section[1] for section in getattr(rep, 'sections', ()) if "testrail_comment" in section[0]]
+        report_messages = []
+        if rep.failed:
             report_messages.append(rep.longreprtext)
         if rep.skipped and hasattr(rep, 'wasxfail'):
             report_messages.append(f'\nXFail: {rep.wasxfail}')
 
-        comment = '\n'.join(report_messages)
-
-        if item.get_closest_marker(TESTRAIL_DEFECTS_PREFIX):
-            defect_ids = item.get_closest_marker(TESTRAIL_DEFECTS_PREFIX).kwargs.get('defect_ids')
-        if item.get_closest_marker(TESTRAIL_PREFIX):
-            testcase_ids = item.get_closest_marker(TESTRAIL_PREFIX).kwargs.get('ids')
-            if rep.when == 'call' and testcase_ids:
-                for testcase_id in clean_test_ids(testcase_ids):
-                    suite_id = get_suite_by_case(case=testcase_id,
-                                                 suites=self.testrail_data.actual_suites_with_case_ids)
-
-                    self.testrail_data.results.append(self.add_result(
-                        testcase_id,
-                        get_test_outcome(outcome.get_result().outcome),
-                        comment=comment,
-                        duration=rep.duration,
-                        defects=str(clean_test_defects(defect_ids)).replace('[', '').replace(']', '').replace("'",
-                                                                                                              '') if defect_ids else None,
-                        test_parametrize=test_parametrize,
-                        suite_id=suite_id,
-                        test_comments=test_comments))
+        # Only the tail of the messages is published, keep no more until then
+        comment = truncate_comment('\n'.join(report_messages))
+
+        if self.send_results_to_controller:
+            rep.testrail_results = []
+        for testcase_id in testcase_ids:
+            suite_id = self._get_suite_by_case(testcase_id)
+
+            self._store_result(rep, self.add_result(
+                testcase_id,
+                get_test_outcome(rep.outcome),
+                comment=comment,
+                duration=rep.duration,
+                defects=defects,
+                test_parametrize=test_parametrize,
+                suite_id=suite_id,
+                test_comments=test_comments))
+        if self.result_publisher is not None and self.result_publisher.failure is not None:
+            item.session.shouldstop = '[{}] Results can not be published: {!r}'.format(
+                TESTRAIL_PREFIX, self.result_publisher.failure)
+        return None
+
+    def _indexed_item(self, item):
+        """
+        :return tuple: case ids, defects and parameters of a marked item, see `index_testrail_item`, or None if the
+            item has no `testrail` marker.
+        """
+        if self.testrail_data.item_index is not None:
+            # built at collection
+            return self.testrail_data.item_index.get(item.nodeid)
+        marker = item.get_closest_marker(TESTRAIL_PREFIX)
+        if marker is None or not marker.kwargs.get('ids'):
             return None
+        return index_testrail_item(item, clean_test_ids(marker.kwargs.get('ids')))
+
+    def _start_result_publisher(self):
+        print(f'[{TESTRAIL_PREFIX}] Results are published while tests are running')
+        self.result_publisher = ResultPublisher(self._add_results,
+                                                batch_size=self.testrail_data.stream_batch_size,
+                                                flush_interval=self.testrail_data.stream_flush_interval,
+                                                queue_size=self.testrail_data.stream_queue_size).start()
+
+    def _get_suite_by_case(self, case_id):
+        if self.testrail_data.case_catalog is not None:
+            return self.testrail_data.case_catalog.suite_of(case_id)
+        return get_suite_by_case(case=case_id, suites=self.testrail_data.actual_suites_with_case_ids)
+
+    def _is_missing_case(self, case_id):
+        if self.testrail_data.case_catalog is not None:
+            return case_id not in self.testrail_data.case_catalog
+        return case_id in self.testrail_data.diff_case_ids
+
+    def _store_result(self, rep, result):
+        if self.result_publisher is None and not self.send_results_to_controller:
+            self._journal_result(result)
+            self.testrail_data.results.append(result)
+            return
+        run_id = self.get_result_run_id(result)
+        if not run_id or self._is_missing_case(result['case_id']):
+            return
+        if self.send_results_to_controller:
+            # sent to the xdist controller along with the report, see NodeAction.pytest_runtest_logreport
+            rep.testrail_results.append(pack_result(run_id, result))
+        else:
+            self._journal_result(result, run_id)
+            if not self.result_publisher.put(run_id, result):
+                # counted as dropped by the publisher stopped on an error, see `pytest_terminal_summary`
+                print(f'[{TESTRAIL_PREFIX}] Result of testcase C{result["case_id"]} not published: the publishing '
+                      f'stopped on an error{", kept in the journal" if self.testrail_data.journal else ""}')
+
+    def _open_journal(self, workerid=None):
+        # each xdist worker publishing its own results writes its own journal
+        path = self.journal_path if workerid is None else '{}.{}'.format(self.journal_path, workerid)
+        self.testrail_data.journal = ResultJournal(path, session={
+            'tr_url': self.testrail_data.tr_url,
+            'version': self.testrail_data.version,
+            'custom_comment': self.testrail_data.custom_comment,
+            'publish_blocked': self.testrail_data.publish_blocked,
+            'coalesce': self.testrail_data.coalesce,
+        })
+        if self.testrail_data.journal.pending:
+            print(f'[{TESTRAIL_PREFIX}] {self.testrail_data.journal.pending} results of a previous session are not '
+                  f'published, replay them with: pytest-testrail-replay {path}')
+
+    def _write_metrics(self, workerid=None):
+        path = self.metrics_file
+        if workerid is not None:
+            # each xdist worker writes its own measures
+            root, extension = os.path.splitext(path)
+            path = '{}.{}{}'.format(root, workerid, extension)
+        self.testrail_data.metrics.write(path)
+
+    def _journal_result(self, result, run_id=None):
+        """ Record a result in the journal, if any, before it is published """
+        if self.testrail_data.journal is None:
+            return
+        run_id = run_id or self.get_result_run_id(result)
+        if run_id and not self._is_missing_case(result['case_id']):
+            result['journal_seq'] = self.testrail_data.journal.append(run_id, result)
+
+    def _publish_session_results(self):
+        if self.result_publisher is None:
+            self.publish_results(testrail_data=self.testrail_data, results=self.testrail_data.results)
+            return
+        self._finish_streaming()
+
+    @timed('publish_results')
+    def _finish_streaming(self):
+        print(f'[{TESTRAIL_PREFIX}] Waiting for the last streamed results to be published')
+        self.result_publisher.close()
+        print(f'[{TESTRAIL_PREFIX}] {self.result_publisher.published} results published while tests were running')
+        if self.result_publisher.dropped:
+            print(f'[{TESTRAIL_PREFIX}] {self.result_publisher.dropped} results not published')
+        self.finish_publishing()
+
+    @timed('publish_results')
+    def publish_worker_results(self):
+        """
+        Publish the results received from all xdist workers, one `_add_results` call per testrun.
+        """
+        print(f'[{TESTRAIL_PREFIX}] Start publishing results of xdist workers')
+        runs = split_by_run(self.testrail_data.worker_results, lambda result: result.run_id)
+        if not runs:
+            print(f'[{TESTRAIL_PREFIX}] No data published')
+        self._add_results_by_run(runs)
+        self.finish_publishing()
 
     @pytest.hookimpl(tryfirst=True)
     def pytest_sessionstart(self, session):
         if is_xdist_worker(config=session.config):
-            self.testrail_data.testrun_id = session.config.workerinput["test_run_id"]
+            workerinput = session.config.workerinput
+            self.testrail_data.testrun_id = workerinput["test_run_id"]
+            self.testrail_data.testplan_id = workerinput.get("test_plan_id", self.testrail_data.testplan_id)
+            self.testrail_data.catalog = workerinput.get("testrail_catalog")
+            self.testrail_data.run_info = workerinput.get("testrail_run_info")
+            self.testrail_data.entries_file = workerinput.get("testrail_entries_file")
+            self.send_results_to_controller = self.testrail_data.publish_on_controller
+            if self.journal_path and not self.send_results_to_controller:
+                self._open_journal(workerinput['workerid'])
         else:
+            if not is_xdist_controller(session.config):
+                self._start_catalog_prefetch()
+            if self.journal_path:
+                self._open_journal()
             if not self.testrail_data.testrun_id and not self.testrail_data.testplan_id \
-                    and self.testrail_data.testplan_name:
+                    and self.testrail_data.testplan_name and not self.testrail_data.testplan_single_request:
                 self._create_test_plan()
+            if is_xdist_controller(session.config):
+                self.prepare_workers()
 
     @pytest.hookimpl(trylast=True, hookwrapper=True)
     def pytest_sessionfinish(self, session, exitstatus):
@@ -248,14 +566,33 @@ class PyTestRailPlugin(TestrailActions):
         if session.config.pluginmanager.get_plugin("xdist"):
             if is_xdist_worker(config=session.config):
                 self.is_use_xdist = True
-                self.publish_results(testrail_data=self.testrail_data, results=self.testrail_data.results)
+                if not self.send_results_to_controller:
+                    self._publish_session_results()
+            elif self.testrail_data.publish_on_controller and session.config.getoption("numprocesses"):
+                if not self.testrail_data.testplan_id and self.testrail_data.entries_file \
+                        and os.path.exists(self.testrail_data.entries_file):
+                    # created by a worker with --tr-testplan-single-request
+                    self._load_shared_entries()
+                self.publish_worker_results()
             if not self.is_use_xdist and not session.config.getoption("numprocesses"):
-                self.publish_results(testrail_data=self.testrail_data, results=self.testrail_data.results)
+                self._publish_session_results()
         else:
-            self.publish_results(testrail_data=self.testrail_data, results=self.testrail_data.results)
+            self._publish_session_results()
+        self.testrail_data.client.close()
+        self.testrail_data.results.close()
+        self.testrail_data.worker_results.close()
+        if self.metrics_file:
+            self._write_metrics(getattr(session.config, 'workerinput', {}).get('workerid'))
+        if self.testrail_data.journal is not None:
+            self.testrail_data.journal.close()
+        if self.testrail_data.catalog_cache is not None:
+            self.testrail_data.catalog_cache.close()
+        if self._entries_dir:
+            shutil.rmtree(self._entries_dir, ignore_errors=True)
 
     def pytest_configure(self, config):
-        if config.pluginmanager.hasplugin("xdist"):
+        # the results of the workers are gathered by the controller only
+        if config.pluginmanager.hasplugin("xdist") and not is_xdist_worker(config):
             config.pluginmanager.register(NodeAction(self.testrail_data))
 
 
@@ -267,3 +604,27 @@ class NodeAction(TestrailActions):
 
     def pytest_configure_node(self, node):  # type: ignore
         node.workerinput["test_run_id"] = self.testrail_data.testrun_id
+        node.workerinput["test_plan_id"] = self.testrail_data.testplan_id
+        node.workerinput["testrail_catalog"] = self.testrail_data.catalog
+        node.workerinput["testrail_run_info"] = self.testrail_data.run_info
+        node.workerinput["testrail_entries_file"] = self.testrail_data.entries_file
+
+    def pytest_runtest_logreport(self, report):
+        """ Gather on the controller the results sent by xdist workers, dropping duplicates. """
+        for record in getattr(report, 'testrail_results', None) or ():
+            # the serialization between processes may turn tuples into lists
+            record = tuple(record[:-1]) + (tuple(record[-1]),)
+            # a record whose hash is known is compared with the results gathered, as different records may have
+            # the same hash
+            key = hash(record)
+            if key in self.testrail_data.worker_result_keys and self._is_gathered(record):
+                continue
+            self.testrail_data.worker_result_keys.add(key)
+            journal = self.testrail_data.journal
+            run_id, result = unpack_result(record)
+            result.journal_seq = journal.append_packed(record) if journal else None
+            self.testrail_data.worker_results.append(result)
+
+    def _is_gathered(self, record):
+        """ :return: True if a result packed in `record` by `pack_result` is among the results gathered. """
+        return any(pack_result(result.run_id, result) == record for result in self.testrail_data.worker_results)
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from pytest_testrail.vars import TESTRAIL_PREFIX
+
+_STOP = object()
+
+# Errors of a server not answering, once the retries of the client are exhausted: the next batches are still published
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class ResultPublisher:
+    def __init__(self, publish, batch_size=250, flush_interval=30.0, queue_size=1000):
+        """
+        Publish results in background while tests are running.
+
+        Results are put in a bounded queue drained by a worker thread. The worker groups them by testrun and calls
+        `publish(run_id, results)` when `batch_size` results are pending or when the oldest pending result is
+        older than `flush_interval` seconds. When the queue is full, `put` blocks until the worker catches up.
+
+        A batch failing with one of `TRANSIENT_ERRORS` is sent again by `close`. Another error would be raised
+        again by the next batches: it is kept in `failure`, and the worker stops. The results which could not be
+        sent are counted in `dropped`.
+
+        :param publish: callable sending a list of results to a testrun, returning the number of results accepted.
+        :param batch_size: number of pending results triggering a flush.
+        :param flush_interval: maximum age in seconds of a pending result.
+        :param queue_size: maximum number of results waiting to be handled by the worker.
+        """
+        self.publish = publish
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.published = 0
+        self.dropped = 0
+        self.errors = []
+        self.failure = None
+        self._unsent = []
+        self._queue = queue.Queue(maxsize=int(queue_size))
+        self._thread = threading.Thread(target=self._run, name='testrail-publisher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def put(self, run_id, result):
+        """
+        Queue a result for a testrun, waiting for room in the queue if needed.
+
+        :return: False if the result is dropped because the worker stopped on a `failure`.
+        """
+        while True:
+            if not self._thread.is_alive():
+                if self.failure is not None:
+                    self.dropped += 1
+                    return False
+                raise RuntimeError('[{}] Result publisher is not running'.format(TESTRAIL_PREFIX))
+            try:
+                self._queue.put((run_id, result), timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+    def close(self, timeout=None):
+        """
+        Publish the pending results, stop the worker, then send again the batches which failed with a transient
+        error.
+
+        :param timeout: maximum number of seconds to wait for the last flush.
+        :return: True if the worker has stopped.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        # left in the queue by a worker stopped on a failure
+        while not self._queue.empty():
+            if self._queue.get_nowait() is not _STOP:
+                self.dropped += 1
+        unsent, self._unsent = self._unsent, []
+        for run_id, results in unsent:
+            try:
+                self.published += self.publish(run_id, results)
+            except Exception as error:
+                self.errors.append(error)
+                self.dropped += len(results)
+                print('[{}] Failed to publish {} results in testrun {}: {}'.format(
+                    TESTRAIL_PREFIX, len(results), run_id, error))
+        return True
+
+    def _run(self):
+        pending = defaultdict(list)
+        count = 0
+        oldest = None
+        while True:
+            wait = None if oldest is None else max(0.0, oldest + self.flush_interval - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(pending)
+                return
+            if item is not None:
+                run_id, result = item
+                pending[run_id].append(result)
+                count += 1
+                oldest = oldest or time.monotonic()
+            if count >= self.batch_size or (oldest is not None and time.monotonic() - oldest >= self.flush_interval):
+                self._flush(pending)
+                if self.failure is not None:
+                    return
+                pending, count, oldest = defaultdict(list), 0, None
+
+    def _flush(self, pending):
+        for run_id, results in pending.items():
+            if self.failure is not None:
+                self.dropped += len(results)
+                continue
+            try:
+                self.published += self.publish(run_id, results)
+            except TRANSIENT_ERRORS as error:  # keep publishing the next batches
+                self.errors.append(error)
+                self._unsent.append((run_id, results))
+                print('[{}] Failed to publish {} results in testrun {}, to be sent again: {}'.format(
+                    TESTRAIL_PREFIX, len(results), run_id, error))
+            except Exception as error:
+                self.errors.append(error)
+                self.failure = error
+                self.dropped += len(results)
@@ -0,0 +1,104 @@
+# -*- coding: UTF-8 -*-
+import getpass
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from filelock import FileLock
+
+from pytest_testrail.vars import TESTRAIL_PREFIX
+
+
+def default_state_file(tr_url):
+    """
+    :return: path of the state file shared by all the processes of the current user of this host sending requests
+        to a TestRail instance. The files of the other users of the temporary directory are not writable.
+    """
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = ''
+    digest = hashlib.sha1('{}\n{}'.format(user, tr_url or '').encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), 'pytest-testrail-{}-{}.ratelimit'.format(user, digest))
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=1, path=None):
+        """
+        Token bucket spacing out the requests sent to TestRail.
+
+        The bucket holds at most `burst` tokens and is refilled with `rate` tokens per second. Each request takes a
+        token, waiting for it when the bucket is empty, so requests are smoothed under the limit instead of being
+        answered by 429 and a long `Retry-After` pause.
+
+        With a `path`, the bucket is stored in this file and protected by a file lock, so it is shared by every
+        process of the host using the same path. A request reserves its token while holding the lock and waits for
+        it after releasing the lock, so the lock is only held for a read and a write of the state. When the file or
+        its lock can not be written, the bucket is no longer shared and is kept by this process.
+
+        :param rate: number of requests allowed per second.
+        :param burst: number of requests allowed at once after an idle period.
+        :param path: (optional) path of the state file shared between processes.
+        """
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.path = path
+        self.waited = 0.0
+        # between the threads of this process: `waited`, and the switch to a bucket not shared
+        self._thread_lock = threading.Lock()
+        self._lock = FileLock(path + '.lock') if path else threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.time()
+
+    def acquire(self):
+        """ Take a token, waiting until one is available. """
+        try:
+            tokens = self._take()
+        except OSError as error:
+            self._unshare(error)
+            tokens = self._take()
+        if tokens < 0:
+            pause = -tokens / self.rate
+            with self._thread_lock:
+                self.waited += pause
+            time.sleep(pause)
+
+    def _take(self):
+        """ :return: tokens left in the bucket once a token is taken, negative when it is awaited. """
+        with self._lock:
+            tokens, updated = self._load()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate) - 1
+            self._store(tokens, now)
+        return tokens
+
+    def _unshare(self, error):
+        """ Keep the bucket in this process, as its state file or lock can not be written. """
+        with self._thread_lock:
+            if self.path is None:
+                return
+            print('[{}] Rate limit not shared with other processes, "{}" can not be written: {}'.format(
+                TESTRAIL_PREFIX, self.path, error))
+            self._tokens, self._updated = self.burst, time.time()
+            self._lock = threading.Lock()
+            self.path = None
+
+    def _load(self):
+        if self.path is None:
+            return self._tokens, self._updated
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+            return float(state['tokens']), float(state['updated'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return self.burst, time.time()
+
+    def _store(self, tokens, updated):
+        if self.path is None:
+            self._tokens, self._updated = tokens, updated
+            return
+        with open(self.path, 'w') as state_file:
+            json.dump({'tokens': tokens, 'updated': updated}, state_file)
@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+import threading
+
+# API method of a POST request -> kinds of lookups whose cached responses it changes: `plans` and `runs` stand for
+# all the plans and all the runs, the other kinds only for the response of the id of the request. A POST not listed
+# clears the whole cache.
+INVALIDATIONS = {
+    'add_results_for_cases': (),
+    'add_run': (),
+    'add_plan': (),
+    'add_plan_entry': ('plan',),
+    'update_run': ('plans', 'run'),
+    'update_plan_entry': ('runs', 'plan'),
+    'close_run': ('plans', 'run'),
+    'close_plan': ('runs', 'plan'),
+}
+
+# Kinds of lookups cleared all together, see `INVALIDATIONS`
+_ALL_OF = {'plans': ('plan',), 'runs': ('run',)}
+
+
+def _key(value):
+    return int(value) if str(value).isdigit() else value
+
+
+class ReadCache:
+    def __init__(self):
+        """
+        Responses of the plan, run and suite lookups of a session, so that each one is downloaded once.
+
+        The tests of a run are not kept, they are streamed page by page: `TestrailActions.get_case_statuses` keeps
+        only their statuses.
+
+        A response is kept until a POST request changing it is sent, see `invalidate`. Error responses are not kept.
+        Lookups and invalidations are thread safe.
+        """
+        self.hits = 0
+        self.misses = 0
+        self._responses = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, kind, key, load, refresh=False):
+        """
+        :param kind: kind of lookup: `plan`, `run` or `suites`.
+        :param key: id of the plan, run or project looked up.
+        :param load: function downloading the response when it is not cached, returns `(response, cacheable)`.
+        :param refresh: download the response even if it is cached, and keep the new one.
+        :return: the response.
+        """
+        key = _key(key)
+        with self._lock:
+            if not refresh and (kind, key) in self._responses:
+                self.hits += 1
+                return self._responses[kind, key]
+            self.misses += 1
+            generation = self._generation
+        response, cacheable = load()
+        with self._lock:
+            # not kept if a POST sent meanwhile may have changed it
+            if cacheable and generation == self._generation:
+                self._responses[kind, key] = response
+            elif refresh:
+                self._responses.pop((kind, key), None)
+        return response
+
+    def invalidate(self, uri):
+        """ Drop the responses changed by a POST request sent to `uri`. """
+        method, _, ids = uri.lstrip('/').partition('/')
+        kinds = INVALIDATIONS.get(method)
+        with self._lock:
+            self._generation += 1
+            if kinds is None:
+                self._responses.clear()
+                return
+            key = _key(ids.split('/')[0])
+            dropped_kinds = {dropped for kind in kinds for dropped in _ALL_OF.get(kind, ())}
+            for kind, cached_key in list(self._responses):
+                if kind in dropped_kinds or (kind in kinds and cached_key == key):
+                    del self._responses[kind, cached_key]
+
+    def summary(self):
+        """ :return: one line with the hit and miss counters. """
+        lookups = self.hits + self.misses
+        return 'read cache: {} hits, {} misses ({:.0%} hit rate)'.format(
+            self.hits, self.misses, self.hits / lookups if lookups else 0)
@@ -0,0 +1,168 @@
+# -*- coding: UTF-8 -*-
+import json
+import os
+import tempfile
+
+# Shared instances of the values repeated by many results: status ids, suite ids and defects
+_interned = {}
+
+
+def _intern(value):
+    return _interned.setdefault(value, value)
+
+
+class ResultRecord:
+    __slots__ = ('case_id', 'status_id', 'comment', 'duration', 'defects', 'test_parametrize', 'suite_id',
+                 'test_comments', 'run_id', 'journal_seq')
+
+    def __init__(self, case_id, status_id, comment='', duration=0, defects=None, test_parametrize=None, suite_id=0,
+                 test_comments=(), run_id=None, journal_seq=None):
+        """
+        Result of a testcase, kept until it is published.
+
+        A record has no instance dictionary and shares its status id, suite id and defects with the other records
+        having the same values. Its fields can be read and set like the keys of a dict, so results built by
+        `TestrailActions.add_result` can be handled like the dicts previously used.
+
+        :param run_id: (optional) id of the testrun the result is published to, when it is already known.
+        :param journal_seq: (optional) sequence number of the result in the journal of the session.
+        """
+        self.case_id = case_id
+        self.status_id = _intern(status_id)
+        self.comment = comment or ''
+        self.duration = duration
+        self.defects = _intern(defects)
+        self.test_parametrize = test_parametrize
+        self.suite_id = _intern(suite_id)
+        self.test_comments = tuple(test_comments) if test_comments else ()
+        self.run_id = run_id
+        self.journal_seq = journal_seq
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        if isinstance(other, ResultRecord):
+            return self.pack() == other.pack()
+        return NotImplemented
+
+    def __repr__(self):
+        fields = ', '.join('{}={!r}'.format(key, getattr(self, key)) for key in self.__slots__)
+        return 'ResultRecord({})'.format(fields)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def pack(self):
+        """ :return tuple: values of the fields, in the order of the arguments of `ResultRecord`. """
+        test_parametrize = self.test_parametrize
+        return (self.case_id, self.status_id, self.comment, self.duration, self.defects,
+                str(test_parametrize) if test_parametrize else None, self.suite_id, self.test_comments, self.run_id,
+                self.journal_seq)
+
+
+class CaseIdSet:
+    def __init__(self):
+        """
+        Set of positive case ids held in a bitmap, one bit per id up to the largest one, whatever the number of
+        results adding them. Iterating it yields the ids in ascending order.
+        """
+        self._bits = bytearray()
+
+    def add(self, case_id):
+        byte = case_id >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+        self._bits[byte] |= 1 << (case_id & 7)
+
+    def __iter__(self):
+        for byte, bits in enumerate(self._bits):
+            if bits:
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        yield byte << 3 | bit
+
+
+class ResultStore:
+    def __init__(self, spill_threshold=None):
+        """
+        Results of a session waiting to be published, in the order they were added.
+
+        Once `spill_threshold` results are held in memory, they are written to a temporary file and dropped from
+        memory, so the memory used by the store stays bounded whatever the number of results. Iterating the store
+        reads the results of the file back one by one, then yields the ones still in memory.
+
+        :param spill_threshold: (optional) number of results kept in memory, all of them if not set or 0.
+        """
+        self.spill_threshold = spill_threshold
+        self.path = None
+        self._records = []
+        self._spilled = 0
+        self._file = None
+
+    def __len__(self):
+        return self._spilled + len(self._records)
+
+    def __iter__(self):
+        if self._file is not None:
+            with open(self.path, encoding='utf-8') as spill_file:
+                for _, line in zip(range(self._spilled), spill_file):
+                    yield ResultRecord(*json.loads(line))
+        yield from list(self._records)
+
+    def append(self, record):
+        self._records.append(record)
+        if self.spill_threshold and len(self._records) >= self.spill_threshold:
+            self._spill()
+
+    def _spill(self):
+        if self._file is None:
+            handle, self.path = tempfile.mkstemp(prefix='pytest-testrail-', suffix='.results')
+            self._file = os.fdopen(handle, 'w', encoding='utf-8')
+        self._file.writelines(json.dumps(record.pack(), separators=(',', ':')) + '\n' for record in self._records)
+        self._file.flush()
+        self._spilled += len(self._records)
+        self._records = []
+
+    def close(self):
+        """ Drop the results, and remove the temporary file. """
+        self._records = []
+        self._spilled = 0
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path)
+            self._file = self.path = None
+
+
+def split_by_run(results, run_id_of):
+    """
+    Split results by testrun in a single pass over them.
+
+    The results of each testrun are held in their own `ResultStore`, spilling to its own file with the threshold of
+    `results`, so a store spilled to disk is neither loaded in memory at once nor read once per testrun.
+
+    :param results: iterable of results, or `ResultStore`.
+    :param run_id_of: function returning the id of the testrun of a result, or None to leave the result out.
+    :return dict: testrun id -> `ResultStore`, in the order of the first result of each testrun.
+    """
+    spill_threshold = getattr(results, 'spill_threshold', None)
+    runs = {}
+    for result in results:
+        run_id = run_id_of(result)
+        if run_id:
+            if run_id not in runs:
+                runs[run_id] = ResultStore(spill_threshold)
+            runs[run_id].append(result)
+    return runs
@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+import random
+import time
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from pytest_testrail.vars import UPDATE_RUN_URL, UPDATE_TESTPLAN_ENTRY, CLOSE_TESTRUN_URL, CLOSE_TESTPLAN_URL
+
+# Retried statuses. The value tells if the request is known not to have been processed by TestRail, in which case a
+# non idempotent POST can be sent again too.
+RETRY_STATUSES = {
+    429: True,  # Too Many Requests
+    500: False,
+    502: False,
+    503: False,
+    504: False,
+}
+
+# POST endpoints which leave TestRail in the same state when sent twice
+IDEMPOTENT_POSTS = tuple(url.lstrip('/').split('{')[0]
+                         for url in (UPDATE_RUN_URL, UPDATE_TESTPLAN_ENTRY, CLOSE_TESTRUN_URL, CLOSE_TESTPLAN_URL))
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=4, backoff=1.0, max_backoff=60.0, deadline=300.0, statuses=None):
+        """
+        Rules applied to retry the requests failing because of a transient error.
+
+        The n-th retry waits a random delay between 0 and `backoff * 2 ** n` seconds (at most `max_backoff`), or the
+        delay asked by a `Retry-After` header. A request is not retried anymore once `max_retries` retries are done
+        or when the next attempt would start more than `deadline` seconds after the first one.
+
+        GET requests and idempotent POST requests are retried on the given statuses, on timeouts and on connection
+        errors. Other POST requests are only retried when TestRail did not process them: on statuses flagged as
+        such and when the connection could not be established.
+
+        :param max_retries: maximum number of retries of a request.
+        :param backoff: base delay in seconds of the exponential backoff.
+        :param max_backoff: maximum delay in seconds between two attempts.
+        :param deadline: maximum time in seconds spent on a request, retries included.
+        :param statuses: (optional) dict of retried status -> True if a request answered with it was not processed.
+        """
+        self.max_retries = int(max_retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.deadline = float(deadline)
+        self.statuses = RETRY_STATUSES if statuses is None else statuses
+        self.sleep = time.sleep
+
+    @staticmethod
+    def is_idempotent(method, uri):
+        return method == 'GET' or uri.lstrip('/').startswith(IDEMPOTENT_POSTS)
+
+    @staticmethod
+    def is_connect_error(error):
+        """ :return: True if the request failed before being sent to the server. """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    def should_retry(self, method, uri, status=None, error=None):
+        """
+        :param status: status of the response, if any.
+        :param error: exception raised by the request, if any.
+        :return: True if the failure is transient and the request can safely be sent again.
+        """
+        if error is not None:
+            if not isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                return False
+            return self.is_idempotent(method, uri) or self.is_connect_error(error)
+        if status not in self.statuses:
+            return False
+        return self.statuses[status] or self.is_idempotent(method, uri)
+
+    def delay(self, retry, retry_after=None):
+        """
+        :param retry: number of the retry, starting at 0.
+        :param retry_after: (optional) value of the `Retry-After` header.
+        :return: seconds to wait before the retry.
+        """
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def wait(self, retry, started, retry_after=None):
+        """
+        Wait before a retry.
+
+        :param started: `time.monotonic()` of the first attempt.
+        :return: False, without waiting, if the retry is not allowed anymore.
+        """
+        if retry >= self.max_retries:
+            return False
+        pause = self.delay(retry, retry_after)
+        if time.monotonic() + pause - started > self.deadline:
+            return False
+        self.sleep(pause)
+        return True
@@ -1,11 +1,19 @@
-import sys
-from collections import defaultdict
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 from pytest_testrail.TestrailModel import TestRailModel
-from pytest_testrail.functions import get_case_list, filter_publish_results
-from pytest_testrail.vars import TESTRAIL_PREFIX, TESTRAIL_TEST_STATUS, COMMENT_SIZE_LIMIT, ADD_RESULTS_URL, \
+from pytest_testrail.catalog_cache import CLOCK_SKEW
+from pytest_testrail.coalesce import coalesce_results, journal_seqs
+from pytest_testrail.metrics import timed
+from pytest_testrail.results import CaseIdSet, ResultRecord, split_by_run
+from pytest_testrail.functions import chunk_results, encode_json, truncate_comment, \
+    print_case_ids
+from pytest_testrail.testrail_api import APIError, PayloadTooLarge
+from pytest_testrail.vars import TESTRAIL_PREFIX, TESTRAIL_TEST_STATUS, COMMENT_TRUNCATED_MARKER, ADD_RESULTS_URL, \
     ADD_TESTRUN_URL, ADD_TESTPLAN_ENTRY_URL, UPDATE_RUN_URL, GET_TESTRUN_URL, CLOSE_TESTRUN_URL, CLOSE_TESTPLAN_URL, \
-    GET_TESTPLAN_URL, GET_TESTCASES_URL, GET_TESTS_URL, UPDATE_TESTPLAN_ENTRY, ADD_TESTPLAN_URL, GET_SUITES_URL
+    GET_TESTPLAN_URL, GET_TESTCASES_URL, GET_TESTS_URL, UPDATE_TESTPLAN_ENTRY, ADD_TESTPLAN_URL, GET_SUITES_URL, \
+    API_PATH_PREFIX, GET_TESTCASES_UPDATED_AFTER
 
 
 class TestrailActions:
@@ -15,7 +23,7 @@ class TestrailActions:
     def add_result(self, test_id, status, comment: str = "", defects=None, duration=0, test_parametrize=None, suite_id=0,
                    test_comments: list | None = None):
         """
-        Add a new result to results dict to be submitted at the end.
+        Build a new result to be submitted at the end.
 
         :param suite_id:
         :param test_id:
@@ -25,129 +33,233 @@ class TestrailActions:
         :param int status: status code of test (pass or fail).
         :param comment: None or a failure representation.
         :param duration: Time it took to run just the test.
+        :return ResultRecord:
         """
-        data = {
-            'case_id': test_id,
-            'status_id': status,
-            'comment': comment,
-            'duration': duration,
-            'defects': defects,
-            'test_parametrize': test_parametrize,
-            "suite_id": suite_id,
-            "test_comments": test_comments or []
-        }
-        return data
+        return ResultRecord(test_id, status, comment, duration, defects, test_parametrize, suite_id, test_comments)
 
     def _add_results(self, testrun_id, results):
         """
         Add results one by one to improve errors handling.
         :param testrun_id: Id of the testrun to feed
-
+        :param results: list of results, or iterable of results published in its order without being loaded in
+            memory at once.
+        :return int: number of results accepted by TestRail.
         """
-        # unicode converter for compatibility of python 2 and 3
-        try:
-            converter = unicode
-        except NameError:
-            converter = lambda s, c: str(bytes(s, "utf-8"), c)
         # Results are sorted by 'case_id' and by 'status_id' (worst result at the end)
         # Comment sort by status_id due to issue with pytest-rerun failures,
         # for details refer to issue https://github.com/allankp/pytest-testrail/issues/100
         # self.results.sort(key=itemgetter('status_id'))
-        results.sort(key=itemgetter('case_id'))
+        if isinstance(results, list):
+            results.sort(key=itemgetter('case_id'))
+        if self.testrail_data.coalesce:
+            # one result per testcase, in place of the results of its reruns and parameters
+            results = coalesce_results(results, self.testrail_data.coalesce)
+
+        blocked_tests_list = frozenset()
 
         # Manage case of "blocked" testcases
         if self.testrail_data.publish_blocked is False:
             print('[{}] Option "Don\'t publish blocked testcases" activated'.format(TESTRAIL_PREFIX))
-            blocked_tests_list = [
-                test.get('case_id') for test in self.get_tests(testrun_id)
-                if test.get('status_id') == TESTRAIL_TEST_STATUS["blocked"]
-            ]
+            blocked_tests_list = {
+                case_id for case_id, status_id in self.get_case_statuses(testrun_id).items()
+                if status_id == TESTRAIL_TEST_STATUS["blocked"]
+            }
             print('[{}] Blocked testcases excluded: {}'.format(TESTRAIL_PREFIX,
                                                                ', '.join(str(elt) for elt in blocked_tests_list)))
-            results = [result for result in results if result.get('case_id') not in blocked_tests_list]
 
         # prompt enabling include all test cases from test suite when creating test run
         if self.testrail_data.include_all:
             print('[{}] Option "Include all testcases from test suite for test run" activated'.format(TESTRAIL_PREFIX))
 
-        # Publish results
-        chunks = []
-        data = {'results': []}
-        for result in results:
-            entry = {'status_id': result['status_id'], 'case_id': result['case_id'], 'defects': result['defects']}
-            if self.testrail_data.version:
-                entry['version'] = self.testrail_data.version
-            comment = result.get('comment', '')
-            test_parametrize = result.get('test_parametrize', '')
-            test_comments = result.get('test_comments', [])
-            entry['comment'] = u''
-            if test_parametrize:
-                entry['comment'] += u"# Test parametrize: #\n"
-                entry['comment'] += str(test_parametrize) + u'\n\n'
-            if test_comments:
-                entry['comment'] += u"# Test comments: #\n"
-                entry['comment'] += u'\n'.join(test_comments) + u'\n\n'
-            if comment and result.get('status_id') != 1:
-                # Indent text to avoid string formatting by TestRail. Limit size of comment.
-                entry['comment'] += u"# Pytest result: #\n"
-                entry['comment'] += u'Log truncated\n...\n' if len(str(comment)) > COMMENT_SIZE_LIMIT else u''
-                entry['comment'] += u"    " + converter(str(comment), "utf-8")[-COMMENT_SIZE_LIMIT:].replace('\n',
-                                                                                                             '\n    ')  # noqa
-            if self.testrail_data.custom_comment:
-                entry['comment'] += self.testrail_data.custom_comment + '\n'
-            duration = result.get('duration')
-            if duration:
-                duration = 1 if (duration < 1) else int(round(duration))  # TestRail API doesn't manage milliseconds
-                entry['elapsed'] = str(duration) + 's'
-            data['results'].append(entry)
-
-            # report data into chunks
-            if sys.getsizeof(data.__str__()) > 512 * 1024:
-                chunks.append({'results': data['results']})
-                data['results'] = []
-
-        chunks.append({'results': data['results']})
-
-        for chunk in chunks:
-            response = self.testrail_data.client.send_post(
-                ADD_RESULTS_URL.format(testrun_id),
-                chunk,
-                cert_check=self.testrail_data.cert_check
-            )
-            error = self.testrail_data.client.get_error(response)
-            if error:
-                print('[{}] Info: Testcases not published for following reason: "{}"'.format(TESTRAIL_PREFIX, error))
+        # Publish results, `pending` holds the results of the entries taken by `chunk_results` so far
+        pending = deque()
+        blocked_seqs = []
+        accepted = 0
+
+        def entries():
+            for result in results:
+                if result.get('case_id') in blocked_tests_list:
+                    blocked_seqs.extend(journal_seqs([result]))
+                    continue
+                pending.append(result)
+                yield self.build_result_entry(result)
+
+        for chunk in chunk_results(entries(), byte_limit=self.testrail_data.chunk_bytes,
+                                   max_results=self.testrail_data.chunk_max_results):
+            # chunks keep the order of the results
+            published_results = [pending.popleft() for _ in chunk['results']]
+            chunk_accepted = self._post_results(testrun_id, chunk['results'])
+            accepted += chunk_accepted
+            if chunk_accepted == len(chunk['results']):
+                self._record_case_statuses(testrun_id, chunk['results'])
+                if self.testrail_data.journal is not None:
+                    self.testrail_data.journal.ack(journal_seqs(published_results))
+        if self.testrail_data.journal is not None:
+            # not to be published by a replay either
+            self.testrail_data.journal.ack(blocked_seqs)
+        return accepted
+
+    def _record_case_statuses(self, testrun_id, entries):
+        """ Record the statuses of published results in the statuses of the testrun, if they are recorded. """
+        statuses = (self.testrail_data.run_case_statuses or {}).get(testrun_id)
+        if statuses is not None:
+            statuses.update((entry['case_id'], entry['status_id']) for entry in entries)
+
+    def _post_results(self, testrun_id, entries):
+        """
+        Send result entries to a testrun, splitting them while TestRail rejects the size of the request.
+
+        The size limit is lowered to half of each rejected payload, so that the next chunks of the session are
+        built small enough to be accepted at the first attempt.
+
+
+        :return int: number of entries accepted.
+        """
+        size = len(encode_json({'results': entries}))
+        if size > self.testrail_data.chunk_bytes and len(entries) > 1:
+            # Built before the limit was lowered
+            return sum(self._post_results(testrun_id, chunk['results'])
+                       for chunk in chunk_results(entries, byte_limit=self.testrail_data.chunk_bytes))
+        try:
+            response = self._post(ADD_RESULTS_URL.format(testrun_id), {'results': entries})
+        except PayloadTooLarge as error:
+            if len(entries) == 1:
+                print('[{}] Info: Testcase C{} not published for following reason: "{}"'.format(
+                    TESTRAIL_PREFIX, entries[0]['case_id'], error))
+                return 0
+            self.testrail_data.chunk_bytes = min(self.testrail_data.chunk_bytes, error.size // 2)
+            print('[{}] Request of {} bytes rejected, results are now sent by requests of at most {} bytes'.format(
+                TESTRAIL_PREFIX, error.size, self.testrail_data.chunk_bytes))
+            middle = len(entries) // 2
+            return self._post_results(testrun_id, entries[:middle]) + self._post_results(testrun_id, entries[middle:])
+        error = self.testrail_data.client.get_error(response)
+        if error:
+            print('[{}] Info: Testcases not published for following reason: "{}"'.format(TESTRAIL_PREFIX, error))
+            return 0
+        return len(entries)
+
+    def build_result_entry(self, result):
+        """
+        Build the entry of a result in the payload of `add_results_for_cases`.
+        """
+        entry = {'status_id': result['status_id'], 'case_id': result['case_id'], 'defects': result['defects']}
+        if self.testrail_data.version:
+            entry['version'] = self.testrail_data.version
+        comment = result.get('comment', '')
+        test_parametrize = result.get('test_parametrize', '')
+        test_comments = result.get('test_comments', [])
+        parts = []
+        if test_parametrize:
+            parts += [u"# Test parametrize: #\n", str(test_parametrize), u'\n\n']
+        if test_comments:
+            parts += [u"# Test comments: #\n", u'\n'.join(test_comments), u'\n\n']
+        if comment and result.get('status_id') != 1:
+            # Indent text to avoid string formatting by TestRail. Limit size of comment.
+            parts.append(u"# Pytest result: #\n")
+            comment = truncate_comment(comment)
+            if comment.startswith(COMMENT_TRUNCATED_MARKER):
+                parts.append(COMMENT_TRUNCATED_MARKER)
+                comment = comment[len(COMMENT_TRUNCATED_MARKER):]
+            parts += [u"    ", comment.replace('\n', '\n    ')]
+        if self.testrail_data.custom_comment:
+            parts += [self.testrail_data.custom_comment, '\n']
+        entry['comment'] = u''.join(parts)
+        duration = result.get('duration')
+        if duration:
+            duration = 1 if (duration < 1) else int(round(duration))  # TestRail API doesn't manage milliseconds
+            entry['elapsed'] = str(duration) + 's'
+        return entry
+
+    def _post(self, uri, data):
+        """
+        Send a POST request, and drop the lookups it may change from the read cache of the session.
+        """
+        try:
+            return self.testrail_data.client.send_post(uri, data, cert_check=self.testrail_data.cert_check)
+        finally:
+            if self.testrail_data.read_cache is not None:
+                self.testrail_data.read_cache.invalidate(uri)
+
+    def _cached_get(self, kind, key, uri, refresh=False):
+        """
+        Send a GET request, served from the read cache of the session when it holds its response.
+
+        :param kind: kind of lookup, see `ReadCache.get`.
+        :param key: id of the object looked up.
+        :param refresh: send the request even if its response is cached, the new response replaces it.
+        """
+        def load():
+            response = self.testrail_data.client.send_get(uri, cert_check=self.testrail_data.cert_check)
+            return response, not self.testrail_data.client.get_error(response)
+
+        if self.testrail_data.read_cache is None:
+            return load()[0]
+        return self.testrail_data.read_cache.get(kind, key, load, refresh=refresh)
 
+    def _send_post(self, uri, data):
+        """
+        Send a POST request, a request rejected for its size is returned as an error response.
+
+        A testrun or a plan entry can not be created in several requests, so its list of case ids is not split.
+        """
+        try:
+            return self._post(uri, data)
+        except PayloadTooLarge as error:
+            return {'error': str(error)}
+
+    @timed('publish_results')
     def publish_results(self, testrail_data: TestRailModel = None, results: list = None):
         print('[{}] Start publishing'.format(TESTRAIL_PREFIX))
 
         if results:
-            results, tests_list = filter_publish_results(results, self.testrail_data.diff_case_ids)
-            print('[{}] Testcases to publish: {}'.format(TESTRAIL_PREFIX, ', '.join(set(tests_list))))
+            ignored = set(self.testrail_data.diff_case_ids)
+            tests_list = CaseIdSet()
+
+            def run_id_of(result):
+                if int(result['case_id']) in ignored:
+                    return None
+                tests_list.add(int(result['case_id']))
+                return self.get_result_run_id(result)
+
+            runs = split_by_run(results, run_id_of)
+            print_case_ids('[{}] Testcases to publish: '.format(TESTRAIL_PREFIX), tests_list)
 
             if self.testrail_data.diff_case_ids:
                 print(f"[{TESTRAIL_PREFIX}] Not found following testcases in suiteID={self.testrail_data.suite_id}")
                 print(f"[{TESTRAIL_PREFIX}] Testcases will be ignored: {self.testrail_data.diff_case_ids}")
 
-            results_by_run = defaultdict(list)
-            if self.testrail_data.testrun_id:
-                test_suite = list(self.testrail_data.plan_entry_storage.keys())[0]
-                for result in results:
-                    if str(result['case_id']) in tests_list:
-                        if int(result['suite_id']) == int(test_suite):
-                            results_by_run[self.testrail_data.plan_entry_storage[result['suite_id']]['testrun_id']].append(
-                                result)
-                self._add_results(self.testrail_data.testrun_id, results_by_run.get(self.testrail_data.testrun_id))
-            else:
-                for result in results:
-                    if str(result['case_id']) in tests_list:
-                        results_by_run[self.testrail_data.plan_entry_storage[result['suite_id']]['testrun_id']].append(
-                            result)
-                for run_id, result in results_by_run.items():
-                    self._add_results(run_id, result)
+            self._add_results_by_run(runs)
         else:
             print('[{}] No data published'.format(TESTRAIL_PREFIX))
 
+        self.finish_publishing()
+
+    def _add_results_by_run(self, runs):
+        """
+        :param runs: dict of testrun id -> `ResultStore` of its results, see `split_by_run`. The stores are closed.
+        """
+        for run_id, run_results in runs.items():
+            try:
+                self._add_results(run_id, run_results)
+            finally:
+                run_results.close()
+
+    def get_result_run_id(self, result):
+        """
+        :return: id of the testrun a result is published to, or None if no testrun exists for its suite.
+        """
+        storage = self.testrail_data.plan_entry_storage
+        if self.testrail_data.testrun_id:
+            # an existing testrun only receives the results of its own suite
+            if not storage or int(result['suite_id']) != int(next(iter(storage))):
+                return None
+        entry = storage.get(result['suite_id'])
+        return entry['testrun_id'] if entry else None
+
+    def finish_publishing(self):
+        """
+        Close the testrun or testplan if requested and print where the results were published.
+        """
         if self.testrail_data.close_on_complete and self.testrail_data.testrun_id:
             self.close_test_run(self.testrail_data.testrun_id)
         elif self.testrail_data.close_on_complete and self.testrail_data.testplan_id:
@@ -171,8 +283,20 @@ class TestrailActions:
         Create testrun with ids collected from markers.
 
         :param tr_keys: collected testrail ids.
+        :return: id of the testrun, 0 if it was not created.
         """
-        data = {
+        data = self.test_run_data(suite_id, testrun_name, assign_user_id, include_all, tr_keys, milestone_id,
+                                  description)
+
+        response = self._send_post(ADD_TESTRUN_URL.format(project_id), data)
+        return self._record_test_run(data, response)
+
+    @staticmethod
+    def test_run_data(suite_id, testrun_name, assign_user_id, include_all, tr_keys, milestone_id, description=''):
+        """
+        :return dict: testrun sent to `add_run`.
+        """
+        return {
             'suite_id': suite_id,
             'name': testrun_name,
             'description': description,
@@ -182,27 +306,77 @@ class TestrailActions:
             'milestone_id': milestone_id,
         }
 
-        response = self.testrail_data.client.send_post(
-            ADD_TESTRUN_URL.format(project_id),
-            data,
-            cert_check=self.testrail_data.cert_check
-        )
+    def _record_test_run(self, data, response):
+        """
+        Record the testrun created by the request sending `data`.
+
+        :return: id of the testrun, 0 if it was not created.
+        """
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to create testrun: "{}"'.format(TESTRAIL_PREFIX, error))
             return 0
         else:
+            suite_id = data['suite_id']
             self.testrail_data.plan_entry_storage[suite_id] = {"testplan_entry_id": None,
                                                                "testrun_id": response['id'],
-                                                               "case_ids": tr_keys}
+                                                               "case_ids": data['case_ids']}
             print('[{}] New testrun created with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
-                                                                             testrun_name,
+                                                                             data['name'],
                                                                              self.testrail_data.plan_entry_storage[
                                                                                  suite_id]["testrun_id"]))
-            return self.testrail_data.testrun_id
+            return self.testrail_data.plan_entry_storage[suite_id]["testrun_id"]
 
-    def create_plan_entry(self, suite_id, testrun_name, assign_user_id, plan_id, include_all, tr_keys, description=''):
-        data = {
+    def create_entries(self, creations, concurrency=1):
+        """
+        Create testruns or testplan entries, sending up to `concurrency` requests at the same time.
+
+        The responses are recorded once all the requests are done, by the calling thread and in the order of
+        `creations`, so `plan_entry_storage` is only updated by one thread and the log does not depend on the order
+        the requests complete. All the failures are reported together, and the first error raised by a request is
+        raised again afterwards.
+
+        :param creations: list of `(uri, data, record)`, where `record(data, response)` records the entry created by
+            the request posting `data` to `uri` and returns the id of its testrun, or 0 if it was not created.
+        :return list: ids of the testruns, 0 for the ones not created.
+        """
+        workers = max(1, min(int(concurrency or 1), len(creations)))
+
+        def send(creation):
+            uri, data, _ = creation
+            try:
+                return self._send_post(uri, data), None
+            except Exception as error:  # reported with the other failures
+                return None, error
+
+        if workers == 1:
+            outcomes = [send(creation) for creation in creations]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='testrail-create') as executor:
+                outcomes = list(executor.map(send, creations))
+
+        run_ids = []
+        failures = []
+        for (uri, data, record), (response, error) in zip(creations, outcomes):
+            run_id = record(data, response) if error is None else 0
+            if not run_id:
+                reason = error if error is not None else self.testrail_data.client.get_error(response)
+                failures.append('suite {}: {}'.format(data['suite_id'], reason))
+            run_ids.append(run_id)
+        if failures:
+            print('[{}] {} of {} testruns not created: {}'.format(TESTRAIL_PREFIX, len(failures), len(creations),
+                                                                  '; '.join(failures)))
+        errors = [error for _, error in outcomes if error is not None]
+        if errors:
+            raise errors[0]
+        return run_ids
+
+    @staticmethod
+    def plan_entry_data(suite_id, testrun_name, assign_user_id, include_all, tr_keys, description=''):
+        """
+        :return dict: testplan entry sent to `add_plan_entry`, or in the entries of `add_plan`.
+        """
+        return {
             'suite_id': suite_id,
             'name': testrun_name,
             'description': description,
@@ -211,39 +385,61 @@ class TestrailActions:
             'case_ids': tr_keys
         }
 
-        response = self.testrail_data.client.send_post(
-            ADD_TESTPLAN_ENTRY_URL.format(plan_id),
-            data,
-            cert_check=self.testrail_data.cert_check
-        )
+    def create_plan_entry(self, suite_id, testrun_name, assign_user_id, plan_id, include_all, tr_keys, description=''):
+        data = self.plan_entry_data(suite_id, testrun_name, assign_user_id, include_all, tr_keys, description)
+
+        response = self._send_post(ADD_TESTPLAN_ENTRY_URL.format(plan_id), data)
+        return self._record_plan_entry(data, response)
+
+    def _record_plan_entry(self, data, response):
+        """
+        Record the testplan entry created by the request sending `data`.
+
+        :return: id of the testrun of the entry, 0 if it was not created.
+        """
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to create testplan entry: "{}"'.format(TESTRAIL_PREFIX, error))
             return 0
         else:
-            self.testrail_data.plan_entry_storage[suite_id] = {"testplan_entry_id": response['id'],
-                                                               "testrun_id": response['runs'][0]['id'],
-                                                               "case_ids": tr_keys}
-            print('[{}] New TestPlan entry created with name "{}" and ID={}, entry_id={}'
-                  .format(TESTRAIL_PREFIX,
-                          testrun_name,
-                          self.testrail_data.plan_entry_storage[suite_id]["testrun_id"],
-                          self.testrail_data.plan_entry_storage[suite_id]["testplan_entry_id"]))
+            return self._store_plan_entry(data, response)
 
-            return self.testrail_data.plan_entry_storage[suite_id]["testrun_id"]
+    def _store_plan_entry(self, data, entry):
+        """
+        Record the testrun of a testplan entry created by TestRail.
 
-    def create_plan(self, project_id, plan_name, milestone_id, description=''):
+        :param data: entry sent to TestRail, see `plan_entry_data`.
+        :param entry: entry returned by TestRail.
+        :return: id of the testrun.
+        """
+        suite_id = data['suite_id']
+        self.testrail_data.plan_entry_storage[suite_id] = {"testplan_entry_id": entry['id'],
+                                                           "testrun_id": entry['runs'][0]['id'],
+                                                           "case_ids": data['case_ids']}
+        print('[{}] New TestPlan entry created with name "{}" and ID={}, entry_id={}'
+              .format(TESTRAIL_PREFIX,
+                      data['name'],
+                      self.testrail_data.plan_entry_storage[suite_id]["testrun_id"],
+                      self.testrail_data.plan_entry_storage[suite_id]["testplan_entry_id"]))
+
+        return self.testrail_data.plan_entry_storage[suite_id]["testrun_id"]
+
+    def create_plan(self, project_id, plan_name, milestone_id, description='', entries=None):
+        """
+        Create a testplan.
+
+        :param list entries: (optional) entries created along with the testplan, in the same request, see
+            `plan_entry_data`.
+        """
         data = {
             'name': plan_name,
             'description': description,
             'milestone_id': milestone_id,
         }
+        if entries:
+            data['entries'] = entries
 
-        response = self.testrail_data.client.send_post(
-            ADD_TESTPLAN_URL.format(project_id),
-            data,
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._send_post(ADD_TESTPLAN_URL.format(project_id), data)
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to create test plan: "{}"'.format(TESTRAIL_PREFIX, error))
@@ -253,6 +449,9 @@ class TestrailActions:
             print('[{}] New test plan created with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
                                                                                plan_name,
                                                                                self.testrail_data.testplan_id))
+            # entries are returned in the order they were sent
+            for entry_data, entry in zip(entries or [], response.get('entries') or []):
+                self._store_plan_entry(entry_data, entry)
             return self.testrail_data.testplan_id
 
     def update_testrun(self, testrun_id: int, tr_keys: list, suite_id: int, save_previous: bool = True) -> None:
@@ -263,70 +462,100 @@ class TestrailActions:
         :param suite_id:
         :param save_previous: collected testrail ids
         """
-        current_tests = []
-        if save_previous:
-            current_tests = get_case_list(self.get_tests(run_id=testrun_id))
-
-        data = {
-            'case_ids': list(set(tr_keys + current_tests)),
-            'include_all': self.testrail_data.include_all
-        }
-
-        response = self.testrail_data.client.send_post(
-            UPDATE_RUN_URL.format(testrun_id),
-            data,
-            cert_check=self.testrail_data.cert_check
-        )
-        error = self.testrail_data.client.get_error(response)
+        case_ids, updated, error = self._add_run_cases(UPDATE_RUN_URL.format(testrun_id), testrun_id, tr_keys,
+                                                       save_previous)
         self.testrail_data.plan_entry_storage[suite_id] = {"testplan_entry_id": None,
                                                            "testrun_id": testrun_id,
-                                                           "case_ids": list(set(tr_keys + current_tests))}
+                                                           "case_ids": case_ids}
         if error:
             print('[{}] Failed to update testrun: "{}"'.format(TESTRAIL_PREFIX, error))
-        else:
+        elif updated:
             print('[{}] Testrun updated with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
                                                                          self.testrail_data.testrun_name,
                                                                          testrun_id))
 
     def update_testplan_entry(self, plan_id: int, entry_id: str, run_id: int, tr_keys: list, suite_id: int,
                               save_previous: bool = True) -> None:
-        current_tests = []
-
-        if save_previous:
-            current_tests = get_case_list(self.get_tests(run_id=run_id))
-
-        data = {
-            'case_ids': list(set(tr_keys + current_tests)),
-            'include_all': self.testrail_data.include_all
-        }
-
-        response = self.testrail_data.client.send_post(
-            UPDATE_TESTPLAN_ENTRY.format(plan_id, entry_id),
-            data,
-            cert_check=self.testrail_data.cert_check
-        )
-        error = self.testrail_data.client.get_error(response)
+        case_ids, updated, error = self._add_run_cases(UPDATE_TESTPLAN_ENTRY.format(plan_id, entry_id), run_id,
+                                                       tr_keys, save_previous)
         self.testrail_data.plan_entry_storage[suite_id] = {"testplan_entry_id": entry_id,
                                                            "testrun_id": run_id,
-                                                           "case_ids": list(set(tr_keys + current_tests))}
+                                                           "case_ids": case_ids}
         if error:
             print('[{}] Failed to update testrun: "{}"'.format(TESTRAIL_PREFIX, error))
-        else:
+        elif updated:
             print('[{}] Testrun updated with name "{}" and ID={}, entry_id={}'.format(TESTRAIL_PREFIX,
                                                                                       self.testrail_data.testrun_name,
                                                                                       run_id,
                                                                                       entry_id))
 
+    def _add_run_cases(self, uri, run_id, tr_keys, save_previous):
+        """
+        Add the collected testcases to an existing testrun, with a POST request to `uri` (`update_run` or
+        `update_plan_entry`).
+
+        With `save_previous`, the testcases already in the testrun are kept, and the request is not sent when all
+        the collected testcases are among them. The status of each testcase of the testrun is recorded in
+        `run_case_statuses`, for the filtering of blocked testcases at publishing.
+
+        :return: sorted case ids of the testrun, whether the request was sent, and its error if any.
+        """
+        case_ids = set(tr_keys)
+        statuses = None
+        if save_previous:
+            statuses = self.get_case_statuses(run_id)
+            added = case_ids.difference(statuses)
+            if not added and self._includes_all(run_id) == bool(self.testrail_data.include_all):
+                print('[{}] All the {} collected testcases are already in testrun ID={}, not updated'.format(
+                    TESTRAIL_PREFIX, len(case_ids), run_id))
+                return sorted(statuses), False, None
+            case_ids.update(statuses)
+        case_ids = sorted(case_ids)
+
+        response = self._send_post(uri, {'case_ids': case_ids, 'include_all': self.testrail_data.include_all})
+        error = self.testrail_data.client.get_error(response)
+        if statuses is not None and not error:
+            for case_id in added:
+                statuses[case_id] = TESTRAIL_TEST_STATUS['untested']
+        return case_ids, True, error
+
+    def _includes_all(self, run_id):
+        """ :return: True if a testrun includes all the testcases of its suite, None if unknown. """
+        run = self.get_run(run_id)
+        if self.testrail_data.client.get_error(run):
+            return None
+        return bool(run.get('include_all'))
+
+    def get_case_statuses(self, run_id):
+        """
+        :return dict: case id -> status id of the tests of a testrun, downloaded once per session. The statuses of
+            the results published afterwards are recorded by `_add_results`. When the download fails, the statuses
+            received so far are returned but not kept, so that the next call downloads them again.
+        """
+        run_case_statuses = self.testrail_data.run_case_statuses
+        if run_case_statuses is None:
+            run_case_statuses = self.testrail_data.run_case_statuses = {}
+        statuses = run_case_statuses.get(run_id)
+        if statuses is None:
+            statuses = {}
+            try:
+                for test in self._iter_pages(GET_TESTS_URL.format(run_id), 'tests'):
+                    statuses[test['case_id']] = test.get('status_id')
+            except APIError as error:
+                print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error}"')
+                return statuses
+            run_case_statuses[run_id] = statuses
+        return statuses
+
     def is_testrun_available(self):
         """
         Ask if testrun is available in TestRail.
 
         :return: True if testrun exists AND is open
         """
-        response = self.testrail_data.client.send_get(
-            GET_TESTRUN_URL.format(self.testrail_data.testrun_id),
-            cert_check=self.testrail_data.cert_check
-        )
+        # the current state, also kept for the next lookups of the testrun
+        response = self._cached_get('run', self.testrail_data.testrun_id,
+                                    GET_TESTRUN_URL.format(self.testrail_data.testrun_id), refresh=True)
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to retrieve testrun: "{}"'.format(TESTRAIL_PREFIX, error))
@@ -339,11 +568,7 @@ class TestrailActions:
         Closes testrun.
 
         """
-        response = self.testrail_data.client.send_post(
-            CLOSE_TESTRUN_URL.format(testrun_id),
-            data={},
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._post(CLOSE_TESTRUN_URL.format(testrun_id), {})
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to close test run: "{}"'.format(TESTRAIL_PREFIX, error))
@@ -355,69 +580,159 @@ class TestrailActions:
         Closes testrun.
 
         """
-        response = self.testrail_data.client.send_post(
-            CLOSE_TESTPLAN_URL.format(testplan_id),
-            data={},
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._post(CLOSE_TESTPLAN_URL.format(testplan_id), {})
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to close test plan: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
             print('[{}] Test plan with ID={} was closed'.format(TESTRAIL_PREFIX, self.testrail_data.testplan_id))
 
+    def _iter_pages(self, uri, key, prefetch=True):
+        """
+        Iterate over the items of a list endpoint, following pagination links.
+
+        Paginated endpoints answer with an envelope (`offset`, `limit`, `size`, `_links` and the list of items under
+        `key`), older TestRail versions answer with a bare list. Only the current page (and the next one, when
+        prefetching) is held in memory.
+
+        :param uri: uri of the first page.
+        :param key: name of the list of items in a paginated response.
+        :param prefetch: fetch the next page in background while the current one is consumed.
+        :return: generator of items. An error response is raised as `APIError` after the preceding pages.
+        """
+        def fetch(page_uri):
+            return self.testrail_data.client.send_get(page_uri, cert_check=self.testrail_data.cert_check)
+
+        def next_uri(page):
+            if not isinstance(page, dict):
+                return None
+            link = (page.get('_links') or {}).get('next')
+            return link.split(API_PATH_PREFIX, 1)[-1] if link else None
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='testrail-page') as executor:
+            page = fetch(uri)
+            while page is not None:
+                if isinstance(page, dict) and key not in page:
+                    raise APIError(self.testrail_data.client.get_error(page))
+                following = next_uri(page)
+                pending = executor.submit(fetch, following) if prefetch and following else None
+                yield from page if isinstance(page, list) else page[key]
+                if pending is not None:
+                    page = pending.result()
+                else:
+                    page = fetch(following) if following else None
+
+    def iter_cases(self, project_id, suit_id, prefetch=True, updated_after=None, raise_error=False):
+        """
+        :param updated_after: only return the cases updated since this UNIX timestamp.
+        :param raise_error: raise `APIError` instead of printing it and stopping the iteration.
+        :return: generator of the cases contained in a suite, page by page.
+        """
+        uri = GET_TESTCASES_URL.format(project_id, suit_id)
+        if updated_after is not None:
+            uri += GET_TESTCASES_UPDATED_AFTER.format(int(updated_after))
+        try:
+            yield from self._iter_pages(uri, 'cases', prefetch=prefetch)
+        except APIError as error:
+            if raise_error:
+                raise
+            print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error} for suite: {suit_id}"')
+
     def get_cases(self, project_id, suit_id):
         """
         :return: the list of tests containing in a testrun.
         """
-        response = self.testrail_data.client.send_get(
-            GET_TESTCASES_URL.format(project_id, suit_id),
-            cert_check=self.testrail_data.cert_check
-        )
-        error = self.testrail_data.client.get_error(response)
-        if error:
-            print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error} for suite: {suit_id}"')
-            return []
-        return response
+        return list(self.iter_cases(project_id, suit_id))
+
+    def get_case_ids_by_suites(self, project_id, suite_ids, concurrency=1):
+        """
+        Fetch the case ids of several suites, using up to `concurrency` parallel requests.
+
+        :param project_id: project containing the suites.
+        :param suite_ids: iterable of suite ids.
+        :param concurrency: maximum number of suites fetched at the same time.
+        :return: dict of suite id -> list of case ids, ordered by suite id whatever the completion order.
+        """
+        suite_ids = sorted(suite_ids)
+        workers = max(1, min(int(concurrency or 1), len(suite_ids)))
+
+        def fetch(suite_id):
+            if self.testrail_data.catalog_cache is not None:
+                return self._get_cached_case_ids(project_id, suite_id)
+            return [case.get('id') for case in self.iter_cases(project_id, suite_id)]
+
+        if workers == 1:
+            return {suite_id: fetch(suite_id) for suite_id in suite_ids}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='testrail-fetch') as executor:
+            return dict(zip(suite_ids, executor.map(fetch, suite_ids)))
+
+    def _get_cached_case_ids(self, project_id, suite_id):
+        """
+        Return the case ids of a suite from the catalog cache, downloading only the cases updated since the last
+        refresh. A missing or expired catalog is downloaded entirely.
+        """
+        cache = self.testrail_data.catalog_cache
+        started_at = int(time.time())
+        cached = cache.get_case_ids(project_id, suite_id)
+        try:
+            if cached is None:
+                case_ids = [case.get('id') for case in self.iter_cases(project_id, suite_id, raise_error=True)]
+                cache.store_case_ids(project_id, suite_id, case_ids, fetched_at=started_at)
+                return case_ids
+            case_ids, updated_at = cached
+            changed = list(self.iter_cases(project_id, suite_id, updated_after=updated_at - CLOCK_SKEW,
+                                           raise_error=True))
+        except APIError as error:
+            print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error} for suite: {suite_id}"')
+            return cached[0] if cached else []
+        return cache.apply_delta(project_id, suite_id, changed, fetched_at=started_at)
+
+    def get_suite_names(self, project_id):
+        """
+        :return: dict of suite id -> suite name of a project, served from the catalog cache when it is fresh.
+        """
+        cache = self.testrail_data.catalog_cache
+        suites = cache.get_suites(project_id) if cache is not None else None
+        if suites is None:
+            suites = {suite['id']: suite['name'] for suite in self.get_suites(project_id=project_id)}
+            if cache is not None and suites:
+                cache.store_suites(project_id, suites)
+        return suites
 
     def get_suites(self, project_id):
         """
         :return: The list of suite_ids
         """
-        response = self.testrail_data.client.send_get(
-            GET_SUITES_URL.format(project_id),
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._cached_get('suites', project_id, GET_SUITES_URL.format(project_id))
         error = self.testrail_data.client.get_error(response)
         if error:
             print(f'[{TESTRAIL_PREFIX}] Failed to get suites: "{error} for project id: {project_id}"')
             return []
         return response
 
+    def iter_tests(self, run_id, prefetch=True):
+        """
+        :return: generator of the tests contained in a testrun, page by page.
+        """
+        try:
+            yield from self._iter_pages(GET_TESTS_URL.format(run_id), 'tests', prefetch=prefetch)
+        except APIError as error:
+            print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error}"')
+
     def get_tests(self, run_id):
         """
         :return: the list of tests containing in a testrun.
 
         """
-        response = self.testrail_data.client.send_get(
-            GET_TESTS_URL.format(run_id),
-            cert_check=self.testrail_data.cert_check
-        )
-        error = self.testrail_data.client.get_error(response)
-        if error:
-            print(f'[{TESTRAIL_PREFIX}] Failed to get tests: "{error}"')
-            return []
-        return response
+        return list(self.iter_tests(run_id))
 
-    def get_plan(self, plan_id):
+    def get_plan(self, plan_id, refresh=False):
         """
+        :param refresh: download the testplan even if it is in the read cache of the session.
         :return: a list of available testruns associated to a testplan in TestRail.
 
         """
-        response = self.testrail_data.client.send_get(
-            GET_TESTPLAN_URL.format(plan_id),
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._cached_get('plan', plan_id, GET_TESTPLAN_URL.format(plan_id), refresh=refresh)
         error = self.testrail_data.client.get_error(response)
         if error:
             print(f'[{TESTRAIL_PREFIX}] Failed to retrieve testplan: "{error}"')
@@ -427,10 +742,7 @@ class TestrailActions:
         """
         Return info
         """
-        response = self.testrail_data.client.send_get(
-            GET_TESTRUN_URL.format(run_id),
-            cert_check=self.testrail_data.cert_check
-        )
+        response = self._cached_get('run', run_id, GET_TESTRUN_URL.format(run_id))
         error = self.testrail_data.client.get_error(response)
         if error:
             print(f'[{TESTRAIL_PREFIX}] Failed to retrieve testrun: "{error}"')
@@ -468,7 +780,8 @@ class TestrailActions:
 
         :return: True if testplan exists AND is open
         """
-        response = self.get_plan(self.testrail_data.testplan_id)
+        # the current state, also kept for the next lookups of the testplan
+        response = self.get_plan(self.testrail_data.testplan_id, refresh=True)
         error = self.testrail_data.client.get_error(response)
         if error:
             print('[{}] Failed to retrieve testplan: "{}"'.format(TESTRAIL_PREFIX, error))
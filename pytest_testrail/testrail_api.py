@@ -12,8 +12,14 @@
 #
 
 import sys
+import threading
 import requests
 import time
+from collections import Counter
+from requests.adapters import HTTPAdapter
+
+from pytest_testrail.functions import encode_json
+from pytest_testrail.retry import RetryPolicy
 
 if sys.version_info.major == 2:
     from urlparse import urljoin
@@ -21,6 +27,22 @@ else:
     from urllib.parse import urljoin
 
 
+class APIError(Exception):
+    '''
+    Error returned by the TestRail API in place of the expected response.
+    '''
+
+
+class PayloadTooLarge(APIError):
+    '''
+    Request rejected by the server with "413 Request Entity Too Large".
+    '''
+    def __init__(self, uri, size):
+        super().__init__('413 Request Entity Too Large ({} bytes sent to {})'.format(size, uri))
+        self.uri = uri
+        self.size = size
+
+
 class APIClient:
     def __init__(self, base_url, user, password, **kwargs):
         '''
@@ -41,6 +63,20 @@ class APIClient:
         :param timeout: (optional) How many seconds to wait for the server to send data before giving up, as a float,
             or a :ref:`(connect timeout, read timeout) <timeouts>` tuple.
         :type timeout: float or tuple
+        :param connect_timeout: (optional) How many seconds to wait for the connection to be established. If set,
+            ``timeout`` is used as the read timeout only.
+        :type connect_timeout: float
+        :param pool_size: (optional) Maximum number of pooled connections kept open to the TestRail host.
+            Defaults to ``10``.
+        :type pool_size: int
+        :param keep_alive: (optional) Whether connections are reused between requests. Defaults to ``True``.
+        :type keep_alive: bool
+        :param retry_policy: (optional) Rules applied to retry the requests failing because of a transient error.
+        :type retry_policy: RetryPolicy
+        :param rate_limiter: (optional) Token bucket every request, retries included, waits for before being sent.
+        :type rate_limiter: RateLimiter
+        :param metrics: (optional) Recorder of the count, size, status and duration of the requests.
+        :type metrics: ApiMetrics
         '''
         self.user = user
         self.password = password
@@ -48,8 +84,59 @@ class APIClient:
         self.headers = kwargs.get('headers', {'Content-Type': 'application/json'})
         self.cert_check = kwargs.get('cert_check', True)
         self.timeout = kwargs.get('timeout', 10.0)
-        if self.timeout is not None:
-            self.timeout = isinstance(self.timeout, float) if False else float(self.timeout)
+        if self.timeout is not None and not isinstance(self.timeout, tuple):
+            self.timeout = float(self.timeout)
+        connect_timeout = kwargs.get('connect_timeout')
+        if connect_timeout is not None:
+            read_timeout = self.timeout[1] if isinstance(self.timeout, tuple) else self.timeout
+            self.timeout = (float(connect_timeout), read_timeout)
+        self.pool_size = int(kwargs.get('pool_size') or 10)
+        self.keep_alive = kwargs.get('keep_alive', True)
+        self.retry_policy = kwargs.get('retry_policy') or RetryPolicy()
+        self.rate_limiter = kwargs.get('rate_limiter')
+        self.metrics = kwargs.get('metrics')
+        self.retries = Counter()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def session(self):
+        '''
+        Persistent HTTP session shared by all requests of this client.
+
+        The session is created on first use and owns a pool of keep-alive connections, so consecutive API calls
+        reuse the same TCP/TLS connection instead of performing a new handshake each time. Authentication and
+        default headers are set once on the session.
+        '''
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.auth = (self.user, self.password)
+                    session.headers.update(self.headers)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self._session = session
+        return self._session
+
+    def close(self):
+        '''
+        Close all pooled connections. The client stays usable: a new session is created on the next request.
+        '''
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
 
     def send_get(self, uri, **kwargs):
         '''
@@ -68,24 +155,7 @@ class APIClient:
             or a :ref:`(connect timeout, read timeout) <timeouts>` tuple.
         :type timeout: float or tuple
         '''
-        cert_check = kwargs.get('cert_check', self.cert_check)
-        headers = kwargs.get('headers', self.headers)
-        url = self._url + uri
-        r = requests.get(
-            url,
-            auth=(self.user, self.password),
-            headers=headers,
-            verify=cert_check,
-            timeout=self.timeout
-        )
-
-        if r.status_code == 429:  # Too many requests
-            pause = int(r.headers.get('Retry-After', 60))
-            print("Too many requests: pause for {}s".format(pause))
-            time.sleep(pause)
-            return self.send_get(uri, **kwargs)
-        else:
-            return r.json()
+        return self._parse(self._send('GET', uri, **kwargs))
 
     def send_post(self, uri, data, **kwargs):
         '''
@@ -105,28 +175,71 @@ class APIClient:
         :param timeout: (optional) How many seconds to wait for the server to send data before giving up, as a float,
             or a :ref:`(connect timeout, read timeout) <timeouts>` tuple.
         :type timeout: float or tuple
+        :raises PayloadTooLarge: if the server rejects the size of the request.
+        '''
+        body = encode_json(data)
+        r = self._send('POST', uri, body, **kwargs)
+        if r.status_code == 413:
+            raise PayloadTooLarge(uri, len(body))
+        return self._parse(r)
+
+    def _send(self, method, uri, body=None, **kwargs):
+        '''
+        Send a request, retrying it according to the retry policy while it fails because of a transient error.
+
+        :return: the last response.
         '''
         cert_check = kwargs.get('cert_check', self.cert_check)
         headers = kwargs.get('headers', self.headers)
+        if body is not None:
+            headers = dict(headers, **{'Content-Type': 'application/json'})
         url = self._url + uri
-        r = requests.post(
-            url,
-            auth=(self.user, self.password),
-            headers=headers,
-            json=data,
-            verify=cert_check,
-            timeout=self.timeout
-        )
-
-        if r.status_code == 429:  # Too many requests
-            pause = int(r.headers.get('Retry-After', 60))
-            print("Too many requests: pause for {}s".format(pause))
-            time.sleep(pause)
-            return self.send_post(uri, data, **kwargs)
-        elif r.status_code == 413:
-            print("413 Request Entity Too Large")
-        else:
+        started = time.monotonic()
+        retry = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            sent_at = time.perf_counter()
+            try:
+                r = self.session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    data=body,
+                    verify=cert_check,
+                    timeout=self.timeout
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                if self.metrics is not None:
+                    self.metrics.record(method, uri, type(error).__name__, time.perf_counter() - sent_at,
+                                        len(body or b''))
+                retryable = self.retry_policy.should_retry(method, uri, error=error)
+                if not (retryable and self.retry_policy.wait(retry, started)):
+                    raise
+                self._count_retry(method, uri, type(error).__name__)
+            else:
+                if self.metrics is not None:
+                    self.metrics.record(method, uri, r.status_code, time.perf_counter() - sent_at, len(body or b''),
+                                        len(r.content))
+                retryable = self.retry_policy.should_retry(method, uri, status=r.status_code)
+                if not (retryable and self.retry_policy.wait(retry, started, r.headers.get('Retry-After'))):
+                    return r
+                self._count_retry(method, uri, r.status_code)
+            retry += 1
+
+    def _count_retry(self, method, uri, reason):
+        with self._stats_lock:
+            self.retries[reason] += 1
+        if self.metrics is not None:
+            self.metrics.record_retry(method, uri)
+        print('[testrail] {} {} failed ({}), retrying'.format(method, uri, reason))
+
+    @staticmethod
+    def _parse(r):
+        try:
             return r.json()
+        except ValueError:
+            return {'error': '{} {}'.format(r.status_code, r.reason)}
 
     @staticmethod
     def get_error(json_response):
@@ -27,9 +27,20 @@ CLOSE_TESTPLAN_URL = 'close_plan/{}'
 GET_TESTRUN_URL = 'get_run/{}'
 GET_TESTPLAN_URL = 'get_plan/{}'
 GET_TESTS_URL = 'get_tests/{}'
-GET_TESTCASES_URL = 'get_cases/{}&suite_id={}&limit=99999'
+GET_TESTCASES_URL = 'get_cases/{}&suite_id={}'
+GET_TESTCASES_UPDATED_AFTER = '&updated_after={}'
 GET_SUITES_URL = 'get_suites/{}'
 UPDATE_RUN_URL = 'update_run/{}'
 UPDATE_TESTPLAN_ENTRY = "/update_plan_entry/{}/{}"
+# Prefix of the '_links.next' URIs returned by paginated endpoints
+API_PATH_PREFIX = '/api/v2/'
 
 COMMENT_SIZE_LIMIT = 4000
+# Head of a comment of which only the last COMMENT_SIZE_LIMIT characters are kept
+COMMENT_TRUNCATED_MARKER = 'Log truncated\n...\n'
+# Maximum size in bytes of the body of an add_results_for_cases request
+RESULTS_CHUNK_SIZE_LIMIT = 512 * 1024
+# Number of results kept in memory before the next ones are written to a temporary file
+RESULTS_SPILL_THRESHOLD = 20000
+# Policies keeping one result per testcase of a testrun, see coalesce.py
+COALESCE_POLICIES = ('worst', 'last', 'aggregate')
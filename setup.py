@@ -21,7 +21,11 @@ setup(
     install_requires=[
         'pytest>=3.10',
         'requests>=2.20.0',
+        'filelock>=3.0',
     ],
     include_package_data=True,
-    entry_points={'pytest11': ['pytest-testrail = pytest_testrail.conftest']},
+    entry_points={
+        'pytest11': ['pytest-testrail = pytest_testrail.conftest'],
+        'console_scripts': ['pytest-testrail-replay = pytest_testrail.journal:main'],
+    },
 )
@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+"""
+Startup benchmark: collection of the tests followed by the fetch of the TestRail catalog, vs. the catalog fetched
+in background during the collection, against the stand-in server answering each suite after a fixed latency.
+
+Run with: py.test -s tests/benchmark/bench_catalog_prefetch.py
+"""
+import contextlib
+import io
+import time
+
+from pytest_testrail.plugin import PyTestRailPlugin
+from pytest_testrail.testrail_api import APIClient
+from tests.benchmark.server import StandInTestRail, make_suites
+
+CASES = 20000
+COLLECTION_TIME = 0.5
+SUITE_LATENCY = 0.5
+
+
+def _startup(server, prefetch):
+    client = APIClient(server.url, 'user', 'password')
+    plugin = PyTestRailPlugin(client, 1, 1, 1, False, True, 'run')
+    start = time.perf_counter()
+    with client, contextlib.redirect_stdout(io.StringIO()):
+        if prefetch:
+            plugin._start_catalog_prefetch()
+        time.sleep(COLLECTION_TIME)  # pytest collecting the tests
+        plugin.pytest_collection_modifyitems(None, None, [])
+    return time.perf_counter() - start, plugin.testrail_data.available_suite_ids
+
+
+def test_catalog_fetched_during_collection():
+    with StandInTestRail(suites=make_suites(CASES), suite_latency={1: SUITE_LATENCY}) as server:
+        sequential_time, sequential_suites = _startup(server, prefetch=False)
+        prefetch_time, prefetch_suites = _startup(server, prefetch=True)
+
+    print('\ncollection {:.1f}s, catalog fetch {:.1f}s: startup {:.3f}s sequential, {:.3f}s with prefetch'.format(
+        COLLECTION_TIME, SUITE_LATENCY, sequential_time, prefetch_time))
+    assert prefetch_suites == sequential_suites
+    assert sequential_time >= COLLECTION_TIME + SUITE_LATENCY
+    assert prefetch_time < max(COLLECTION_TIME, SUITE_LATENCY) * 1.5
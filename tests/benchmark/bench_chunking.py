@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+"""
+Chunking benchmark: splitting result payloads of add_results_for_cases, previous approach vs. exact byte sizes.
+
+The previous approach re-serialized the whole pending chunk after each result to measure it, so its cost grows
+with the square of the chunk size.
+
+Run with: py.test -s tests/benchmark/bench_chunking.py
+"""
+import sys
+import time
+
+from pytest_testrail.functions import chunk_results, encode_json
+
+LIMIT = 512 * 1024
+
+
+def _entries(count):
+    return [{'case_id': case_id, 'status_id': 5, 'defects': None, 'elapsed': '1s',
+             'comment': u'# Pytest result: #\n    AssertionError: {}'.format(case_id)} for case_id in range(count)]
+
+
+def _previous_chunking(entries):
+    chunks = []
+    data = {'results': []}
+    for entry in entries:
+        data['results'].append(entry)
+        if sys.getsizeof(data.__str__()) > LIMIT:
+            chunks.append(data)
+            data = {'results': []}
+    chunks.append(data)
+    return chunks
+
+
+def _timed(function, entries):
+    start = time.perf_counter()
+    chunks = list(function(entries))
+    return time.perf_counter() - start, chunks
+
+
+def test_previous_chunking_is_quadratic():
+    small, _ = _timed(_previous_chunking, _entries(1000))
+    large, _ = _timed(_previous_chunking, _entries(2000))
+    print('\nprevious chunking: 1000 results {:.3f}s, 2000 results {:.3f}s'.format(small, large))
+
+
+def test_exact_chunking_is_linear():
+    timings = {}
+    for count in (25000, 50000, 100000):
+        entries = _entries(count)
+        timings[count], chunks = _timed(lambda e: chunk_results(e, byte_limit=LIMIT), entries)
+        assert sum(len(chunk['results']) for chunk in chunks) == count
+        assert all(len(encode_json(chunk)) <= LIMIT for chunk in chunks)
+        print('exact chunking: {} results in {} chunks {:.3f}s'.format(count, len(chunks), timings[count]))
+    # Twice as many results must take well under four times as long
+    assert timings[100000] < 3 * timings[50000]
@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+"""
+Collection benchmark: per-suite case catalog fetch, sequential vs. concurrent.
+
+Run with: py.test -s tests/benchmark/bench_collection.py
+"""
+import time
+
+from pytest_testrail import TestrailModel
+from pytest_testrail import testrail_actions
+from pytest_testrail.testrail_api import APIClient
+from tests.benchmark.server import StandInTestRail
+
+SUITES = 40
+SUITE_LATENCY = 0.05
+SLOWEST_SUITE_LATENCY = 0.3
+
+
+def _fetch(server, concurrency):
+    client = APIClient(server.url, 'user', 'password', pool_size=concurrency)
+    actions = testrail_actions.TestrailActions(TestrailModel.TestRailModel(assign_user_id=1, client=client))
+    start = time.perf_counter()
+    with client:
+        cases = actions.get_case_ids_by_suites(1, server.suites, concurrency=concurrency)
+    return time.perf_counter() - start, cases
+
+
+def test_concurrent_fetch_scales_with_slowest_suite():
+    suites = {suite_id: list(range(suite_id * 1000, suite_id * 1000 + 50)) for suite_id in range(1, SUITES + 1)}
+    suite_latency = {suite_id: SUITE_LATENCY for suite_id in suites}
+    suite_latency[SUITES] = SLOWEST_SUITE_LATENCY
+    with StandInTestRail(suites=suites, suite_latency=suite_latency) as server:
+        sequential_time, sequential_cases = _fetch(server, concurrency=1)
+        concurrent_time, concurrent_cases = _fetch(server, concurrency=SUITES)
+
+    print('\nsequential fetch of {} suites: {:.3f}s'.format(SUITES, sequential_time))
+    print('concurrent fetch of {} suites: {:.3f}s (slowest suite: {:.3f}s)'.format(
+        SUITES, concurrent_time, SLOWEST_SUITE_LATENCY))
+    assert concurrent_cases == sequential_cases
+    assert list(concurrent_cases) == sorted(suites)
+    assert sequential_time >= sum(suite_latency.values())
+    assert concurrent_time < SLOWEST_SUITE_LATENCY * 2
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+"""
+Memory benchmark: heap kept by the results of a session of 20k failing tests with long tracebacks.
+
+Each failure goes through `pytest_runtest_makereport` with a fresh traceback text, as pytest renders it, so the
+memory still allocated at the end is what the plugin keeps until the results are published.
+
+Run with: py.test -s tests/benchmark/bench_comments.py
+"""
+import time
+import tracemalloc
+
+from mock import Mock
+
+from pytest_testrail.plugin import PyTestRailPlugin
+from pytest_testrail.vars import COMMENT_SIZE_LIMIT
+
+FAILURES = 20000
+# Characters of the traceback of each failure
+TRACEBACK_SIZE = 50 * 1024
+
+
+class _Item:
+    def __init__(self, case_id):
+        self.marker = Mock(kwargs={'ids': ('C{}'.format(case_id),)})
+
+    def get_closest_marker(self, name):
+        return self.marker if name == 'testrail' else None
+
+
+class _Report:
+    when = 'call'
+    failed = True
+    skipped = False
+    outcome = 'failed'
+    duration = 0.01
+    sections = ()
+
+    def __init__(self, case_id):
+        self.case_id = case_id
+
+    @property
+    def longreprtext(self):
+        # rendered on each access, like pytest does
+        return 'E   AssertionError: test {}\n'.format(self.case_id) * (TRACEBACK_SIZE // 30)
+
+
+def _capture(plugin, case_id):
+    item, report = _Item(case_id), _Report(case_id)
+    hook = plugin.pytest_runtest_makereport(item, Mock())
+    next(hook)
+    try:
+        hook.send(Mock(get_result=lambda: report))
+    except StopIteration:
+        pass
+
+
+def test_failure_comments_memory():
+    # results kept in memory, to measure the comments they hold
+    plugin = PyTestRailPlugin(Mock(), 1, 1, 1, False, True, 'run', spill_threshold=0)
+    plugin.testrail_data.actual_suites_with_case_ids = {1: set(range(1, FAILURES + 1))}
+    tracemalloc.start()
+    start = time.perf_counter()
+    for case_id in range(1, FAILURES + 1):
+        _capture(plugin, case_id)
+    elapsed = time.perf_counter() - start
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(plugin.testrail_data.results) == FAILURES
+    print('\n{} failures captured in {:.2f}s: {:.1f} MB kept, {:.1f} MB at peak, {:.0f} bytes per result'.format(
+        FAILURES, elapsed, kept / 2 ** 20, peak / 2 ** 20, kept / FAILURES))
+    # The bounded tail of each comment, and its bookkeeping, not the tracebacks
+    assert kept / FAILURES < COMMENT_SIZE_LIMIT * 2
+    assert peak < kept + 10 * TRACEBACK_SIZE * 4
@@ -0,0 +1,49 @@
+# -*- coding: UTF-8 -*-
+"""
+Startup benchmark: creation of one testrun, or testplan entry, per suite, sequential vs. concurrent, against the
+stand-in server answering each request after a fixed latency.
+
+Run with: py.test -s tests/benchmark/bench_create_entries.py
+"""
+import contextlib
+import io
+import time
+
+import pytest
+
+from pytest_testrail.plugin import PyTestRailPlugin
+from pytest_testrail.testrail_api import APIClient
+from tests.benchmark.server import StandInTestRail, make_suites
+
+SUITES = 30
+CASES = 30000
+LATENCY = 0.1
+CONCURRENCY = 8
+
+
+def _create(server, concurrency, plan):
+    client = APIClient(server.url, 'user', 'password', pool_size=concurrency)
+    plugin = PyTestRailPlugin(client, 1, 1, None, False, True, 'run', create_concurrency=concurrency)
+    plugin.testrail_data.actual_suites_with_case_ids = dict(server.suites)
+    plugin.testrail_data.available_suite_ids = {suite_id: 'Suite {}'.format(suite_id) for suite_id in server.suites}
+    if plan:
+        plugin.testrail_data.testplan_name = 'plan'
+        with contextlib.redirect_stdout(io.StringIO()):
+            plugin._create_test_plan()
+    start = time.perf_counter()
+    with client, contextlib.redirect_stdout(io.StringIO()):
+        plugin._create_report_entries()
+    return time.perf_counter() - start, plugin.testrail_data.plan_entry_storage
+
+
+@pytest.mark.parametrize('plan', [False, True], ids=['testruns', 'testplan-entries'])
+def test_concurrent_creation(plan):
+    with StandInTestRail(suites=make_suites(CASES, suites=SUITES), latency=LATENCY) as server:
+        sequential_time, sequential_storage = _create(server, 1, plan)
+        concurrent_time, concurrent_storage = _create(server, CONCURRENCY, plan)
+
+    print('\n{} {}: sequential {:.3f}s, {} concurrent requests {:.3f}s'.format(
+        SUITES, 'testplan entries' if plan else 'testruns', sequential_time, CONCURRENCY, concurrent_time))
+    assert list(concurrent_storage) == list(sequential_storage) == sorted(server.suites)
+    assert sequential_time >= SUITES * LATENCY
+    assert concurrent_time < sequential_time / (CONCURRENCY / 2)
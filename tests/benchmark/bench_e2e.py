@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""
+End-to-end benchmark: pytest sessions of synthetic projects of 1k, 10k and 100k tests publishing to the stand-in
+server, without and with xdist.
+
+For each session, records the API calls, the bytes sent and the overhead of the plugin, i.e. the wall time of the
+session with --testrail minus the wall time of the same session without it. Request counts are checked against
+budgets, so that a change sending more requests than needed is caught.
+
+Run with: py.test -s tests/benchmark/bench_e2e.py
+Set PYTEST_TESTRAIL_BENCH_OUTPUT to a file path to save the measures as JSON.
+"""
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pytest_testrail.vars import RESULTS_CHUNK_SIZE_LIMIT
+from tests.benchmark.server import StandInTestRail, make_suites
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PAGE_SIZE = 250
+# Cases of the suite not covered by the tests
+EXTRA_CASES = 1000
+WORKERS = 4
+
+TESTS_MODULE = """
+import pytest
+from pytest_testrail import pytestrail
+
+
+@pytest.mark.parametrize('case_id', [pytest.param(case_id, marks=pytestrail.case('C{{}}'.format(case_id)))
+                                     for case_id in range(1, {tests} + 1)])
+def test_case(case_id):
+    # one test out of 20 fails
+    assert case_id % 20
+"""
+
+MEASURES = []
+
+
+def _run_session(project, server, testrail, xdist):
+    # --tb=no: the failure summary of pytest grows with the square of the number of tests
+    args = [sys.executable, '-m', 'pytest', '-q', '--tb=no', '-p', 'pytest_testrail.conftest',
+            '-p', 'no:cacheprovider', '-p', 'no:warnings']
+    if xdist:
+        args += ['-n', str(WORKERS)]
+    if testrail:
+        args += ['--testrail', '--tr-url', server.url, '--tr-email', 'user', '--tr-password', 'password',
+                 '--tr-testrun-project-id', '1', '--tr-testrun-suite-id', '1', '--tr-testrun-assignedto-id', '1']
+        if xdist:
+            args += ['--tr-xdist-publish-on-controller']
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    completed = subprocess.run(args, cwd=str(project), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    # exit code 1: some tests failed, as expected
+    assert completed.returncode == 1, completed.stdout.decode('utf-8', 'replace')[-3000:]
+    return elapsed
+
+
+@pytest.mark.parametrize('xdist', [False, True], ids=['no-xdist', 'xdist'])
+@pytest.mark.parametrize('tests', [1000, 10000, 100000])
+def test_session(tmp_path, tests, xdist):
+    if xdist:
+        pytest.importorskip('xdist')
+    (tmp_path / 'test_synthetic.py').write_text(TESTS_MODULE.format(tests=tests))
+    suites = make_suites(tests, extra_cases=EXTRA_CASES)
+    with StandInTestRail(suites=suites, page_size=PAGE_SIZE) as server:
+        baseline = _run_session(tmp_path, server, testrail=False, xdist=xdist)
+        server.reset_counters()
+        with_plugin = _run_session(tmp_path, server, testrail=True, xdist=xdist)
+        calls = server.calls()
+        bytes_sent = server.bytes_sent()
+        results = sum(len(run_results) for run_results in server.results.values())
+
+    measure = {'tests': tests, 'xdist': xdist, 'calls': calls, 'requests': sum(calls.values()),
+               'bytes_sent': bytes_sent, 'baseline_s': round(baseline, 3), 'session_s': round(with_plugin, 3),
+               'overhead_s': round(with_plugin - baseline, 3)}
+    MEASURES.append(measure)
+    print('\n{tests} tests, xdist={xdist}: {requests} requests {calls}, {bytes_sent} bytes sent, '
+          'session {session_s}s, plugin overhead {overhead_s}s'.format(**measure))
+    output = os.environ.get('PYTEST_TESTRAIL_BENCH_OUTPUT')
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(MEASURES, output_file, indent=2)
+
+    assert results == tests
+    # Budgets
+    assert calls['get_cases'] == math.ceil((tests + EXTRA_CASES) / PAGE_SIZE)
+    assert calls['add_run'] == 1
+    assert calls['add_results_for_cases'] <= math.ceil(bytes_sent / RESULTS_CHUNK_SIZE_LIMIT) + 1
+    assert calls['get_suites'] == 1
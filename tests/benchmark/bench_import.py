@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+"""
+Import-time benchmark of the module loaded by every pytest process where the package is installed, measured with
+`python -X importtime`, vs. the HTTP stack it only loads when --testrail is enabled.
+
+Run with: py.test -s tests/benchmark/bench_import.py
+"""
+import subprocess
+import sys
+
+CODE = 'import pytest; import pytest_testrail.conftest; import requests'
+
+
+def _cumulated_import_times():
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE], capture_output=True, text=True,
+                             check=True)
+    cumulated_us = {}
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and fields[1].strip().isdigit():
+            cumulated_us[fields[2].strip()] = int(fields[1])
+    return cumulated_us
+
+
+def test_entry_point_import_time():
+    cumulated_us = _cumulated_import_times()
+
+    print('\npytest_testrail.conftest: {} us, requests: {} us'.format(cumulated_us['pytest_testrail.conftest'],
+                                                                      cumulated_us['requests']))
+    # cheaper than the HTTP stack it no longer loads
+    assert cumulated_us['pytest_testrail.conftest'] < cumulated_us['requests']
@@ -0,0 +1,26 @@
+# -*- coding: UTF-8 -*-
+"""
+Journal benchmark: cost of recording a result in the journal, compared to the duration of a short test.
+
+Run with: py.test -s tests/benchmark/bench_journal.py
+"""
+import time
+
+from pytest_testrail.journal import ResultJournal
+
+RESULTS = 20000
+
+
+def test_journal_append_cost(tmp_path):
+    result = {'case_id': 1234, 'status_id': 5, 'comment': 'AssertionError: ' + 'x' * 200, 'duration': 0.01,
+              'defects': None, 'test_parametrize': None, 'test_comments': []}
+    journal = ResultJournal(str(tmp_path / 'journal.jsonl'))
+    start = time.perf_counter()
+    for _ in range(RESULTS):
+        journal.append(10, result)
+    journal.close()
+    elapsed = time.perf_counter() - start
+
+    print('\n{} results journaled in {:.3f}s: {:.1f}us per result'.format(RESULTS, elapsed, elapsed / RESULTS * 1e6))
+    # Well below the duration of a short test
+    assert elapsed / RESULTS < 0.001
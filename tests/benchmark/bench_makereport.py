@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+"""
+Microbenchmark: time spent in `pytest_runtest_makereport` for the setup, call and teardown phases of 100k collected
+tests, one out of 100 marked with a testcase.
+
+Run with: py.test -s tests/benchmark/bench_makereport.py
+"""
+import time
+
+from mock import Mock
+
+from pytest_testrail.functions import get_testrail_keys, index_testrail_item
+from pytest_testrail.plugin import PyTestRailPlugin
+
+pytest_plugins = "pytester"
+
+TESTS = 100000
+MARKED_EVERY = 100
+TESTS_FILE = """
+    import pytest
+    @pytest.mark.parametrize('i', [pytest.param(i, marks=pytest.mark.testrail(ids=('C{{}}'.format(i),)))
+                                   if not i % {marked_every} else i for i in range({tests})])
+    def test_func(i):
+        pass
+""".format(tests=TESTS, marked_every=MARKED_EVERY)
+
+
+class _Report:
+    failed = False
+    skipped = False
+    outcome = 'passed'
+    duration = 0.01
+    sections = ()
+
+    def __init__(self, when):
+        self.when = when
+
+
+def _run_phases(plugin, items):
+    outcomes = [Mock(get_result=lambda report=_Report(when): report) for when in ('setup', 'call', 'teardown')]
+    start = time.perf_counter()
+    for item in items:
+        for outcome in outcomes:
+            hook = plugin.pytest_runtest_makereport(item, None)
+            next(hook)
+            try:
+                hook.send(outcome)
+            except StopIteration:
+                pass
+    return time.perf_counter() - start
+
+
+def test_makereport_overhead(pytester):
+    pytester.makeini('[pytest]\nmarkers = testrail')
+    pytester.makepyfile(TESTS_FILE)
+    items = pytester.getitems(TESTS_FILE)
+    assert len(items) == TESTS
+    plugin = PyTestRailPlugin(Mock(), 1, 1, 1, False, True, 'run', spill_threshold=0)
+    plugin.testrail_data.actual_suites_with_case_ids = {1: list(range(0, TESTS, MARKED_EVERY))}
+
+    # index built at collection, see pytest_collection_modifyitems
+    start = time.perf_counter()
+    plugin.testrail_data.item_index = {item.nodeid: index_testrail_item(item, case_ids)
+                                       for item, case_ids in get_testrail_keys(items)}
+    index_time = time.perf_counter() - start
+    hook_time = _run_phases(plugin, items)
+
+    assert len(plugin.testrail_data.results) == TESTS // MARKED_EVERY
+    calls = TESTS * 3
+    print('\n{} tests, {} marked: index built in {:.3f}s, {} hook calls in {:.3f}s, {:.2f}us per call'.format(
+        TESTS, TESTS // MARKED_EVERY, index_time, calls, hook_time, hook_time / calls * 1e6))
+    assert hook_time / calls < 5e-6
@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+"""
+Rate limit benchmark: 32 processes sending requests to a TestRail instance limited to 100 requests per second,
+without and with a rate limiter shared through a state file.
+
+Run with: py.test -s tests/benchmark/bench_rate_limit.py
+"""
+import multiprocessing
+import os
+import time
+
+from pytest_testrail.rate_limit import RateLimiter
+from pytest_testrail.retry import RetryPolicy
+from pytest_testrail.testrail_api import APIClient
+from pytest_testrail.vars import GET_TESTCASES_URL
+from tests.benchmark.server import StandInTestRail
+
+CLIENTS = 32
+REQUESTS = 10
+SERVER_LIMIT = 100
+CLIENT_LIMIT = 90
+
+
+def _client(url, state_file):
+    # 429 answers are not retried, so that each of them is counted once by the server
+    limiter = RateLimiter(CLIENT_LIMIT, path=state_file) if state_file else None
+    with APIClient(url, 'user', 'password', retry_policy=RetryPolicy(max_retries=0), rate_limiter=limiter) as client:
+        for _ in range(REQUESTS):
+            client.send_get(GET_TESTCASES_URL.format(1, 1))
+
+
+def _run(server, state_file=None):
+    server.reset_counters()
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_client, args=(server.url, state_file)) for _ in range(CLIENTS)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    return time.perf_counter() - start, server.throttled
+
+
+def test_shared_rate_limiter_avoids_429(tmp_path):
+    with StandInTestRail(rate_limit=SERVER_LIMIT) as server:
+        unlimited_time, unlimited_throttled = _run(server)
+        limited_time, limited_throttled = _run(server, str(tmp_path / 'state'))
+
+    print('\n{} clients x {} requests without rate limiter: {} answered with 429 in {:.3f}s'.format(
+        CLIENTS, REQUESTS, unlimited_throttled, unlimited_time))
+    print('{} clients x {} requests with a shared rate limiter: {} answered with 429 in {:.3f}s'.format(
+        CLIENTS, REQUESTS, limited_throttled, limited_time))
+    assert unlimited_throttled > 0
+    assert limited_throttled == 0
+    assert os.path.exists(str(tmp_path / 'state'))
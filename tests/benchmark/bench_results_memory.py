@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+"""
+Memory benchmark: peak heap used by the results of sessions of 25k to 200k results, from their capture to the end of
+their publication, with results spilled to disk and kept in memory.
+
+Run with: py.test -s tests/benchmark/bench_results_memory.py
+"""
+import time
+import tracemalloc
+
+import pytest
+
+from pytest_testrail.plugin import PyTestRailPlugin
+from pytest_testrail.vars import TESTRAIL_TEST_STATUS, RESULTS_SPILL_THRESHOLD, COMMENT_SIZE_LIMIT
+
+SUITE_ID = 1
+RUN_ID = 10
+PEAKS = {}
+
+
+class _Client:
+    """ Accepts the results without keeping them. """
+
+    def __init__(self):
+        self.published = 0
+
+    def send_post(self, uri, data, cert_check=None):
+        self.published += len(data['results'])
+        return {}
+
+    @staticmethod
+    def get_error(response):
+        return None
+
+
+def _session(results, spill_threshold):
+    client = _Client()
+    plugin = PyTestRailPlugin(client, 1, 1, SUITE_ID, False, True, 'run', spill_threshold=spill_threshold)
+    plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': RUN_ID, 'testplan_entry_id': None,
+                                                          'case_ids': []}}
+    tracemalloc.start()
+    start = time.perf_counter()
+    for case_id in range(1, results + 1):
+        # one test out of 20 fails with a truncated traceback
+        failed = not case_id % 20
+        comment = 'E   AssertionError {}\n'.format(case_id) * (COMMENT_SIZE_LIMIT // 25) if failed else ''
+        status = TESTRAIL_TEST_STATUS['failed' if failed else 'passed']
+        plugin._store_result(None, plugin.add_result(case_id, status, comment=comment, duration=0.01,
+                                                     suite_id=SUITE_ID))
+    plugin.publish_results(plugin.testrail_data, plugin.testrail_data.results)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plugin.testrail_data.results.close()
+    assert client.published == results
+    return peak, elapsed
+
+
+@pytest.mark.parametrize('spill_threshold', [RESULTS_SPILL_THRESHOLD, 0], ids=['spilled', 'in-memory'])
+@pytest.mark.parametrize('results', [25000, 50000, 100000, 200000])
+def test_results_memory(results, spill_threshold):
+    peak, elapsed = _session(results, spill_threshold)
+    PEAKS[spill_threshold, results] = peak
+    print('\n{} results, spill threshold {}: {:.1f} MB at peak, captured and published in {:.2f}s'.format(
+        results, spill_threshold, peak / 2 ** 20, elapsed))
+    if spill_threshold and (spill_threshold, 25000) in PEAKS:
+        # Flat: the results above the threshold are on disk
+        assert peak < PEAKS[spill_threshold, 25000] * 1.5
@@ -0,0 +1,52 @@
+# -*- coding: UTF-8 -*-
+"""
+Transport benchmark: 500 API calls with one connection per request vs. the pooled APIClient session.
+
+Run with: py.test -s tests/benchmark/bench_transport.py
+"""
+import time
+
+import requests
+
+from pytest_testrail.testrail_api import APIClient
+from pytest_testrail.vars import ADD_RESULTS_URL, GET_TESTCASES_URL, GET_TESTS_URL
+from tests.benchmark.server import StandInTestRail
+
+CALLS = 500
+# Simulated cost of establishing a TCP/TLS connection to a remote TestRail host
+CONNECT_DELAY = 0.002
+
+
+def _session_calls(send_get, send_post):
+    for i in range(CALLS):
+        if i % 4 == 0:
+            send_post(ADD_RESULTS_URL.format(1), {'results': [{'case_id': 1, 'status_id': 1}]})
+        elif i % 4 == 1:
+            send_get(GET_TESTS_URL.format(1))
+        else:
+            send_get(GET_TESTCASES_URL.format(1, 1))
+
+
+def test_pooled_client_reduces_handshakes():
+    with StandInTestRail(connect_delay=CONNECT_DELAY) as server:
+        client = APIClient(server.url, 'user', 'password')
+        url = client._url
+
+        start = time.perf_counter()
+        _session_calls(
+            lambda uri: requests.get(url + uri, auth=('user', 'password'), timeout=10).json(),
+            lambda uri, data: requests.post(url + uri, json=data, auth=('user', 'password'), timeout=10).json(),
+        )
+        unpooled_time, unpooled_connections = time.perf_counter() - start, server.connections
+
+        server.reset_counters()
+        start = time.perf_counter()
+        with client:
+            _session_calls(client.send_get, client.send_post)
+        pooled_time, pooled_connections = time.perf_counter() - start, server.connections
+
+    print('\nper-request connections: {} handshakes, {:.3f}s'.format(unpooled_connections, unpooled_time))
+    print('pooled session:          {} handshakes, {:.3f}s'.format(pooled_connections, pooled_time))
+    assert unpooled_connections == CALLS
+    assert pooled_connections == 1
+    assert pooled_time < unpooled_time
@@ -0,0 +1,303 @@
+# -*- coding: UTF-8 -*-
+"""
+Local stand-in for the TestRail API v2, used by the benchmarks.
+
+The server runs in a background thread of the current process and keeps its whole state in memory. It implements
+the endpoints used by the plugin (see `pytest_testrail.vars`), counts accepted TCP connections and served requests,
+and can inject the failures of a real instance (rate limit, 413, 5xx), so benchmarks can compare how many
+handshakes, round-trips and bytes the plugin needs.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = '/index.php?/api/v2/'
+URI_PATTERN = re.compile(r'/*(?P<endpoint>[a-z_]+)/?(?P<arg>[0-9a-f-]*)(?:/(?P<arg2>[0-9a-f-]+))?(?P<query>.*)')
+
+
+def make_suites(cases, suites=1, extra_cases=0):
+    """
+    Build a synthetic catalog.
+
+    :param cases: number of cases covered by tests, numbered from 1 and spread over the suites.
+    :param suites: number of suites, numbered from 1.
+    :param extra_cases: number of cases of each suite not covered by any test.
+    :return: mapping of suite id to the list of case ids it contains.
+    """
+    catalog = {suite_id: [] for suite_id in range(1, suites + 1)}
+    for case_id in range(1, cases + 1):
+        catalog[(case_id - 1) % suites + 1].append(case_id)
+    next_case_id = cases + 1
+    for case_ids in catalog.values():
+        case_ids.extend(range(next_case_id, next_case_id + extra_cases))
+        next_case_id += extra_cases
+    return catalog
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # Called once per accepted TCP connection: simulate the cost of a TCP/TLS handshake.
+        with self.server.stand_in.lock:
+            self.server.stand_in.connections += 1
+        if self.server.stand_in.connect_delay:
+            time.sleep(self.server.stand_in.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET', None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self._dispatch('POST', body)
+
+    def _dispatch(self, method, body):
+        stand_in = self.server.stand_in
+        uri = self.path[len(API_PREFIX):] if self.path.startswith(API_PREFIX) else self.path
+        with stand_in.lock:
+            stand_in.requests.append((method, uri, len(body or b'')))
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+        headers = {}
+        fault = stand_in.fault(uri)
+        if stand_in.throttle():
+            status, payload, headers = 429, {'error': 'API rate limit exceeded'}, {'Retry-After': '60'}
+        elif fault:
+            status, payload = fault, None
+            if fault == 429:
+                headers = {'Retry-After': '1'}
+        elif stand_in.max_body and len(body or b'') > stand_in.max_body:
+            status, payload = 413, None
+        else:
+            status, payload = stand_in.handle(method, uri, json.loads(body) if body else None)
+        if payload is None:
+            # Answer of a proxy or load balancer
+            data = '<html><body>{} {}</body></html>'.format(status, self.responses[status][0]).encode('utf-8')
+            headers['Content-Type'] = 'text/html'
+        else:
+            data = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInTestRail:
+    """
+    In-process HTTP server answering the TestRail API endpoints used by the plugin.
+
+    :param suites: mapping of suite id to the list of case ids it contains, see `make_suites`.
+    :param latency: seconds to wait before answering each request.
+    :param connect_delay: seconds to wait when a new connection is accepted (simulates TLS handshake cost).
+    :param suite_latency: mapping of suite id to extra seconds spent answering `get_cases` for that suite.
+    :param rate_limit: maximum number of requests per second, the next ones are answered with 429 like TestRail Cloud.
+    :param page_size: if set, `get_cases` and `get_tests` are paginated like TestRail 6.7+ with this many items per
+        page, otherwise they return a bare list.
+    :param max_body: if set, POST requests with a larger body are answered with 413.
+    :param faults: mapping of endpoint name to a list of statuses returned, in order, by its next requests instead
+        of handling them (e.g. ``{'add_results_for_cases': [502, 429]}``).
+    """
+
+    def __init__(self, suites=None, latency=0.0, connect_delay=0.0, suite_latency=None, rate_limit=None,
+                 page_size=None, max_body=None, faults=None):
+        self.suites = suites or {1: [1, 2, 3]}
+        self.latency = latency
+        self.suite_latency = suite_latency or {}
+        self.connect_delay = connect_delay
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.max_body = max_body
+        self.faults = {endpoint: deque(statuses) for endpoint, statuses in (faults or {}).items()}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.throttled = 0
+        self.requests = []
+        self.runs = {}
+        self.plans = {}
+        self.results = {}
+        self._accepted = deque()
+        self._next_id = 1
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.throttled = 0
+            self.requests = []
+
+    def calls(self, method=None):
+        """ :return: mapping of endpoint name to the number of requests it received. """
+        counts = {}
+        for request_method, uri, _ in self.requests:
+            if method is None or request_method == method:
+                endpoint = URI_PATTERN.match(uri).group('endpoint')
+                counts[endpoint] = counts.get(endpoint, 0) + 1
+        return counts
+
+    def bytes_sent(self):
+        """ :return: number of bytes of the bodies of the requests received. """
+        return sum(size for _, _, size in self.requests)
+
+    def throttle(self):
+        """ :return: True if the request exceeds the rate limit over the last second. """
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self._accepted and now - self._accepted[0] >= 1.0:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.rate_limit:
+                self.throttled += 1
+                return True
+            self._accepted.append(now)
+            return False
+
+    def fault(self, uri):
+        """ :return: status injected for a request, if any. """
+        statuses = self.faults.get(URI_PATTERN.match(uri).group('endpoint'))
+        with self.lock:
+            return statuses.popleft() if statuses else None
+
+    def _new_id(self):
+        with self.lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _page(self, uri, key, items, query):
+        if not self.page_size:
+            return items
+        offset = int(query.get('offset', 0))
+        limit = min(int(query.get('limit', self.page_size)), self.page_size)
+        page = items[offset:offset + limit]
+        next_uri = None
+        if offset + limit < len(items):
+            base = re.sub(r'&(offset|limit)=[0-9]*', '', uri.lstrip('/'))
+            next_uri = '/api/v2/{}&limit={}&offset={}'.format(base, limit, offset + limit)
+        return {'offset': offset, 'limit': limit, 'size': len(page), '_links': {'next': next_uri, 'prev': None},
+                key: page}
+
+    def _add_run(self, data, plan_id=None, entry_id=None):
+        run_id = self._new_id()
+        if data.get('include_all'):
+            case_ids = list(self.suites.get(int(data.get('suite_id') or 0), []))
+        else:
+            case_ids = list(data.get('case_ids') or [])
+        self.runs[run_id] = {'id': run_id, 'suite_id': data.get('suite_id'), 'name': data.get('name'),
+                             'plan_id': plan_id, 'entry_id': entry_id, 'case_ids': case_ids,
+                             'include_all': bool(data.get('include_all')), 'is_completed': False}
+        return self.runs[run_id]
+
+    def _add_plan_entry(self, plan, data):
+        entry_id = str(uuid.uuid4())
+        entry = {'id': entry_id, 'suite_id': data.get('suite_id'), 'name': data.get('name'),
+                 'runs': [self._add_run(data, plan['id'], entry_id)]}
+        plan['entries'].append(entry)
+        return entry
+
+    def _plan(self, plan_id):
+        plan = self.plans[plan_id]
+        return dict(plan, entries=[dict(entry, runs=[self.runs[run['id']] for run in entry['runs']])
+                                   for entry in plan['entries']])
+
+    def handle(self, method, uri, data):
+        """ Return ``(status, payload)`` for an API call. """
+        match = URI_PATTERN.match(uri)
+        endpoint, arg, arg2 = match.group('endpoint'), match.group('arg'), match.group('arg2')
+        query = dict(re.findall(r'&([a-z_]+)=([^&]*)', match.group('query')))
+        if endpoint == 'get_suites':
+            return 200, [{'id': suite_id, 'name': 'Suite {}'.format(suite_id)} for suite_id in self.suites]
+        if endpoint == 'get_cases':
+            suite_id = int(query.get('suite_id', 0))
+            time.sleep(self.suite_latency.get(suite_id, 0))
+            cases = [{'id': case_id, 'suite_id': suite_id} for case_id in self.suites.get(suite_id, [])]
+            return 200, self._page(uri, 'cases', cases, query)
+        if endpoint == 'add_run':
+            return 200, self._add_run(data)
+        if endpoint == 'get_run':
+            run = self.runs.get(int(arg))
+            return (200, run) if run else (400, {'error': 'Field :run_id is not a valid test run.'})
+        if endpoint == 'update_run':
+            run = self.runs.get(int(arg))
+            if not run:
+                return 400, {'error': 'Field :run_id is not a valid test run.'}
+            run['case_ids'] = list(data.get('case_ids') or [])
+            run['include_all'] = bool(data.get('include_all'))
+            return 200, run
+        if endpoint == 'close_run':
+            run = self.runs.get(int(arg))
+            if not run:
+                return 400, {'error': 'Field :run_id is not a valid test run.'}
+            run['is_completed'] = True
+            return 200, run
+        if endpoint == 'get_tests':
+            run = self.runs.get(int(arg), {})
+            results = {result['case_id']: result['status_id'] for result in self.results.get(int(arg), [])}
+            tests = [{'id': case_id, 'case_id': case_id, 'status_id': results.get(case_id, 3)}
+                     for case_id in run.get('case_ids', [])]
+            return 200, self._page(uri, 'tests', tests, query)
+        if endpoint == 'add_results_for_cases':
+            if int(arg) not in self.runs:
+                return 400, {'error': 'Field :run_id is not a valid test run.'}
+            self.results.setdefault(int(arg), []).extend(data['results'])
+            return 200, data['results']
+        if endpoint == 'add_plan':
+            plan_id = self._new_id()
+            self.plans[plan_id] = {'id': plan_id, 'name': data.get('name'), 'entries': [], 'is_completed': False}
+            for entry in data.get('entries') or []:
+                self._add_plan_entry(self.plans[plan_id], entry)
+            return 200, self._plan(plan_id)
+        if endpoint in ('get_plan', 'add_plan_entry', 'update_plan_entry', 'close_plan'):
+            if int(arg) not in self.plans:
+                return 400, {'error': 'Field :plan_id is not a valid test plan.'}
+            plan = self.plans[int(arg)]
+            if endpoint == 'add_plan_entry':
+                return 200, self._add_plan_entry(plan, data)
+            if endpoint == 'update_plan_entry':
+                entry = next((entry for entry in plan['entries'] if entry['id'] == arg2), None)
+                if entry is None:
+                    return 400, {'error': 'Field :entry_id is not a valid test plan entry.'}
+                for run in entry['runs']:
+                    self.runs[run['id']]['case_ids'] = list(data.get('case_ids') or [])
+                return 200, dict(entry, runs=[self.runs[run['id']] for run in entry['runs']])
+            if endpoint == 'close_plan':
+                plan['is_completed'] = True
+            return 200, self._plan(int(arg))
+        return 404, {'error': 'Unknown method {}'.format(endpoint)}
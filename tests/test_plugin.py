@@ -1,11 +1,29 @@
 # -*- coding: UTF-8 -*-
+import getpass
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 from datetime import datetime
 from freezegun import freeze_time
-from mock import call, create_autospec
+from mock import Mock, call, create_autospec
 import pytest
+import requests
 from pytest_testrail import vars, plugin
+from pytest_testrail.catalog import CaseCatalog
+from pytest_testrail.catalog_cache import CatalogCache
+from pytest_testrail.coalesce import coalesce_results
+from pytest_testrail.functions import chunk_results, encode_json, pack_result, truncate_comment
+from pytest_testrail.journal import ResultJournal, main as replay_main, read_journal, replay_journal
+from pytest_testrail.metrics import ApiMetrics, endpoint_template
 from pytest_testrail.plugin import PyTestRailPlugin
-from pytest_testrail.testrail_api import APIClient
+from pytest_testrail.publisher import ResultPublisher
+from pytest_testrail.rate_limit import RateLimiter, default_state_file
+from pytest_testrail.results import ResultRecord, ResultStore, split_by_run
+from pytest_testrail.retry import RetryPolicy
+from pytest_testrail.testrail_api import APIClient, PayloadTooLarge
 from pytest_testrail.vars import TESTRAIL_TEST_STATUS
 
 pytest_plugins = "pytester"
@@ -72,6 +90,24 @@ def tr_plugin(api_client):
                             version='1.0.0.0', milestone_id=MILESTONE_ID, custom_comment=CUSTOM_COMMENT)
 
 
+MARKED_TESTS_FILE = """
+    from pytest_testrail import pytestrail
+    @pytestrail.case('C1234', 'C5678')
+    def test_func():
+        pass
+    @pytestrail.case('C8765', 'C4321')
+    @pytestrail.defect('PF-418', 'PF-517')
+    def test_other_func():
+        pass
+"""
+
+
+@pytest.fixture
+def marked_test_items(testdir):
+    testdir.makepyfile(MARKED_TESTS_FILE)
+    return testdir.getitems(MARKED_TESTS_FILE)
+
+
 @pytest.fixture
 def pytest_test_items(testdir):
     testdir.makepyfile(PYTEST_FILE)
@@ -323,6 +359,106 @@ def test_get_available_testruns(api_client, tr_plugin):
     assert tr_plugin.get_available_testruns(testplan_id) == [59, 61]
 
 
+def test_read_cache(api_client, tr_plugin):
+    """ Lookups are downloaded once, until a POST request changes them """
+    cache = tr_plugin.testrail_data.read_cache
+    api_client.send_get.return_value = TESTPLAN
+    assert tr_plugin.get_available_testruns(58) == [59, 61]
+    assert tr_plugin.get_testplan_entry_id(58, '61') == TESTPLAN['entries'][2]['id']
+    assert tr_plugin.get_run(61) == TESTPLAN
+    assert tr_plugin.get_run('61') == TESTPLAN
+    assert api_client.send_get.call_count == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    api_client.send_post.return_value = {}
+    tr_plugin.close_test_run(60)  # changes its plan, not the other runs
+    tr_plugin.get_plan(58)
+    tr_plugin.get_run(61)
+    assert api_client.send_get.call_count == 3
+
+    tr_plugin.update_testplan_entry(58, TESTPLAN['entries'][2]['id'], 61, [1], SUITE_ID, save_previous=False)
+    tr_plugin.get_plan(58)
+    tr_plugin.get_run(61)
+    assert api_client.send_get.call_count == 5
+    assert (cache.hits, cache.misses) == (3, 5)
+
+    # errors are not kept
+    api_client.send_get.return_value = {'error': 'An error occured'}
+    tr_plugin.get_run(62)
+    tr_plugin.get_run(62)
+    assert api_client.send_get.call_count == 7
+
+
+def test_read_cache_tests_of_run(api_client, tr_plugin):
+    tests = [{'case_id': 1, 'status_id': TESTRAIL_TEST_STATUS['blocked']}]
+    api_client.send_get.return_value = tests
+    api_client.send_post.return_value = {}
+    # the tests of a run are streamed, not kept in the read cache
+    assert tr_plugin.get_tests(10) == tests
+    assert tr_plugin.get_tests(10) == tests
+    assert api_client.send_get.call_count == 2
+    assert len(tr_plugin.testrail_data.read_cache) == 0
+
+    # their statuses are downloaded once for the update of the run and the filtering of blocked testcases
+    tr_plugin.update_testrun(10, [2], SUITE_ID, save_previous=True)
+    assert api_client.send_get.call_count == 3
+    tr_plugin.testrail_data.publish_blocked = False
+    tr_plugin._add_results(10, [tr_plugin.add_result(1, 1), tr_plugin.add_result(2, 1)])
+    assert api_client.send_get.call_count == 3
+    assert [entry['case_id'] for entry in api_client.send_post.call_args[0][1]['results']] == [2]
+
+
+@pytest.mark.parametrize('plan', [False, True], ids=['testrun', 'testplan-entry'])
+def test_update_existing_run_with_new_cases_only(api_client, tr_plugin, plan):
+    def update(tr_keys):
+        if plan:
+            tr_plugin.update_testplan_entry(58, 'entry', 10, tr_keys, SUITE_ID)
+        else:
+            tr_plugin.update_testrun(10, tr_keys, SUITE_ID)
+
+    tests = [{'case_id': 3, 'status_id': TESTRAIL_TEST_STATUS['passed']},
+             {'case_id': 1, 'status_id': TESTRAIL_TEST_STATUS['blocked']}]
+    api_client.send_get.side_effect = lambda uri, **kwargs: tests if uri.startswith('get_tests') else \
+        {'id': 10, 'include_all': False}
+    api_client.send_post.return_value = {}
+    tr_plugin.testrail_data.include_all = False
+
+    # all the collected cases are in the run already
+    update([1, 3])
+    api_client.send_post.assert_not_called()
+    assert tr_plugin.testrail_data.plan_entry_storage[SUITE_ID]['case_ids'] == [1, 3]
+
+    update([3, 2, 4])
+    assert api_client.send_post.call_args[0][1] == {'case_ids': [1, 2, 3, 4], 'include_all': False}
+    assert tr_plugin.testrail_data.plan_entry_storage[SUITE_ID]['case_ids'] == [1, 2, 3, 4]
+
+    # the tests of the run are downloaded once, and reused to exclude the blocked cases
+    tr_plugin.testrail_data.publish_blocked = False
+    tr_plugin._add_results(10, [tr_plugin.add_result(case_id, 1) for case_id in (1, 2, 4)])
+    assert [entry['case_id'] for entry in api_client.send_post.call_args[0][1]['results']] == [2, 4]
+    assert [c[0][0] for c in api_client.send_get.call_args_list].count(vars.GET_TESTS_URL.format(10)) == 1
+
+
+def test_case_statuses_kept_after_complete_download(api_client, tr_plugin):
+    pages = [
+        {'offset': 0, 'limit': 1, 'size': 1, 'tests': [{'case_id': 1, 'status_id': 1}],
+         '_links': {'next': '/api/v2/get_tests/10&limit=1&offset=1', 'prev': None}},
+        {'error': 'An error occured'},
+    ]
+    api_client.send_get.side_effect = lambda uri, **kwargs: pages[api_client.send_get.call_count - 1]
+    # the second page failed, the statuses received are not kept
+    assert tr_plugin.get_case_statuses(10) == {1: 1}
+    assert tr_plugin.testrail_data.run_case_statuses == {}
+
+    pages.extend([{'offset': 0, 'limit': 1, 'size': 1, 'tests': [{'case_id': 1, 'status_id': 1}],
+                   '_links': {'next': '/api/v2/get_tests/10&limit=1&offset=1', 'prev': None}},
+                  {'offset': 1, 'limit': 1, 'size': 1, 'tests': [{'case_id': 2, 'status_id': 5}],
+                   '_links': {'next': None, 'prev': '/api/v2/get_tests/10&limit=1&offset=0'}}])
+    assert tr_plugin.get_case_statuses(10) == {1: 1, 2: 5}
+    assert tr_plugin.get_case_statuses(10) == {1: 1, 2: 5}
+    assert api_client.send_get.call_count == 4
+
+
 def test_close_test_run(api_client, tr_plugin):
     tr_plugin.results = [
         {'case_id': 1234, 'status_id': TESTRAIL_TEST_STATUS["failed"], 'duration': 2.6, 'defects':None},
@@ -458,3 +594,844 @@ def test_api_client_timeout(api_client):
 
     api_client.send_post('/timeout', data={"body": "body"}, timeout=None)
     api_client.send_post.assert_called_with('/timeout', data={"body": "body"}, timeout=None)
+
+
+def test_api_client_session_reused_and_closed():
+    client = APIClient('http://testrail.local/', 'user', 'password', pool_size=4, timeout='20', connect_timeout=5)
+    session = client.session
+    assert client.session is session
+    assert session.auth == ('user', 'password')
+    assert session.get_adapter('http://testrail.local/')._pool_maxsize == 4
+    assert client.timeout == (5.0, 20.0)
+
+    client.close()
+    assert client._session is None
+    assert client.session is not session
+    client.close()
+
+
+def _response(status, body=None, headers=None):
+    response = Mock(status_code=status, reason='Reason', headers=headers or {}, content=b'')
+    response.json.side_effect = (lambda: body) if body is not None else ValueError
+    return response
+
+
+@pytest.fixture
+def retrying_client():
+    policy = RetryPolicy(max_retries=3, backoff=0.5)
+    policy.sleep = Mock()
+    client = APIClient('http://testrail.local/', 'user', 'password', retry_policy=policy)
+    client._session = Mock()
+    return client
+
+
+def test_api_client_retries_transient_errors(retrying_client):
+    retrying_client._session.request.side_effect = [
+        requests.exceptions.ReadTimeout(), _response(502), _response(429, headers={'Retry-After': '2'}),
+        _response(200, {'id': 1})]
+
+    assert retrying_client.send_get('get_run/1') == {'id': 1}
+    assert retrying_client._session.request.call_count == 4
+    assert retrying_client.retries == {'ReadTimeout': 1, 502: 1, 429: 1}
+    sleeps = [c[0][0] for c in retrying_client.retry_policy.sleep.call_args_list]
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1 and sleeps[2] == 2
+
+
+def test_api_client_retries_posts_only_when_safe(retrying_client):
+    request = retrying_client._session.request
+    request.side_effect = [_response(502), _response(200, {})]
+    assert retrying_client.send_post('add_results_for_cases/1', {}) == {'error': '502 Reason'}
+    assert request.call_count == 1
+
+    request.reset_mock(side_effect=True)
+    request.side_effect = [_response(502), _response(200, {})]
+    assert retrying_client.send_post('update_run/1', {}) == {}
+    assert request.call_count == 2
+
+    request.reset_mock(side_effect=True)
+    request.side_effect = [_response(429), _response(200, {})]
+    assert retrying_client.send_post('add_run/1', {}) == {}
+    assert request.call_count == 2
+
+    request.reset_mock(side_effect=True)
+    request.side_effect = [requests.exceptions.ConnectTimeout(), requests.exceptions.ReadTimeout()]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        retrying_client.send_post('add_results_for_cases/1', {})
+    assert request.call_count == 2
+
+
+def test_api_client_stops_retrying(retrying_client):
+    retrying_client._session.request.return_value = _response(503)
+    assert retrying_client.send_get('get_run/1') == {'error': '503 Reason'}
+    assert retrying_client._session.request.call_count == 4
+
+    retrying_client._session.request.reset_mock()
+    retrying_client.retry_policy.deadline = 10
+    retrying_client._session.request.return_value = _response(429, headers={'Retry-After': '60'})
+    assert retrying_client.send_get('get_run/1') == {'error': '429 Reason'}
+    assert retrying_client._session.request.call_count == 1
+
+
+def test_get_case_ids_by_suites(api_client, tr_plugin):
+    def send_get(uri, **kwargs):
+        suite_id = int(uri.split('suite_id=')[1].split('&')[0])
+        return [{'id': suite_id * 10 + i} for i in range(3)]
+
+    api_client.send_get.side_effect = send_get
+    cases = tr_plugin.get_case_ids_by_suites(PROJECT_ID, {3, 1, 2}, concurrency=3)
+
+    assert list(cases) == [1, 2, 3]
+    assert cases[2] == [20, 21, 22]
+    assert api_client.send_get.call_count == 3
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_iter_tests_follows_pagination(api_client, tr_plugin, prefetch):
+    pages = {
+        vars.GET_TESTS_URL.format(10): {
+            'offset': 0, 'limit': 2, 'size': 2,
+            '_links': {'next': '/api/v2/get_tests/10&limit=2&offset=2', 'prev': None},
+            'tests': [{'case_id': 1}, {'case_id': 2}]
+        },
+        'get_tests/10&limit=2&offset=2': {
+            'offset': 2, 'limit': 2, 'size': 1,
+            '_links': {'next': None, 'prev': '/api/v2/get_tests/10&limit=2&offset=0'},
+            'tests': [{'case_id': 3}]
+        },
+    }
+    api_client.send_get.side_effect = lambda uri, **kwargs: pages[uri]
+
+    assert [test['case_id'] for test in tr_plugin.iter_tests(10, prefetch=prefetch)] == [1, 2, 3]
+    assert api_client.send_get.call_count == 2
+
+
+def test_iter_cases_bare_list_and_error(api_client, tr_plugin):
+    api_client.send_get.return_value = [{'id': 1}, {'id': 2}]
+    assert [case['id'] for case in tr_plugin.iter_cases(PROJECT_ID, SUITE_ID)] == [1, 2]
+    api_client.send_get.assert_called_once_with(vars.GET_TESTCASES_URL.format(PROJECT_ID, SUITE_ID), cert_check=True)
+
+    api_client.send_get.return_value = {'error': 'Field :suite_id is not a valid test suite.'}
+    assert tr_plugin.get_cases(PROJECT_ID, SUITE_ID) == []
+
+
+def test_catalog_cache_delta_and_eviction(tmp_path):
+    cache = CatalogCache(tmp_path / 'catalog.sqlite3', 'http://testrail.local/', ttl=3600, max_cases=5)
+    assert cache.get_case_ids(PROJECT_ID, 1) is None
+
+    cache.store_case_ids(PROJECT_ID, 1, [1, 2, 3], fetched_at=time.time() - 10)
+    cache.store_case_ids(PROJECT_ID, 2, [4, 5], fetched_at=time.time())
+    case_ids, updated_at = cache.get_case_ids(PROJECT_ID, 1)
+    assert case_ids == [1, 2, 3]
+
+    changed = [{'id': 2, 'suite_id': 1, 'is_deleted': 1}, {'id': 3, 'suite_id': 2}, {'id': 6, 'suite_id': 1}]
+    assert cache.apply_delta(PROJECT_ID, 1, changed) == [1, 6]
+
+    # suite 2 is the least recently used catalog and is evicted when the cache grows over max_cases
+    cache.store_case_ids(PROJECT_ID, 3, [7, 8, 9])
+    assert cache.get_case_ids(PROJECT_ID, 2) is None
+    assert cache.get_case_ids(PROJECT_ID, 1)[0] == [1, 6]
+
+    cache.store_suites(PROJECT_ID, {1: 'Suite 1'}, fetched_at=time.time() - 7200)
+    assert cache.get_suites(PROJECT_ID) is None
+    cache.close()
+
+
+def test_warm_catalog_cache_requests_delta_only(api_client, tr_plugin, tmp_path):
+    tr_plugin.testrail_data.catalog_cache = CatalogCache(tmp_path / 'catalog.sqlite3', 'http://testrail.local/')
+    api_client.send_get.return_value = [{'id': 1, 'suite_id': SUITE_ID}, {'id': 2, 'suite_id': SUITE_ID}]
+    assert tr_plugin.get_case_ids_by_suites(PROJECT_ID, [SUITE_ID]) == {SUITE_ID: [1, 2]}
+    api_client.send_get.assert_called_once_with(vars.GET_TESTCASES_URL.format(PROJECT_ID, SUITE_ID), cert_check=True)
+
+    api_client.send_get.reset_mock()
+    api_client.send_get.return_value = [{'id': 3, 'suite_id': SUITE_ID}]
+    assert tr_plugin.get_case_ids_by_suites(PROJECT_ID, [SUITE_ID]) == {SUITE_ID: [1, 2, 3]}
+    assert api_client.send_get.call_count == 1
+    assert '&updated_after=' in api_client.send_get.call_args[0][0]
+
+
+def test_result_publisher_flushes_batches():
+    published = []
+    publisher = ResultPublisher(lambda run_id, results: published.append((run_id, list(results))) or len(results),
+                                batch_size=2, flush_interval=60, queue_size=1).start()
+    for case_id in (1, 2, 3):
+        publisher.put(10, {'case_id': case_id})
+    publisher.put(11, {'case_id': 4})
+    assert publisher.close(timeout=5)
+
+    assert published == [(10, [{'case_id': 1}, {'case_id': 2}]), (10, [{'case_id': 3}]), (11, [{'case_id': 4}])]
+    assert publisher.published == 4
+
+
+def test_result_publisher_flushes_old_results():
+    published = []
+    publisher = ResultPublisher(lambda run_id, results: published.append(len(results)) or len(results),
+                                batch_size=100, flush_interval=0.05).start()
+    publisher.put(10, {'case_id': 1})
+    deadline = time.time() + 5
+    while not published and time.time() < deadline:
+        time.sleep(0.01)
+    assert published == [1]
+    assert publisher.close(timeout=5)
+
+
+def test_result_publisher_stops_on_error():
+    published = []
+    server_down = [True]
+
+    def publish(run_id, results):
+        if run_id == 11:
+            raise ValueError('bad request')
+        if run_id == 12 and server_down:
+            server_down.pop()
+            raise requests.exceptions.ConnectionError('server down')
+        published.append(run_id)
+        return len(results)
+
+    publisher = ResultPublisher(publish, batch_size=1, flush_interval=60).start()
+    # the next batches are published after a transient error
+    for run_id in (12, 10, 11):
+        assert publisher.put(run_id, {'case_id': 1})
+    publisher._thread.join(5)
+    assert publisher.put(10, {'case_id': 2}) is False
+    assert publisher.close(timeout=5)
+
+    # the batch failing with a transient error is sent again when closing
+    assert published == [10, 12]
+    assert (publisher.published, publisher.dropped) == (2, 2)
+    assert isinstance(publisher.failure, ValueError)
+    assert [type(error) for error in publisher.errors] == [requests.exceptions.ConnectionError, ValueError]
+
+
+def test_result_publisher_counts_accepted_results(api_client, tr_plugin):
+    api_client.send_post.side_effect = [{}, {'error': 'Field :results cannot be empty'}]
+    publisher = ResultPublisher(tr_plugin._add_results, batch_size=2, flush_interval=60).start()
+    for case_id in (1, 2, 3, 4):
+        publisher.put(10, tr_plugin.add_result(case_id, TESTRAIL_TEST_STATUS['passed']))
+    assert publisher.close(timeout=5)
+    assert (publisher.published, publisher.dropped) == (2, 0)
+
+
+def test_stream_results_stop_session_on_error(api_client, tr_plugin):
+    tr_plugin.testrail_data.stream_batch_size = 1
+    tr_plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': 10, 'testplan_entry_id': None,
+                                                             'case_ids': [1]}}
+    tr_plugin.testrail_data.actual_suites_with_case_ids = {SUITE_ID: [1]}
+    tr_plugin.testrail_data.item_index = {'test_func': ([1], None, None)}
+    api_client.send_post.side_effect = ValueError('bad request')
+    tr_plugin._start_result_publisher()
+    item = Mock(nodeid='test_func', session=Mock(shouldstop=False))
+
+    def report():
+        rep = Mock(when='call', failed=False, skipped=False, outcome='passed', duration=1, sections=[])
+        hook = tr_plugin.pytest_runtest_makereport(item, None)
+        next(hook)
+        with pytest.raises(StopIteration):
+            hook.send(Mock(get_result=lambda: rep))
+
+    report()
+    tr_plugin.result_publisher._thread.join(5)
+    report()
+    assert item.session.shouldstop == "[testrail] Results can not be published: ValueError('bad request')"
+    terminalreporter = Mock()
+    api_client.retries = {}
+    tr_plugin.pytest_terminal_summary(terminalreporter)
+    assert 'stopped on error' in terminalreporter.write_line.call_args_list[0][0][0]
+    tr_plugin._publish_session_results()
+
+
+def test_stream_results_in_makereport(api_client, tr_plugin):
+    tr_plugin.testrail_data.stream_results = True
+    tr_plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': 10, 'testplan_entry_id': None,
+                                                             'case_ids': [1]}}
+    tr_plugin._start_result_publisher()
+    tr_plugin._store_result(None, tr_plugin.add_result(1, TESTRAIL_TEST_STATUS['passed'], suite_id=SUITE_ID))
+    tr_plugin._publish_session_results()
+
+    assert len(tr_plugin.testrail_data.results) == 0
+    assert api_client.send_post.call_args[0][0] == vars.ADD_RESULTS_URL.format(10)
+    assert api_client.send_post.call_args[0][1]['results'][0]['case_id'] == 1
+
+
+def test_publish_session_results_without_streaming(api_client, tr_plugin):
+    tr_plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': 10, 'testplan_entry_id': None,
+                                                             'case_ids': [1]}}
+    tr_plugin._store_result(None, tr_plugin.add_result(1, TESTRAIL_TEST_STATUS['passed'], suite_id=SUITE_ID))
+    tr_plugin._publish_session_results()
+
+    api_client.send_post.assert_called_once()
+    assert api_client.send_post.call_args[0][0] == vars.ADD_RESULTS_URL.format(10)
+
+
+def test_publish_worker_results_on_controller(api_client, tr_plugin):
+    tr_plugin.testrail_data.publish_on_controller = True
+    tr_plugin.send_results_to_controller = True
+    tr_plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': 10, 'testplan_entry_id': None,
+                                                             'case_ids': [1, 2]}}
+
+    class Report:
+        pass
+
+    reports = []
+    for case_id in (1, 2, 2):
+        rep = Report()
+        rep.testrail_results = []
+        tr_plugin._store_result(rep, tr_plugin.add_result(case_id, TESTRAIL_TEST_STATUS['passed'], suite_id=SUITE_ID,
+                                                          test_parametrize={'param': 1}, test_comments=['note']))
+        # simulate the serialization between worker and controller
+        rep.testrail_results = [list(record) for record in rep.testrail_results]
+        reports.append(rep)
+    assert len(tr_plugin.testrail_data.results) == 0
+
+    node_action = plugin.NodeAction(tr_plugin.testrail_data)
+    for rep in reports:
+        node_action.pytest_runtest_logreport(rep)
+    tr_plugin.publish_worker_results()
+
+    api_client.send_post.assert_called_once()
+    uri, data = api_client.send_post.call_args[0]
+    assert uri == vars.ADD_RESULTS_URL.format(10)
+    assert [entry['case_id'] for entry in data['results']] == [1, 2]
+    assert "{'param': 1}" in data['results'][0]['comment']
+
+
+def test_worker_results_with_same_hash_kept(monkeypatch, tr_plugin):
+    tr_plugin.testrail_data.worker_results = ResultStore(spill_threshold=1)
+    monkeypatch.setattr(plugin, 'hash', lambda record: 0, raising=False)
+
+    class Report:
+        pass
+
+    node_action = plugin.NodeAction(tr_plugin.testrail_data)
+    for case_id in (1, 2, 2):
+        rep = Report()
+        rep.testrail_results = [pack_result(10, tr_plugin.add_result(case_id, TESTRAIL_TEST_STATUS['passed']))]
+        node_action.pytest_runtest_logreport(rep)
+
+    # different records, even with the same hash, but no duplicate
+    assert [result.case_id for result in tr_plugin.testrail_data.worker_results] == [1, 2]
+    tr_plugin.testrail_data.worker_results.close()
+
+
+@pytest.mark.parametrize('worker', [False, True], ids=['controller', 'worker'])
+def test_node_action_registered_on_controller_only(tr_plugin, worker):
+    config = Mock(spec=['pluginmanager', 'workerinput'] if worker else ['pluginmanager'])
+    config.pluginmanager.hasplugin.return_value = True
+    tr_plugin.pytest_configure(config)
+    assert config.pluginmanager.register.called is not worker
+
+
+def test_result_record():
+    result = ResultRecord(1, 5, 'failed', 2, 'PF-1', {'param': 1}, suite_id=3, test_comments=['note'])
+    assert result['case_id'] == 1 and result.get('suite_id') == 3 and result.get('unknown', 'x') == 'x'
+    result['journal_seq'] = 7
+    assert result.journal_seq == 7
+    with pytest.raises(KeyError):
+        result['unknown']
+    with pytest.raises(AttributeError):
+        result.unknown = 1
+    assert ResultRecord(*result.pack()) == ResultRecord(1, 5, 'failed', 2, 'PF-1', "{'param': 1}", 3, ('note',),
+                                                        journal_seq=7)
+    # shared with the other records
+    assert ResultRecord(2, 5, defects='PF-1'.join(['', ''])).defects is result.defects
+
+
+def test_result_store_spills_to_disk():
+    store = ResultStore(spill_threshold=3)
+    results = [ResultRecord(case_id, 1, suite_id=1) for case_id in range(7)]
+    for result in results:
+        store.append(result)
+    assert len(store) == 7
+    assert len(store._records) == 1
+    path = store.path
+    with open(path) as spill_file:
+        assert len(spill_file.readlines()) == 6
+    assert list(store) == results
+    # can be read again
+    assert [result.case_id for result in store] == list(range(7))
+    store.close()
+    assert not os.path.exists(path)
+    assert len(store) == 0 and list(store) == []
+
+
+def test_split_by_run():
+    store = ResultStore(spill_threshold=2)
+    for case_id in range(5):
+        store.append(ResultRecord(case_id, 1, run_id=10 + case_id % 2))
+    runs = split_by_run(store, lambda result: result.run_id if result.case_id else None)
+
+    assert {run_id: [result.case_id for result in run_results] for run_id, run_results in runs.items()} == {
+        11: [1, 3], 10: [2, 4]}
+    assert list(runs) == [11, 10]
+    # each testrun spills to its own file
+    assert runs[10].path and runs[11].path and runs[10].path != runs[11].path
+    store.close()
+    for run_results in runs.values():
+        run_results.close()
+
+
+def test_publish_results_from_spilled_store(api_client, tr_plugin):
+    tr_plugin.testrail_data.plan_entry_storage = {SUITE_ID: {'testrun_id': 10, 'testplan_entry_id': None,
+                                                             'case_ids': [1, 2, 3]},
+                                                  2: {'testrun_id': 11, 'testplan_entry_id': None, 'case_ids': [4]}}
+    tr_plugin.testrail_data.results = store = ResultStore(spill_threshold=2)
+    for case_id, suite_id in ((3, SUITE_ID), (4, 2), (1, SUITE_ID), (2, SUITE_ID)):
+        tr_plugin._store_result(None, tr_plugin.add_result(case_id, TESTRAIL_TEST_STATUS['passed'], suite_id=suite_id))
+    assert store.path
+    tr_plugin.publish_results(tr_plugin.testrail_data, store)
+
+    assert [(args[0], [entry['case_id'] for entry in args[1]['results']])
+            for args, _ in api_client.send_post.call_args_list] == [(vars.ADD_RESULTS_URL.format(10), [3, 1, 2]),
+                                                                    (vars.ADD_RESULTS_URL.format(11), [4])]
+    store.close()
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('worst', [(2, 1, ''), (1, 5, 'first failure')]),
+    ('last', [(2, 1, ''), (1, 1, '')]),
+])
+def test_coalesce_results(policy, expected):
+    results = [ResultRecord(1, 5, 'first failure', 1, journal_seq=1),
+               ResultRecord(2, 1, journal_seq=2),
+               ResultRecord(1, 2, 'skipped', 1, journal_seq=3),
+               ResultRecord(1, 1, '', 2, journal_seq=4)]
+    coalesced = list(coalesce_results(results, policy))
+    assert [(result.case_id, result.status_id, result.comment) for result in coalesced] == expected
+    assert coalesced[0].journal_seq == 2
+    assert coalesced[1].journal_seq == (1, 3, 4)
+
+
+def test_coalesce_results_from_spilled_store(api_client, tr_plugin):
+    tr_plugin.testrail_data.coalesce = 'worst'
+    store = ResultStore(spill_threshold=2)
+    for case_id, status_id in ((1, 1), (2, 1), (1, 5), (3, 1), (2, 1)):
+        store.append(tr_plugin.add_result(case_id, status_id))
+    tr_plugin._add_results(10, store)
+
+    entries = api_client.send_post.call_args[0][1]['results']
+    assert [(entry['case_id'], entry['status_id']) for entry in entries] == [(1, 5), (3, 1), (2, 1)]
+    store.close()
+
+
+def test_coalesce_results_aggregate(api_client, tr_plugin):
+    tr_plugin.testrail_data.coalesce = 'aggregate'
+    results = [tr_plugin.add_result(1, 1, duration=1.5, test_parametrize={'x': 1}, defects='PF-1'),
+               tr_plugin.add_result(1, 5, 'E   assert 0', duration=2.5, test_parametrize={'x': 2},
+                                    defects='PF-1, PF-2', test_comments=['note']),
+               tr_plugin.add_result(2, 1, duration=1)]
+    tr_plugin._add_results(10, results)
+
+    entries = api_client.send_post.call_args[0][1]['results']
+    assert [(entry['case_id'], entry['status_id'], entry['elapsed']) for entry in entries] == [
+        (1, 5, '4s'), (2, 1, '1s')]
+    assert entries[0]['defects'] == 'PF-1, PF-2'
+    assert entries[0]['comment'] == ("# Test parametrize: #\n"
+                                     "2 results: 1 passed, 1 failed\n"
+                                     "passed: {'x': 1} (1.50s)\n"
+                                     "failed: {'x': 2} (2.50s)\n\n"
+                                     "# Test comments: #\nnote\n\n"
+                                     "# Pytest result: #\n    E   assert 0" + CUSTOM_COMMENT + "\n")
+    with pytest.raises(ValueError):
+        coalesce_results(results, 'best')
+
+
+def test_coalesce_policy_of_ini_file_checked_at_startup(testdir):
+    testdir.makeini('[pytest]\ntr-coalesce = best\n')
+    testdir.makepyfile('def test_func():\n    pass\n')
+    result = testdir.runpytest('-p', 'pytest_testrail.conftest', '--testrail', '--tr-url', 'http://127.0.0.1:9',
+                               '--tr-email', 'user', '--tr-password', 'password')
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(['*Unknown coalescing policy "best", expected one of: worst, last, aggregate'])
+
+
+def test_create_plan_with_entries_in_single_request(api_client, tr_plugin):
+    tr_plugin.testrail_data.testplan_name = 'Plan'
+    tr_plugin.testrail_data.testplan_single_request = True
+    tr_plugin.testrail_data.actual_suites_with_case_ids = {1: [10, 11], 2: [], 3: [30]}
+    tr_plugin.testrail_data.available_suite_ids = {1: 'Suite 1', 2: 'Suite 2', 3: 'Suite 3'}
+    api_client.send_post.return_value = {'id': 100, 'entries': [{'id': 'a', 'suite_id': 1, 'runs': [{'id': 101}]},
+                                                                {'id': 'b', 'suite_id': 3, 'runs': [{'id': 103}]}]}
+    tr_plugin._create_report_entries()
+
+    api_client.send_post.assert_called_once()
+    uri, data = api_client.send_post.call_args[0]
+    assert uri == vars.ADD_TESTPLAN_URL.format(PROJECT_ID)
+    assert [(entry['suite_id'], entry['case_ids']) for entry in data['entries']] == [(1, [10, 11]), (3, [30])]
+    assert data['entries'][1]['name'].startswith('[ Suite 3 ] ')
+    assert tr_plugin.testrail_data.testplan_id == 100
+    assert tr_plugin.testrail_data.plan_entry_storage == {
+        1: {'testplan_entry_id': 'a', 'testrun_id': 101, 'case_ids': [10, 11]},
+        3: {'testplan_entry_id': 'b', 'testrun_id': 103, 'case_ids': [30]}}
+
+
+def test_create_testruns_in_parallel(api_client, tr_plugin, capsys):
+    tr_plugin.testrail_data.create_concurrency = 4
+    tr_plugin.testrail_data.actual_suites_with_case_ids = {1: [10], 2: [20], 3: [30], 4: [40]}
+    tr_plugin.testrail_data.available_suite_ids = {1: 'S1', 2: 'S2', 3: 'S3', 4: 'S4'}
+
+    def send_post(uri, data, cert_check=None):
+        # the first suites are answered last
+        time.sleep(0.05 * (4 - data['suite_id']))
+        if data['suite_id'] == 2:
+            return {'error': 'Invalid case ids'}
+        return {'id': data['suite_id'] * 100}
+
+    api_client.send_post.side_effect = send_post
+    tr_plugin._create_report_entries()
+
+    assert {suite_id: entry['testrun_id'] for suite_id, entry in tr_plugin.testrail_data.plan_entry_storage.items()
+            } == {1: 100, 3: 300, 4: 400}
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(' and ID=')[-1] for line in lines if 'New testrun created' in line] == ['100', '300', '400']
+    assert lines[-1] == '[testrail] 1 of 4 testruns not created: suite 2: Invalid case ids'
+
+
+def test_create_entries_reports_all_failures(api_client, tr_plugin, capsys):
+    api_client.send_post.side_effect = [requests.exceptions.ConnectionError('refused'), {'id': 11}]
+    creations = [('add_run/1', {'suite_id': 1, 'name': 'run 1', 'case_ids': [1]}, tr_plugin._record_test_run),
+                 ('add_run/1', {'suite_id': 2, 'name': 'run 2', 'case_ids': [2]}, tr_plugin._record_test_run)]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        tr_plugin.create_entries(creations)
+
+    assert tr_plugin.testrail_data.plan_entry_storage[2]['testrun_id'] == 11
+    assert '1 of 2 testruns not created: suite 1: refused' in capsys.readouterr().out
+
+
+def test_pack_catalog_roundtrip():
+    catalog = plugin.pack_catalog({1: 'Suite 1', 2: 'Suite 2'}, {1: [10, 2 ** 40], 2: []})
+    assert isinstance(catalog['cases'][0][1], bytes)
+    assert plugin.unpack_catalog(catalog) == ({1: 'Suite 1', 2: 'Suite 2'}, {1: [10, 2 ** 40], 2: []})
+
+
+def test_workers_share_catalog_and_testruns(api_client, marked_test_items, tmp_path):
+    workers = [PyTestRailPlugin(api_client, ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, True, TR_NAME)
+               for _ in range(2)]
+    for worker in workers:
+        worker.testrail_data.catalog = plugin.pack_catalog({SUITE_ID: 'Suite'}, {SUITE_ID: [1234, 5678]})
+        worker.testrail_data.entries_file = str(tmp_path / 'entries.json')
+    api_client.send_post.return_value = {'id': 42}
+
+    for worker in workers:
+        worker.pytest_collection_modifyitems(None, None, marked_test_items)
+
+    api_client.send_get.assert_not_called()
+    api_client.send_post.assert_called_once()
+    assert api_client.send_post.call_args[0][0] == vars.ADD_TESTRUN_URL.format(PROJECT_ID)
+    assert workers[1].testrail_data.plan_entry_storage[SUITE_ID]['testrun_id'] == 42
+    assert workers[1].testrail_data.diff_case_ids == [4321, 8765]
+
+
+def test_case_catalog():
+    catalog = CaseCatalog({10: [1, 2], 20: [3]})
+    catalog.add_suite(20, [4])
+    catalog.add_item(3, 'item')
+
+    assert 4 in catalog and 5 not in catalog
+    assert len(catalog) == 4
+    assert catalog.suite_of(2) == 10
+    assert catalog.suite_of(4) == 20
+    assert catalog.suite_of(5) == 0
+    assert catalog.case_ids(20) == {3, 4}
+    assert catalog.suite_ids == [10, 20]
+    assert catalog.items_of(3) == ['item']
+    assert catalog.items_of(1) == []
+
+
+def test_skip_missing_uses_case_catalog(api_client, marked_test_items):
+    my_plugin = PyTestRailPlugin(api_client, ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, True, TR_NAME,
+                                 skip_missing=True)
+    api_client.send_get.side_effect = lambda uri, **kwargs: (
+        [{'id': SUITE_ID, 'name': 'Suite'}] if uri.startswith('get_suites') else [{'id': 1234}, {'id': 5678}])
+    api_client.send_post.return_value = {'id': 10}
+
+    my_plugin.pytest_collection_modifyitems(None, None, marked_test_items)
+
+    assert my_plugin.testrail_data.diff_case_ids == [4321, 8765]
+    assert my_plugin.testrail_data.case_catalog.suite_of(5678) == SUITE_ID
+    assert not marked_test_items[0].get_closest_marker('skip')
+    assert marked_test_items[1].get_closest_marker('skip')
+    assert api_client.send_post.call_args[0][1]['case_ids'] == [1234, 5678]
+
+
+def test_catalog_prefetched_during_collection(api_client, marked_test_items):
+    my_plugin = PyTestRailPlugin(api_client, ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, True, TR_NAME)
+    api_client.send_get.side_effect = lambda uri, **kwargs: (
+        [{'id': SUITE_ID, 'name': 'Suite'}] if uri.startswith('get_suites') else [{'id': 1234}, {'id': 5678}])
+    api_client.send_post.return_value = {'id': 10}
+
+    my_plugin._start_catalog_prefetch()
+    assert my_plugin._catalog_prefetch.result() == ({SUITE_ID: 'Suite'}, {SUITE_ID: [1234, 5678]})
+    assert api_client.send_get.call_count == 2
+    my_plugin.pytest_collection_modifyitems(None, None, marked_test_items)
+
+    assert api_client.send_get.call_count == 2
+    assert my_plugin.testrail_data.actual_suites_with_case_ids == {SUITE_ID: [1234, 5678]}
+    assert my_plugin.testrail_data.diff_case_ids == [4321, 8765]
+
+
+def test_catalog_prefetch_does_not_hold_exit(api_client):
+    my_plugin = PyTestRailPlugin(api_client, ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, True, TR_NAME)
+    released = threading.Event()
+    api_client.send_get.side_effect = lambda uri, **kwargs: released.wait() and []
+
+    my_plugin._start_catalog_prefetch()
+    prefetch_thread = next(thread for thread in threading.enumerate() if thread.name == 'testrail-prefetch')
+    assert prefetch_thread.daemon
+    released.set()
+    assert my_plugin._catalog_prefetch.result() == ({}, {SUITE_ID: []})
+
+
+def test_makereport_reads_item_index(api_client, marked_test_items):
+    my_plugin = PyTestRailPlugin(api_client, ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, True, TR_NAME)
+    api_client.send_get.side_effect = lambda uri, **kwargs: (
+        [{'id': SUITE_ID, 'name': 'Suite'}] if uri.startswith('get_suites') else [{'id': 8765}, {'id': 4321}])
+    api_client.send_post.return_value = {'id': 10}
+    my_plugin.pytest_collection_modifyitems(None, None, marked_test_items)
+    assert my_plugin.testrail_data.item_index[marked_test_items[1].nodeid] == ([8765, 4321], 'PF-418, PF-517', None)
+
+    def report(item, when):
+        rep = Mock(when=when, failed=False, skipped=False, outcome='passed', duration=1, sections=[])
+        hook = my_plugin.pytest_runtest_makereport(item, None)
+        next(hook)
+        with pytest.raises(StopIteration):
+            hook.send(Mock(get_result=lambda: rep))
+
+    report(marked_test_items[1], 'setup')
+    report(Mock(nodeid='test_unmarked'), 'call')
+    assert len(my_plugin.testrail_data.results) == 0
+    report(marked_test_items[1], 'call')
+    assert [(result['case_id'], result['defects']) for result in my_plugin.testrail_data.results] == \
+        [(8765, 'PF-418, PF-517'), (4321, 'PF-418, PF-517')]
+
+
+def test_chunk_results_respects_byte_limit():
+    entries = [{'case_id': case_id, 'status_id': 1, 'comment': u'é' * (case_id % 7)} for case_id in range(200)]
+    chunks = list(chunk_results(entries, byte_limit=1024))
+
+    assert [entry for chunk in chunks for entry in chunk['results']] == entries
+    assert all(len(encode_json(chunk)) <= 1024 for chunk in chunks)
+    # Chunks are filled up: the next entry would not fit in the previous chunk
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        assert len(encode_json({'results': chunk['results'] + next_chunk['results'][:1]})) > 1024
+
+    assert [len(chunk['results']) for chunk in chunk_results(entries, max_results=80)] == [80, 80, 40]
+    assert list(chunk_results([])) == []
+    # An entry larger than the limit is sent alone
+    big = {'case_id': 1, 'comment': 'x' * 2048}
+    assert list(chunk_results([big, entries[0]], byte_limit=1024)) == [{'results': [big]}, {'results': [entries[0]]}]
+
+
+def test_comments_truncated_once(tr_plugin):
+    traceback = 'E   AssertionError\n' * 1000 + 'last line \udc80'
+    comment = truncate_comment(traceback)
+    assert comment.startswith(vars.COMMENT_TRUNCATED_MARKER)
+    assert len(comment) == len(vars.COMMENT_TRUNCATED_MARKER) + vars.COMMENT_SIZE_LIMIT
+    assert comment.endswith('last line ?')
+    assert truncate_comment(comment) is comment
+    assert truncate_comment('short') == 'short'
+
+    entry = tr_plugin.build_result_entry({'case_id': 1, 'status_id': 5, 'defects': None, 'comment': comment})
+    assert entry['comment'].startswith('# Pytest result: #\nLog truncated\n...\n    ')
+    assert entry == tr_plugin.build_result_entry({'case_id': 1, 'status_id': 5, 'defects': None,
+                                                  'comment': traceback})
+
+
+def test_add_results_splits_rejected_payloads(api_client, tr_plugin):
+    accepted = []
+
+    def send_post(uri, data, **kwargs):
+        size = len(encode_json(data))
+        if size > 2000:
+            raise PayloadTooLarge(uri, size)
+        accepted.extend(entry['case_id'] for entry in data['results'])
+        return {}
+
+    api_client.send_post.side_effect = send_post
+    results = [tr_plugin.add_result(case_id, 1, duration=1) for case_id in range(100)]
+
+    tr_plugin._add_results(10, results)
+
+    assert accepted == list(range(100))
+    assert tr_plugin.testrail_data.chunk_bytes <= 2000
+
+    # The accepted size is reused: no request is rejected anymore
+    api_client.send_post.reset_mock()
+    tr_plugin._add_results(10, results)
+    assert all(len(encode_json(c[0][1])) <= 2000 for c in api_client.send_post.call_args_list)
+    assert accepted == list(range(100)) * 2
+
+
+def test_create_test_run_reports_rejected_payload(api_client, tr_plugin, capsys):
+    api_client.send_post.side_effect = PayloadTooLarge('add_run/1', 10 ** 6)
+
+    assert tr_plugin.create_test_run(ASSIGN_USER_ID, PROJECT_ID, SUITE_ID, False, TR_NAME, [1, 2], MILESTONE_ID) == 0
+    assert '413 Request Entity Too Large' in capsys.readouterr().out
+
+
+def test_terminal_summary_reports_retries(api_client, tr_plugin):
+    reporter = Mock()
+    api_client.retries = {}
+    tr_plugin.pytest_terminal_summary(reporter)
+    reporter.write_line.assert_not_called()
+
+    api_client.retries = {502: 2, 'ConnectTimeout': 1}
+    tr_plugin.pytest_terminal_summary(reporter)
+    reporter.write_line.assert_called_once_with('[testrail] 3 requests retried (502: 2, ConnectTimeout: 1)')
+
+
+def test_api_client_records_metrics(retrying_client):
+    retrying_client.metrics = ApiMetrics()
+    retrying_client._session.request.side_effect = [
+        _response(502), Mock(status_code=200, headers={}, content=b'{"id": 1}', json=lambda: {'id': 1})]
+    retrying_client.send_post('update_run/12', {'case_ids': [1]})
+
+    endpoint, = retrying_client.metrics.to_dict()['endpoints']
+    assert endpoint['endpoint'] == vars.UPDATE_RUN_URL
+    assert endpoint['method'] == 'POST'
+    assert endpoint['count'] == 2
+    assert endpoint['statuses'] == {'200': 1, '502': 1}
+    assert endpoint['retries'] == 1
+    assert endpoint['bytes_out'] == 2 * len(b'{"case_ids":[1]}')
+    assert endpoint['bytes_in'] == 9
+
+
+def test_metrics_outputs(tmp_path, tr_plugin):
+    assert endpoint_template('get_cases/3&suite_id=4&offset=250') == vars.GET_TESTCASES_URL
+    metrics = ApiMetrics()
+    metrics.record('GET', 'get_run/1', 200, 0.02, bytes_in=100)
+    metrics.record('GET', 'get_run/2', 'ReadTimeout', 3.0)
+    tr_plugin.testrail_data.metrics = metrics
+    tr_plugin.create_report_entries()
+
+    text = metrics.to_openmetrics()
+    labels = 'endpoint="{}",method="GET"'.format(vars.GET_TESTRUN_URL)
+    assert 'testrail_api_requests_total{{{},status="ReadTimeout"}} 1'.format(labels) in text
+    assert 'testrail_api_request_duration_seconds_bucket{{{},le="0.025"}} 1'.format(labels) in text
+    assert 'testrail_api_request_duration_seconds_bucket{{{},le="+Inf"}} 2'.format(labels) in text
+    assert 'testrail_hook_duration_seconds_total{hook="create_report_entries"}' in text
+    assert text.endswith('# EOF\n')
+
+    path = tmp_path / 'metrics.json'
+    metrics.write(str(path))
+    data = json.loads(path.read_text())
+    assert data['endpoints'][0]['count'] == 2
+    assert data['hooks']['create_report_entries']['count'] == 1
+
+
+def test_rate_limiter_shared_through_state_file(tmp_path):
+    path = str(tmp_path / 'state')
+    limiters = [RateLimiter(20, path=path), RateLimiter(20, path=path)]
+    start = time.monotonic()
+    for i in range(6):
+        limiters[i % 2].acquire()
+    # The first request takes the only token of the burst, the 5 next ones are spaced by 1/20s
+    assert time.monotonic() - start >= 0.24
+    assert limiters[0].waited > 0 and limiters[1].waited > 0
+
+
+def test_rate_limiter_state_file_not_writable(tmp_path, capsys):
+    # e.g. created by another user of the host
+    (tmp_path / 'state').mkdir()
+    limiter = RateLimiter(20, path=str(tmp_path / 'state'))
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.path is None and limiter.waited > 0
+    assert 'Rate limit not shared with other processes' in capsys.readouterr().out
+
+
+def test_rate_limit_state_file_per_user(monkeypatch):
+    monkeypatch.setattr(getpass, 'getuser', lambda: 'alice')
+    alice_path = default_state_file('https://testrail.example')
+    monkeypatch.setattr(getpass, 'getuser', lambda: 'bob')
+    assert default_state_file('https://testrail.example') != alice_path
+    assert 'bob' in os.path.basename(default_state_file('https://testrail.example'))
+
+
+def test_result_journal(tmp_path, tr_plugin):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = ResultJournal(path, session={'version': '1.0'})
+    seqs = [journal.append(10, tr_plugin.add_result(case_id, 1)) for case_id in (1, 2, 3)]
+    journal.ack(seqs[:2])
+    journal.close()
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"seq": 4, "resu')  # killed while writing
+
+    pending, last_seq = read_journal(path)
+    assert last_seq == 3
+    assert [(seq, session['version'], run_id, result['case_id']) for seq, session, run_id, result in pending] == \
+        [(3, '1.0', 10, 3)]
+
+    # Pending results are kept by the next session, which continues the sequence
+    journal = ResultJournal(path)
+    assert journal.pending == 1
+    assert journal.append(10, tr_plugin.add_result(4, 1)) == 4
+    journal.ack([3, 4])
+    journal.close()
+    assert read_journal(path)[0] == []
+
+    # A journal without pending results is truncated
+    ResultJournal(path).close()
+    assert read_journal(path) == ([], 0)
+
+
+def test_add_results_acks_accepted_results(tmp_path, api_client, tr_plugin):
+    journal = tr_plugin.testrail_data.journal = ResultJournal(str(tmp_path / 'journal.jsonl'))
+    tr_plugin.testrail_data.chunk_max_results = 2
+    results = []
+    for case_id in (1, 2, 3, 4):
+        result = tr_plugin.add_result(case_id, 1)
+        result['journal_seq'] = journal.append(10, result)
+        results.append(result)
+    api_client.send_post.side_effect = [{}, {'error': 'Unavailable'}]
+
+    tr_plugin._add_results(10, results)
+    journal.close()
+
+    assert [result['case_id'] for _, _, _, result in read_journal(journal.path)[0]] == [3, 4]
+
+
+@pytest.mark.parametrize('cfg, args, cert_check', [
+    ('', [], True),
+    ('no_ssl_cert_check = True\n', [], False),
+    ('no_ssl_cert_check = False\n', ['--tr-no-ssl-cert-check'], False),
+])
+def test_replay_command_cert_check(tmp_path, monkeypatch, cfg, args, cert_check):
+    cfg_path = tmp_path / 'testrail.cfg'
+    cfg_path.write_text('[API]\nurl = https://testrail.example\n' + cfg)
+    replays = []
+    monkeypatch.setattr('pytest_testrail.journal.replay_journal',
+                        lambda path, client, cert_check: replays.append((path, cert_check)) or 0)
+    assert replay_main(['--tr-config', str(cfg_path), 'journal.jsonl'] + args) == 0
+    assert replays == [('journal.jsonl', cert_check)]
+
+
+def test_replay_journal(tmp_path, api_client, tr_plugin):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = ResultJournal(path, session={'version': '2.0', 'custom_comment': None, 'publish_blocked': True})
+    journal.append(10, tr_plugin.add_result(1, 1, duration=2))
+    journal.append(11, tr_plugin.add_result(2, 5, comment='failed'))
+    journal.close()
+    api_client.send_post.return_value = {}
+
+    assert replay_journal(path, api_client) == 2
+    assert [c[0][0] for c in api_client.send_post.call_args_list] == [vars.ADD_RESULTS_URL.format(10),
+                                                                      vars.ADD_RESULTS_URL.format(11)]
+    assert api_client.send_post.call_args_list[0][0][1]['results'][0]['version'] == '2.0'
+
+    api_client.send_post.reset_mock()
+    assert replay_journal(path, api_client) == 0
+    api_client.send_post.assert_not_called()
+
+
+# Imported only when the plugin is enabled with --testrail
+HEAVY_MODULES = ('requests', 'urllib3', 'charset_normalizer', 'filelock', 'sqlite3', 'pytest_testrail.plugin',
+                 'pytest_testrail.testrail_actions', 'pytest_testrail.testrail_api')
+
+
+def test_entry_point_imports():
+    """ The module loaded by every pytest process does not load the client, see tests/benchmark/bench_import.py """
+    code = 'import sys, pytest; import pytest_testrail.conftest; print(" ".join(sorted(sys.modules)))'
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    loaded = set(process.stdout.split())
+
+    assert 'pytest_testrail.conftest' in loaded
+    assert [module for module in HEAVY_MODULES if module in loaded] == []